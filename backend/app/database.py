@@ -12,7 +12,10 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./apiverse.db")
 # SQLALCHEMY_DATABASE_URL = "sqlite:///./apiverse.db"
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, pool_pre_ping=True
+    SQLALCHEMY_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -24,3 +27,17 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_detached_db():
+    """Session whose loaded objects stay readable after commit.
+
+    For async handlers that commit to hand the pooled connection back before
+    awaiting provider I/O (or pass the objects to worker threads): with the
+    default expire-on-commit, the next attribute access would silently
+    re-query and re-acquire a connection.
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
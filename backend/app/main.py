@@ -1,12 +1,22 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from .database import engine, Base
-from .routers import users, subscriptions, api_services, file_search, widget
+from .database import engine
+from .migrations import prepare_database
+from .routers import users, subscriptions, api_services, file_search, widget, metrics
+from .services.file_refresher import document_refresher
+from .services.quota import quota_service
+from .services.usage_writer import usage_writer
+from .services.job_queue import job_worker
+from .services.blob_gc import blob_collector
+from .services.http_transport import http_transport
+from .passwords import password_hasher
+from .rate_limit import RateLimitMiddleware
+from .upload_limit import UploadLimitMiddleware
 import os
 
-# Create tables (for simple local dev without alembic run initially)
-Base.metadata.create_all(bind=engine)
+# Create tables and add columns/indexes introduced since the database was created
+prepare_database(engine)
 
 app = FastAPI(
     title="APIverse API",
@@ -27,6 +37,12 @@ origins = [
     "http://apiverse.smartbot.co.nz",  # HTTP version (in case)
 ]
 
+# Throttles widget/public routes before any DB or LLM work. Added before CORS
+# so that CORS (the outermost middleware) also decorates 429 responses.
+app.add_middleware(RateLimitMiddleware)
+# Oversized uploads are refused while the body is still arriving, not after it is spooled
+app.add_middleware(UploadLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Temporarily allow all origins for debugging
@@ -41,6 +57,34 @@ app.include_router(subscriptions.router)
 app.include_router(api_services.router)
 app.include_router(file_search.router)
 app.include_router(widget.router)
+app.include_router(metrics.router)
+
+# Re-upload Google AI files ahead of expiry so queries never wait on an upload
+FILE_REFRESH_ENABLED = os.getenv("FILE_REFRESH_ENABLED", "true").lower() == "true"
+
+# Outbound email/SMS/call jobs: processed in the API process by default (local
+# development); set to false and run `python run_workers.py` to scale them separately
+JOB_WORKER_IN_API = os.getenv("JOB_WORKER_IN_API", "true").lower() == "true"
+
+@app.on_event("startup")
+async def start_background_workers():
+    quota_service.start()
+    usage_writer.start()
+    if FILE_REFRESH_ENABLED and os.getenv("GOOGLE_AI_API_KEY"):
+        document_refresher.start()
+    if JOB_WORKER_IN_API:
+        job_worker.start()
+    blob_collector.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await job_worker.stop()
+    await document_refresher.stop()
+    await blob_collector.stop()
+    await quota_service.stop()
+    await usage_writer.stop()
+    password_hasher.shutdown()
+    await http_transport.close()
 
 # Mount static files for widget
 # This serves files from the widget/dist directory at /widget path
@@ -0,0 +1,57 @@
+from sqlalchemy import inspect, text
+from .database import Base
+from .services.api_keys import backfill_key_hashes
+from .services.blob_gc import backfill_blob_refs
+
+
+def prepare_database(engine):
+    """Create missing tables, bring existing ones up to date and backfill derived columns.
+
+    Runs on API and worker startup, so upgrading needs no manual ALTER TABLE
+    or CREATE INDEX; `python -m app.migrations` does the same ahead of a deploy.
+    """
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    # API keys are looked up by digest; fill it in for keys created before that
+    backfill_key_hashes(engine)
+    # Blob reference counts, for documents stored before blobs were counted
+    backfill_blob_refs(engine)
+
+
+def upgrade_schema(engine):
+    """Bring tables created by an older version up to date with the models.
+
+    `create_all` only creates missing tables, so columns and indexes added to
+    existing models are added here: new columns are created nullable and
+    filled with their scalar default, then any missing indexes are built.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            preparer = engine.dialect.identifier_preparer
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                ))
+                if column.default is not None and column.default.is_scalar:
+                    conn.execute(table.update().values({column.name: column.default.arg}))
+                print(f"Added column {table.name}.{column.name}")
+
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    print(f"Created index {index.name}")
+
+
+if __name__ == "__main__":
+    from .database import engine
+    prepare_database(engine)
+    print("✅ Database schema is up to date")
@@ -1,5 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Enum, Index, UniqueConstraint, Text
+from sqlalchemy.orm import relationship, deferred
 from .database import Base
 import datetime
 import enum
@@ -18,6 +18,8 @@ class User(Base):
     company_name = Column(String(255))
     company_url = Column(String(500), nullable=True)  # Company website URL
     is_active = Column(Boolean, default=True)
+    token_version = Column(Integer, default=1)  # Bump to revoke every issued token
+    config_version = Column(Integer, default=1)  # Bumped when anything the widget bootstrap returns changes
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     subscription = relationship("Subscription", back_populates="user", uselist=False)
@@ -42,13 +44,19 @@ class APIKey(Base):
     __tablename__ = "api_keys"
 
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String(255), unique=True, index=True)
+    key = Column(String(255), unique=True)  # Shown in the dashboard; lookups go through key_hash
+    key_hash = Column(String(64), unique=True, index=True)  # sha256 hex of key
     user_id = Column(Integer, ForeignKey("users.id"))
     label = Column(String(100)) # e.g., "Production", "Test"
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     user = relationship("User", back_populates="api_keys")
 
+    __table_args__ = (
+        # Keyset pagination of a user's keys on (created_at, id)
+        Index("ix_api_keys_user_created", "user_id", "created_at", "id"),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
 
@@ -74,6 +82,30 @@ class UsageLog(Base):
 
     user = relationship("User", back_populates="usage_logs")
 
+    __table_args__ = (
+        # Per-user history and rollup backfills read a user's logs by time
+        Index("ix_usage_logs_user_created", "user_id", "created_at"),
+    )
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    granularity = Column(String(10))  # "hour" or "day"
+    bucket_start = Column(DateTime)  # UTC start of the hour/day
+    service_type = Column(String(50))
+    status = Column(String(50))
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        # Also the index the dashboard reads: one user's buckets of one granularity by time
+        UniqueConstraint(
+            "user_id", "granularity", "bucket_start", "service_type", "status",
+            name="uq_usage_rollups_bucket"
+        ),
+    )
+
 class KnowledgeBase(Base):
     __tablename__ = "knowledge_bases"
 
@@ -82,11 +114,17 @@ class KnowledgeBase(Base):
     name = Column(String(255))
     description = Column(String(500))
     google_vector_store_id = Column(String(255))
+    content_version = Column(Integer, default=1)  # Bumped on every document upload/delete
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     user = relationship("User", back_populates="knowledge_bases")
     documents = relationship("Document", back_populates="knowledge_base")
 
+    __table_args__ = (
+        # Keyset pagination of a user's KBs on (created_at, id)
+        Index("ix_knowledge_bases_user_created", "user_id", "created_at", "id"),
+    )
+
 class Document(Base):
     __tablename__ = "documents"
 
@@ -96,13 +134,28 @@ class Document(Base):
     google_file_id = Column(String(255))
     file_size = Column(Integer)
     mime_type = Column(String(100))
-    status = Column(String(50)) # pending, processing, active, failed, expired
-    file_content = Column(String(50000), nullable=True)  # Store file content for re-upload
+    status = Column(String(50)) # pending, processing, active, refreshing, failed, expired
+    # Deferred: loaded together, only when accessed, never by list/search queries
+    file_content = deferred(Column(String(50000), nullable=True), group="content")  # Legacy base64 content, moved to the blob store by migrate_blobs.py
+    content_sha256 = Column(String(64), nullable=True, index=True)  # Blob store reference for re-upload
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    google_file_expires_at = Column(DateTime, nullable=True)  # Google files expire in 48h
+    google_file_expires_at = Column(DateTime, nullable=True, index=True)  # Google files expire in 48h
 
     knowledge_base = relationship("KnowledgeBase", back_populates="documents")
 
+    __table_args__ = (
+        # Keyset pagination of a KB's documents on (created_at, id)
+        Index("ix_documents_kb_created", "knowledge_base_id", "created_at", "id"),
+    )
+
+class Blob(Base):
+    """Reference count of a blob-store object; the row is locked while its file is added or removed"""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    ref_count = Column(Integer, default=0, nullable=False)  # Documents using it; 0 = collectable
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
 class FileSearchQuery(Base):
     __tablename__ = "file_search_queries"
 
@@ -112,3 +165,43 @@ class FileSearchQuery(Base):
     query_text = Column(String(5000)) # Long text support
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        # Quota counters are seeded from a per-user, per-period count of this table
+        Index("ix_file_search_queries_user_created", "user_id", "created_at"),
+    )
+
+class QuotaCounter(Base):
+    __tablename__ = "quota_counters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    period = Column(String(20))  # "lifetime" or "YYYY-MM"
+    used = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", name="uq_quota_counters_user_period"),
+    )
+
+class OutboundJob(Base):
+    __tablename__ = "outbound_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex, returned to the client
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    kind = Column(String(20))  # email, sms, call
+    payload = Column(Text)  # JSON arguments for the provider call
+    status = Column(String(20), default="queued")  # queued, running, succeeded, dead
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow)  # Not picked up before this
+    locked_by = Column(String(100), nullable=True)  # Worker holding the job while running
+    locked_at = Column(DateTime, nullable=True)
+    result = Column(String(500), nullable=True)  # Provider message id / sid
+    last_error = Column(String(1000), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Workers claim the oldest due jobs of a status
+        Index("ix_outbound_jobs_status_run_after", "status", "run_after"),
+    )
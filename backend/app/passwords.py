@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed in flight (running + queued) before new ones are rejected
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(PASSWORD_HASH_WORKERS, 1) * 8)))
+# Raising this rehashes existing passwords at their next login
+PBKDF2_ROUNDS = int(os.getenv("PASSWORD_PBKDF2_ROUNDS", "29000"))
+
+# bcrypt hashes (written by older versions of reset_password.py) still verify
+# and are replaced with pbkdf2_sha256 on the next successful login
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256", "bcrypt"],
+    deprecated=["bcrypt"],
+    pbkdf2_sha256__default_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=PBKDF2_ROUNDS,
+)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str):
+    try:
+        return pwd_context.verify_and_update(password, hashed_password)
+    except (ValueError, TypeError):
+        # Unknown or corrupt hash format
+        return False, None
+
+
+class PasswordHasher:
+    """Runs pbkdf2 hashing and verification in a dedicated process pool.
+
+    The hash is deliberately CPU-heavy, so it runs in processes rather than
+    threads (which would still contend for the GIL with request handling).
+    Jobs in flight are bounded by PASSWORD_HASH_MAX_PENDING; beyond that,
+    requests are shed with 503 + Retry-After instead of queueing behind a
+    login burst. The module lives outside app.services so spawned workers
+    import only passlib, not the provider SDKs.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _executor(self):
+        if self._pool is None and PASSWORD_HASH_WORKERS > 0:
+            # spawn: forking a process that already runs threads is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def _submit(self, func, *args):
+        if self.pending >= PASSWORD_HASH_MAX_PENDING:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-in requests, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            executor = self._executor()
+            if executor is None:
+                # PASSWORD_HASH_WORKERS=0: run in the shared thread pool (development, tests).
+                # Imported here so pool workers never load app.services.
+                from .services.blocking import run_blocking
+                return await run_blocking(func, *args)
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, password: str, hashed_password: str):
+        """(matches, new hash or None); a new hash means the stored one is outdated"""
+        if not hashed_password:
+            return False, None
+        valid, new_hash = await self._submit(_verify_and_update, password, hashed_password)
+        if valid and new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "pbkdf2_rounds": PBKDF2_ROUNDS,
+            "pending": self.pending,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            "completed_total": self.completed,
+            "rejected_total": self.rejected,
+            "rehashed_total": self.rehashed,
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,296 @@
+import json
+import math
+import os
+import time
+from collections import OrderedDict, namedtuple
+from .models import PlanType
+from .services.api_keys import api_key_resolver, hash_api_key
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Limiter entries kept at most (least recently used are dropped first)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Reverse proxies in front of the API; the client IP is taken from X-Forwarded-For
+# that many hops from the right. 0 trusts no header and uses the socket peer.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+# Per-key limits are multiplied by the plan of the key's owner
+RATE_LIMIT_PLAN_MULTIPLIERS = {
+    None: float(os.getenv("FREE_RATE_LIMIT_MULTIPLIER", "1")),
+    PlanType.STANDARD: float(os.getenv("STANDARD_RATE_LIMIT_MULTIPLIER", "4")),
+    PlanType.ENTERPRISE: float(os.getenv("ENTERPRISE_RATE_LIMIT_MULTIPLIER", "20")),
+    PlanType.CUSTOM: float(os.getenv("CUSTOM_RATE_LIMIT_MULTIPLIER", "50")),
+}
+
+# scope: "key" (API key; requests without one skip the rule), "ip" or "route" (all
+# callers of the route together). Limits are "<requests>/<seconds>"; each can be set
+# with RATE_LIMIT_<ROUTE>_PER_<SCOPE>, and an empty value disables the rule.
+Rule = namedtuple("Rule", ["route", "scope", "algorithm", "limit", "period"])
+
+# route -> (path prefixes, [(scope, algorithm, default limit)])
+ROUTES = {
+    "widget_search": (("/api/widget/search",), [
+        ("key", "token_bucket", "30/60"),
+        ("ip", "sliding_window", "20/60"),
+        ("route", "sliding_window", "6000/60"),
+    ]),
+    "widget_config": (("/api/widget/bootstrap/", "/api/widget/config/"), [
+        ("key", "token_bucket", "600/60"),
+        ("ip", "sliding_window", "120/60"),
+    ]),
+    "services": (("/api/v1/",), [
+        ("key", "token_bucket", "120/60"),
+        ("ip", "sliding_window", "120/60"),
+    ]),
+    "login": (("/users/login",), [
+        ("ip", "sliding_window", "20/300"),
+    ]),
+}
+
+
+def _load_rules() -> dict:
+    rules = {}
+    for route, (prefixes, specs) in ROUTES.items():
+        active = []
+        for scope, algorithm, default in specs:
+            spec = os.getenv(f"RATE_LIMIT_{route.upper()}_PER_{scope.upper()}", default).strip()
+            if spec:
+                limit, period = spec.split("/")
+                active.append(Rule(route, scope, algorithm, int(limit), float(period)))
+        rules[route] = (prefixes, active)
+    return rules
+
+
+Decision = namedtuple("Decision", ["allowed", "limit", "remaining", "reset", "retry_after"])
+
+
+class MemoryRateLimitBackend:
+    """Limiter state in this process: one small list per (rule, identity).
+
+    Token buckets keep [tokens, updated]; sliding windows keep [window
+    start, current count, previous count] and weight the previous window by
+    its overlap, so both need O(1) memory per active key however many
+    requests it makes. Entries live in an LRU bounded by RATE_LIMIT_MAX_KEYS.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._state = OrderedDict()  # (route, scope, identity) -> state list
+
+    def _get(self, key, default):
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = default
+            while len(self._state) > self.max_keys:
+                self._state.popitem(last=False)
+        else:
+            self._state.move_to_end(key)
+        return state
+
+    def check(self, key, rule: Rule, limit: float, now: float):
+        """(Decision, commit) for one request; call commit() only once every rule allowed it"""
+        if rule.algorithm == "token_bucket":
+            return self._token_bucket(key, rule, limit, now)
+        return self._sliding_window(key, rule, limit, now)
+
+    def _token_bucket(self, key, rule: Rule, capacity: float, now: float):
+        state = self._get(key, [capacity, now])
+        rate = capacity / rule.period
+        tokens = min(capacity, state[0] + (now - state[1]) * rate)
+        reset = (capacity - tokens) / rate
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+            return Decision(False, capacity, 0, reset, wait), None
+
+        def commit():
+            state[0] = tokens - 1
+            state[1] = now
+
+        return Decision(True, capacity, int(tokens - 1), reset + 1 / rate, 0.0), commit
+
+    def _sliding_window(self, key, rule: Rule, limit: float, now: float):
+        period = rule.period
+        state = self._get(key, [now - now % period, 0, 0])
+        start, current, previous = state
+        if now - start >= period:
+            # Roll forward; a gap of two or more windows leaves nothing to carry over
+            previous = current if now - start < 2 * period else 0
+            current = 0
+            start = now - now % period
+        elapsed = now - start
+        weight = 1 - elapsed / period
+        used = previous * weight + current
+        reset = period - elapsed
+        if used + 1 > limit:
+            if previous and current + 1 <= limit:
+                wait = period * (1 - (limit - 1 - current) / previous) - elapsed
+            else:
+                # Wait for the next window, where this one's count decays in its place
+                wait = reset + (period * (1 - (limit - 1) / current) if current >= limit else 0)
+            return Decision(False, limit, 0, reset, max(wait, 0.0)), None
+
+        def commit():
+            state[0] = start
+            state[1] = current + 1
+            state[2] = previous
+
+        return Decision(True, limit, int(limit - used - 1), reset, 0.0), commit
+
+    def __len__(self):
+        return len(self._state)
+
+
+_BACKENDS = {
+    "memory": MemoryRateLimitBackend,
+}
+
+
+def get_rate_limit_backend():
+    try:
+        return _BACKENDS[RATE_LIMIT_BACKEND]()
+    except KeyError:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+
+
+class RateLimiter:
+    """Applies every rule of the matched route; a request passes only if all allow it"""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else get_rate_limit_backend()
+        self.rules = _load_rules()
+        self.allowed = {}
+        self.rejected = {}
+
+    def match(self, path: str):
+        for route, (prefixes, rules) in self.rules.items():
+            if rules and path.startswith(prefixes):
+                return route, rules
+        return None, None
+
+    def check(self, route: str, rules: list, key_hash: str, ip: str, now: float = None):
+        """The most restrictive Decision across the route's rules"""
+        now = time.monotonic() if now is None else now
+        principal = api_key_resolver.peek(key_hash) if key_hash else None
+        # Keys not yet resolved in this process (or unknown) get the free plan's limits
+        multiplier = RATE_LIMIT_PLAN_MULTIPLIERS.get(principal.plan if principal else None, 1.0)
+        decisions = []
+        commits = []
+        for rule in rules:
+            if rule.scope == "key":
+                if not key_hash:
+                    continue
+                identity, limit = key_hash, rule.limit * multiplier
+            elif rule.scope == "ip":
+                identity, limit = ip, rule.limit
+            else:
+                identity, limit = "", rule.limit
+            decision, commit = self.backend.check((route, rule.scope, identity), rule, limit, now)
+            decisions.append(decision)
+            commits.append(commit)
+        if not decisions:
+            return None
+        denied = [d for d in decisions if not d.allowed]
+        if denied:
+            self.rejected[route] = self.rejected.get(route, 0) + 1
+            return max(denied, key=lambda d: d.retry_after)
+        for commit in commits:
+            commit()
+        self.allowed[route] = self.allowed.get(route, 0) + 1
+        return min(decisions, key=lambda d: d.remaining)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "backend": RATE_LIMIT_BACKEND,
+            "tracked_keys": len(self.backend),
+            "allowed_total": dict(self.allowed),
+            "rejected_total": dict(self.rejected),
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+def _rate_limit_headers(decision: Decision) -> list:
+    headers = [
+        (b"x-ratelimit-limit", str(int(decision.limit)).encode()),
+        (b"x-ratelimit-remaining", str(max(decision.remaining, 0)).encode()),
+        (b"x-ratelimit-reset", str(math.ceil(decision.reset)).encode()),
+    ]
+    if not decision.allowed:
+        headers.append((b"retry-after", str(max(math.ceil(decision.retry_after), 1)).encode()))
+    return headers
+
+
+_untrusted_forwarding_warned = False
+
+
+def _client_ip(scope) -> str:
+    global _untrusted_forwarding_warned
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            if RATE_LIMIT_TRUSTED_PROXIES:
+                hops = [h.strip() for h in value.decode("latin-1").split(",") if h.strip()]
+                if hops:
+                    return hops[-min(RATE_LIMIT_TRUSTED_PROXIES, len(hops))]
+            elif not _untrusted_forwarding_warned:
+                _untrusted_forwarding_warned = True
+                print(
+                    "WARNING: requests carry X-Forwarded-For but RATE_LIMIT_TRUSTED_PROXIES=0, so per-IP "
+                    "rate limits apply to the proxy's address and every client shares them. Set it to "
+                    "the number of reverse proxies in front of the API."
+                )
+            break
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+def _api_key(scope, path: str):
+    for name, value in scope["headers"]:
+        if name == b"x-api-key":
+            return value.decode("latin-1")
+    if path.startswith(("/api/widget/bootstrap/", "/api/widget/config/")):
+        return path.rstrip("/").rsplit("/", 1)[-1]
+    return None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware throttling requests before routing, so rejected requests
+    cost no DB query, LLM call or body parsing. Adds X-RateLimit-* headers to
+    limited routes and answers 429 with Retry-After when a rule is exhausted.
+    """
+
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMIT_ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        route, rules = self.limiter.match(path)
+        if route is None:
+            return await self.app(scope, receive, send)
+
+        key = _api_key(scope, path)
+        decision = self.limiter.check(route, rules, hash_api_key(key) if key else None, _client_ip(scope))
+        if decision is None:
+            return await self.app(scope, receive, send)
+        headers = _rate_limit_headers(decision)
+
+        if not decision.allowed:
+            body = json.dumps({"detail": "Rate limit exceeded, please retry later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers,
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -1,21 +1,74 @@
-from fastapi import APIRouter, Depends, HTTPException
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from ..services import email_service, twilio_service, chatbot_service, payment_service
+from sqlalchemy.orm import Session
+from typing import Annotated, Optional, List, Dict
+from ..database import SessionLocal
+from ..services import chatbot_service, payment_service
+from ..services.usage_writer import usage_writer
+from ..services.api_keys import api_key_resolver
+from ..services.chatbot import ChatbotError
+from ..services.bulk_email import bulk_email_sender, BULK_EMAIL_MAX_RECIPIENTS
+from ..services.bulk_sms import bulk_sms_sender, ndjson, BULK_SMS_MAX_MESSAGES
+from ..services.job_queue import enqueue
+from ..services.sse import sse_engine
+from ..models import OutboundJob
 
 router = APIRouter(
     prefix="/api/v1",
     tags=["services"]
 )
 
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_usage_user_id(
+    x_api_key: Annotated[Optional[str], Header()] = None,
+    db: Session = Depends(get_db)
+) -> Optional[int]:
+    """Usage is attributed to the owner of the API key when one is sent"""
+    if not x_api_key:
+        return None
+    principal = api_key_resolver.resolve(db, x_api_key)
+    if not principal:
+        raise HTTPException(status_code=403, detail="Invalid API Key")
+    return principal.user_id
+
+usage_user_dependency = Annotated[Optional[int], Depends(get_usage_user_id)]
+
 class EmailRequest(BaseModel):
     to_email: str
     subject: str
     content: str
 
+class BulkEmailRecipient(BaseModel):
+    email: str
+    name: Optional[str] = None
+    substitutions: Dict[str, str] = {}  # {"first_name": "Ada"} fills {{first_name}}
+
+class BulkEmailRequest(BaseModel):
+    subject: str
+    content: str
+    recipients: List[BulkEmailRecipient]
+
 class SMSRequest(BaseModel):
     to_number: str
     body: str
 
+class BulkSMSMessage(BaseModel):
+    to_number: str
+    body: Optional[str] = None  # Defaults to the request's body
+
+class BulkSMSRequest(BaseModel):
+    body: Optional[str] = None
+    to_numbers: List[str] = []  # Same body to each number...
+    messages: List[BulkSMSMessage] = []  # ...and/or individual messages
+
 class PhoneCallRequest(BaseModel):
     to_number: str
     url: str = "http://demo.twilio.com/docs/voice.xml"
@@ -30,43 +83,123 @@ class PaymentRequest(BaseModel):
     plan_name: str = None
     interval: str = "month"
 
-@router.post("/email/send")
-async def send_email(request: EmailRequest):
-    success, message = email_service.send_email(request.to_email, request.subject, request.content)
-    if not success:
-        # Return 400 Bad Request with the specific error message from the service
-        raise HTTPException(status_code=400, detail=f"Failed to send email: {message}")
-    return {"status": "sent", "message": message}
-
-@router.post("/sms/send")
-async def send_sms(request: SMSRequest):
-    sid, message = twilio_service.send_sms(request.to_number, request.body)
-    if not sid:
-        raise HTTPException(status_code=400, detail=f"Failed to send SMS: {message}")
-    return {"status": "sent", "sid": sid, "message": message}
-
-@router.post("/phone/call")
-async def make_phone_call(request: PhoneCallRequest):
-    sid, message = twilio_service.make_call(request.to_number, request.url)
-    if not sid:
-        raise HTTPException(status_code=400, detail=f"Failed to initiate call: {message}")
-    return {"status": "initiated", "sid": sid, "message": message}
+def _job_response(job: OutboundJob) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": job.result,
+        "last_error": job.last_error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+# Email, SMS and calls are queued and sent by the job workers (see run_workers.py);
+# poll GET /jobs/{job_id} for the outcome. Usage is recorded when the job finishes.
+@router.post("/email/send", status_code=202)
+def send_email(request: EmailRequest, user_id: usage_user_dependency, db: Session = Depends(get_db)):
+    job = enqueue(db, "email", request.model_dump(), user_id)
+    return _job_response(job)
+
+@router.post("/email/send-bulk")
+async def send_bulk_email(request: BulkEmailRequest, user_id: usage_user_dependency):
+    """Send one message to many recipients; results are reported per recipient"""
+    if not request.recipients:
+        raise HTTPException(status_code=400, detail="No recipients")
+    if len(request.recipients) > BULK_EMAIL_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_EMAIL_MAX_RECIPIENTS} recipients per request")
+    
+    result = await bulk_email_sender.send(
+        request.subject, request.content, [r.model_dump() for r in request.recipients]
+    )
+    for r in result["results"]:
+        await usage_writer.record_usage(user_id, "email", "success" if r["status"] == "accepted" else "failed", r["email"])
+    return result
+
+@router.post("/sms/send", status_code=202)
+def send_sms(request: SMSRequest, user_id: usage_user_dependency, db: Session = Depends(get_db)):
+    job = enqueue(db, "sms", request.model_dump(), user_id)
+    return _job_response(job)
+
+@router.post("/sms/send-bulk")
+async def send_bulk_sms(request: BulkSMSRequest, user_id: usage_user_dependency):
+    """Send many SMS at the configured sender rate, streaming one NDJSON result line per
+    message as it completes (with its index in the request) and a final summary line"""
+    messages = [(number, request.body) for number in request.to_numbers]
+    messages += [(m.to_number, m.body or request.body) for m in request.messages]
+    if not messages:
+        raise HTTPException(status_code=400, detail="No messages")
+    if len(messages) > BULK_SMS_MAX_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_SMS_MAX_MESSAGES} messages per request")
+    if any(not body for _, body in messages):
+        raise HTTPException(status_code=400, detail="Every message needs a body")
+
+    async def results():
+        async for item in bulk_sms_sender.stream(messages):
+            if "summary" not in item:
+                await usage_writer.record_usage(
+                    user_id, "sms", "success" if item["status"] == "sent" else "failed",
+                    f"{item['to_number']} {item.get('sid') or ''}"
+                )
+            yield ndjson(item)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@router.post("/phone/call", status_code=202)
+def make_phone_call(request: PhoneCallRequest, user_id: usage_user_dependency, db: Session = Depends(get_db)):
+    job = enqueue(db, "call", request.model_dump(), user_id)
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, user_id: usage_user_dependency, db: Session = Depends(get_db)):
+    """Status of a queued email/SMS/call; jobs created with an API key need the same key's owner"""
+    job = db.get(OutboundJob, job_id)
+    if not job or (job.user_id is not None and job.user_id != user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
 
 @router.post("/chat/thread")
 async def create_chat_thread():
-    thread_id = chatbot_service.create_thread()
+    thread_id = await chatbot_service.create_thread()
     if not thread_id:
         raise HTTPException(status_code=500, detail="Failed to create thread")
     return {"thread_id": thread_id}
 
 @router.post("/chat/message")
-async def chat_message(request: ChatRequest):
-    if not request.thread_id:
-        # Create a new thread if not provided
-        request.thread_id = chatbot_service.create_thread()
-    
-    response = chatbot_service.send_message(request.thread_id, request.message)
-    return {"response": response, "thread_id": request.thread_id}
+async def chat_message(request: ChatRequest, user_id: usage_user_dependency):
+    # Without a thread_id, the thread is created by the same request that runs the assistant;
+    # send the returned thread_id on follow-up messages
+    response, thread_id = await chatbot_service.send_message(request.thread_id, request.message)
+    await usage_writer.record_usage(user_id, "chatbot", "success" if thread_id else "failed", f"thread: {thread_id}")
+    return {"response": response, "thread_id": thread_id}
+
+@router.post("/chat/message/stream")
+async def chat_message_stream(
+    request: ChatRequest,
+    user_id: usage_user_dependency,
+    last_event_id: Annotated[Optional[str], Header()] = None
+):
+    """Server-Sent Events: `accepted`, {"thread_id"}, then {"text"} chunks, then {"done": true}"""
+    async def events():
+        thread_id = request.thread_id
+        status = "failed"
+        try:
+            async for kind, value in chatbot_service.stream_reply(thread_id, request.message):
+                if kind == "thread":
+                    thread_id = value
+                    yield {"thread_id": thread_id}
+                else:
+                    yield value
+            status = "success"
+            yield {"done": True, "thread_id": thread_id}
+        except (ChatbotError, httpx.HTTPError) as e:
+            print(f"Error in chatbot stream: {e}")
+            yield {"error": "Sorry, I encountered an error."}
+        finally:
+            await usage_writer.record_usage(user_id, "chatbot", status, f"thread: {thread_id}")
+
+    return sse_engine.response(events, owner=user_id, last_event_id=last_event_id)
 
 @router.post("/payment/create-session")
 async def create_payment_session(request: PaymentRequest):
@@ -75,7 +208,7 @@ async def create_payment_session(request: PaymentRequest):
     # For this demo, we'll use a mock email or pass it in.
     
     # Use dynamic amount from request (defaulting to $10.00 if passed as 1000 cents)
-    session = payment_service.create_checkout_session(
+    session = await payment_service.create_checkout_session(
         customer_email="user@example.com",
         amount=request.amount,
         currency=request.currency,
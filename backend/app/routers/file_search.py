@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from typing import List, Annotated
-from ..database import SessionLocal
-from ..models import User
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
+from sqlalchemy.orm import Session, selectinload, load_only, noload
+from typing import List, Annotated, Optional
+from ..database import SessionLocal, get_detached_db
+from ..models import KnowledgeBase as KnowledgeBaseModel, Document as DocumentModel
 from ..schemas import (
     KnowledgeBase, KnowledgeBaseCreate, 
     Document, 
     FileSearchRequest, FileSearchResponse, SearchResult
 )
 from ..services.file_search import file_search_service
-from ..routers.users import get_current_user # Assuming auth is here
+from ..services.quota import quota_service
+from ..services.pagination import paginate
+from ..routers.users import get_current_principal
+from ..services.auth_cache import UserPrincipal
 
 router = APIRouter(
     prefix="/api/file-search",
@@ -25,7 +28,15 @@ def get_db():
         db.close()
 
 db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[User, Depends(get_current_user)]
+# Upload and search commit before awaiting Google AI and keep using what they loaded
+search_db_dependency = Annotated[Session, Depends(get_detached_db)]
+user_dependency = Annotated[UserPrincipal, Depends(get_current_principal)]
+
+# Only the columns the Document response shows
+DOCUMENT_LIST_COLUMNS = (
+    DocumentModel.id, DocumentModel.filename, DocumentModel.file_size, DocumentModel.mime_type,
+    DocumentModel.google_file_id, DocumentModel.status, DocumentModel.created_at
+)
 
 @router.post("/knowledge-bases", response_model=KnowledgeBase)
 def create_knowledge_base(
@@ -43,15 +54,65 @@ def create_knowledge_base(
 @router.get("/knowledge-bases", response_model=List[KnowledgeBase])
 def list_knowledge_bases(
     current_user: user_dependency,
-    db: db_dependency
+    db: db_dependency,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    include_documents: bool = True
+):
+    """KBs, oldest first: all of them, or one page when `limit` or `cursor` is
+    given (the next page's cursor is then in X-Next-Cursor).
+
+    With include_documents=false, `documents` is left empty: page through
+    them with GET /knowledge-bases/{kb_id}/documents instead.
+    """
+    query = db.query(KnowledgeBaseModel).filter(KnowledgeBaseModel.user_id == current_user.id)
+    if name_prefix:
+        query = query.filter(KnowledgeBaseModel.name.startswith(name_prefix, autoescape=True))
+    if include_documents:
+        # One more statement for the documents of every KB on the page
+        query = query.options(selectinload(KnowledgeBaseModel.documents).load_only(*DOCUMENT_LIST_COLUMNS))
+    else:
+        query = query.options(noload(KnowledgeBaseModel.documents))
+    return paginate(query, KnowledgeBaseModel, response, limit, cursor)
+
+@router.get("/knowledge-bases/{kb_id}/documents", response_model=List[Document])
+def list_documents(
+    kb_id: int,
+    current_user: user_dependency,
+    db: db_dependency,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    name_prefix: Optional[str] = None
 ):
-    return current_user.knowledge_bases
+    """A KB's documents, oldest first: all of them, or one page when `limit` or `cursor` is given"""
+    kb_exists = db.query(KnowledgeBaseModel.id).filter(
+        KnowledgeBaseModel.id == kb_id,
+        KnowledgeBaseModel.user_id == current_user.id
+    ).first()
+    if not kb_exists:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+
+    query = db.query(DocumentModel).options(load_only(*DOCUMENT_LIST_COLUMNS)).filter(
+        DocumentModel.knowledge_base_id == kb_id
+    )
+    if status:
+        query = query.filter(DocumentModel.status == status)
+    if mime_type:
+        query = query.filter(DocumentModel.mime_type == mime_type)
+    if name_prefix:
+        query = query.filter(DocumentModel.filename.startswith(name_prefix, autoescape=True))
+    return paginate(query, DocumentModel, response, limit, cursor)
 
 @router.post("/knowledge-bases/{kb_id}/documents", response_model=Document)
 async def upload_document(
     kb_id: int,
     current_user: user_dependency,
-    db: db_dependency,
+    db: search_db_dependency,
     file: UploadFile = File(...)
 ):
     try:
@@ -75,19 +136,19 @@ def delete_document(
     return file_search_service.delete_document(db, current_user.id, kb_id, doc_id)
 
 @router.post("/query", response_model=FileSearchResponse)
-def search_documents(
+async def search_documents(
     request: FileSearchRequest,
     current_user: user_dependency,
-    db: db_dependency
+    db: search_db_dependency
 ):
-    results = file_search_service.search(
+    results = await file_search_service.search(
         db,
         current_user.id,
         request.knowledge_base_id,
         request.query
     )
     
-    remaining = file_search_service.check_quota(db, current_user.id)
+    remaining = quota_service.remaining(db, current_user.id)
     
     return FileSearchResponse(
         results=results,
@@ -99,6 +160,5 @@ def get_quota(
     current_user: user_dependency,
     db: db_dependency
 ):
-    used = file_search_service.get_quota_usage(db, current_user.id)
-    limit = 100 # Should trigger from env or constant
+    used, limit = quota_service.usage(db, current_user.id)
     return {"used": used, "limit": limit, "remaining": limit - used}
@@ -0,0 +1,50 @@
+from fastapi import APIRouter
+from ..services.file_registry import file_handle_registry
+from ..services.file_refresher import document_refresher
+from ..services.answer_cache import answer_cache
+from ..services.retrieval import retrieval_index
+from ..services.quota import quota_service
+from ..services.usage_writer import usage_writer
+from ..services.api_keys import api_key_resolver
+from ..services.auth_cache import principal_cache
+from ..passwords import password_hasher
+from ..rate_limit import rate_limiter
+from ..services.widget_config import widget_config_cache
+from ..services.bulk_email import bulk_email_sender
+from ..services.bulk_sms import bulk_sms_sender
+from ..services.job_queue import job_worker
+from ..services.http_transport import http_transport
+from ..services.generation import context_cache
+from ..services.coalescer import query_coalescer
+from ..services.sse import sse_engine
+from ..services.blob_gc import blob_collector
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"]
+)
+
+@router.get("")
+def get_metrics():
+    """In-process counters for background workers and caches"""
+    return {
+        "file_refresher": document_refresher.stats(),
+        "file_handles": file_handle_registry.stats(),
+        "blob_gc": blob_collector.stats(),
+        "answer_cache": answer_cache.stats(),
+        "retrieval": retrieval_index.stats(),
+        "quota": quota_service.stats(),
+        "usage_writer": usage_writer.stats(),
+        "api_keys": api_key_resolver.stats(),
+        "auth": principal_cache.stats(),
+        "passwords": password_hasher.stats(),
+        "widget_config": widget_config_cache.stats(),
+        "bulk_email": bulk_email_sender.stats(),
+        "bulk_sms": bulk_sms_sender.stats(),
+        "jobs": job_worker.stats(),
+        "http": http_transport.stats(),
+        "context_cache": context_cache.stats(),
+        "coalescer": query_coalescer.stats(),
+        "sse": sse_engine.stats(),
+        "rate_limit": rate_limiter.stats(),
+    }
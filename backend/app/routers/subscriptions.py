@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from .. import models, schemas, database
+from ..services.quota import quota_service
+from ..services.api_keys import api_key_resolver
 
 router = APIRouter(
     prefix="/subscriptions",
@@ -9,7 +11,9 @@ router = APIRouter(
 
 @router.post("/{user_id}", response_model=schemas.Subscription)
 def create_subscription(user_id: int, sub: schemas.SubscriptionCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = db.query(models.User).options(
+        joinedload(models.User.subscription)
+    ).filter(models.User.id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -19,10 +23,14 @@ def create_subscription(user_id: int, sub: schemas.SubscriptionCreate, db: Sessi
         db_user.subscription.plan_type = sub.plan_type
         db.commit()
         db.refresh(db_user.subscription)
+        quota_service.invalidate_plan(user_id)
+        api_key_resolver.invalidate_user(user_id)
         return db_user.subscription
     
     new_sub = models.Subscription(user_id=user_id, plan_type=sub.plan_type)
     db.add(new_sub)
     db.commit()
     db.refresh(new_sub)
+    quota_service.invalidate_plan(user_id)
+    api_key_resolver.invalidate_user(user_id)
     return new_sub
@@ -1,30 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.orm import Session, joinedload, selectinload
 from .. import models, schemas, database
-from passlib.context import CryptContext
-from typing import List
-import secrets
+from typing import List, Optional
 import os
 from datetime import datetime, timedelta
 from jose import jwt
+from ..services.api_keys import api_key_resolver, generate_api_key, hash_api_key
+from ..services.auth_cache import principal_cache, UserPrincipal
+from ..services.pagination import paginate
+from ..services.usage_rollups import usage_series
+from ..passwords import password_hasher
 
 router = APIRouter(
     prefix="/users",
     tags=["users"]
 )
 
-# Use pbkdf2_sha256 which is pure python and doesn't have C-extension version conflicts
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "AICLOUD0610")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -32,75 +27,111 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 from fastapi.security import OAuth2PasswordBearer
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    # A fresh instance per raise: a shared one would keep every failed request's frames in its traceback
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> UserPrincipal:
+    """Authenticate from the token claims and the principal cache, without loading the ORM User"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except jwt.JWTError:
-        raise credentials_exception
-        
-    user = db.query(models.User).filter(models.User.email == email).first()
+        user_id = int(payload["sub"])
+        version = payload.get("ver", 1)
+    except (jwt.JWTError, KeyError, ValueError):
+        raise credentials_exception()
+
+    principal = principal_cache.get(db, user_id)
+    if principal is None or not principal.is_active or principal.token_version != version:
+        raise credentials_exception()
+    return principal
+
+def get_current_user(principal: UserPrincipal = Depends(get_current_principal), db: Session = Depends(database.get_db)):
+    """The ORM User, for handlers that read relationships or modify the user"""
+    user = db.get(models.User, principal.id)
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
     return user
 
+def load_user_profile(db: Session, user_id: int):
+    """User with subscription (joined) and API keys (one extra SELECT), as `schemas.User` renders it"""
+    return db.query(models.User).options(
+        joinedload(models.User.subscription),
+        selectinload(models.User.api_keys)
+    ).filter(models.User.id == user_id).first()
+
 @router.post("/login")
-def login(user_credentials: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def login(user_credentials: schemas.UserCreate, db: Session = Depends(database.get_detached_db)):
     user = db.query(models.User).filter(models.User.email == user_credentials.email).first()
+    # Hand the connection back while the hash is checked in the worker pool
+    db.commit()
     if not user:
         raise HTTPException(status_code=403, detail="Invalid credentials")
     
-    if not verify_password(user_credentials.password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify(user_credentials.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=403, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash uses a deprecated scheme or too few rounds
+        user.hashed_password = new_hash
+        db.commit()
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": str(user.id), "ver": user.token_version or 1}, expires_delta=access_token_expires
     )
     
     return {"token": access_token, "user": user}
 
 @router.post("/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
     db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db.commit()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = models.User(email=user.email, hashed_password=hashed_password, company_name=user.company_name)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     
     # Create a default API key for the user
-    api_key = models.APIKey(key=f"sk_{secrets.token_hex(16)}", user_id=db_user.id, label="Default Key")
+    key = generate_api_key()
+    api_key = models.APIKey(key=key, key_hash=hash_api_key(key), user_id=db_user.id, label="Default Key")
     db.add(api_key)
     db.commit()
     
-    return db_user
+    return load_user_profile(db, db_user.id)
 
 @router.get("/me", response_model=schemas.User)
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
+def get_current_user_info(current_user: UserPrincipal = Depends(get_current_principal), db: Session = Depends(database.get_db)):
     """Get current logged-in user's information including API keys"""
-    return current_user
+    return load_user_profile(db, current_user.id)
+
+@router.get("/me/usage", response_model=schemas.UsageSeries)
+def get_usage(
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    service_type: Optional[str] = None,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    """Usage time-series (hour or day buckets, UTC) served from the usage rollups"""
+    return usage_series(db, current_user.id, granularity, start, end, service_type)
 
 @router.get("/{user_id}", response_model=schemas.User)
 def read_user(user_id: int, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = load_user_profile(db, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -116,33 +147,44 @@ def update_current_user(
         current_user.company_name = user_update.company_name
     if user_update.company_url is not None:
         current_user.company_url = user_update.company_url
+    current_user.config_version = (current_user.config_version or 1) + 1
     
     db.commit()
-    db.refresh(current_user)
-    return current_user
+    api_key_resolver.invalidate_user(current_user.id)
+    principal_cache.invalidate(current_user.id)
+    return load_user_profile(db, current_user.id)
 
 # API Keys Management
 @router.get("/me/api-keys", response_model=List[schemas.APIKey])
-def get_api_keys(current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
-    """Get all API keys for current user"""
-    api_keys = db.query(models.APIKey).filter(models.APIKey.user_id == current_user.id).all()
-    return api_keys
+def get_api_keys(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    """Get API keys for current user: all, or one page when `limit` or `cursor` is given (next cursor in X-Next-Cursor)"""
+    query = db.query(models.APIKey).filter(models.APIKey.user_id == current_user.id)
+    return paginate(query, models.APIKey, response, limit, cursor)
 
 @router.post("/me/api-keys", response_model=schemas.APIKey)
-def create_api_key(key_data: schemas.APIKeyCreate, current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
+def create_api_key(key_data: schemas.APIKeyCreate, current_user: UserPrincipal = Depends(get_current_principal), db: Session = Depends(database.get_db)):
     """Create a new API key for current user"""
+    key = generate_api_key()
     new_key = models.APIKey(
-        key=f"sk_{secrets.token_hex(16)}",
+        key=key,
+        key_hash=hash_api_key(key),
         user_id=current_user.id,
         label=key_data.label
     )
     db.add(new_key)
     db.commit()
     db.refresh(new_key)
+    api_key_resolver.invalidate_key(key)
     return new_key
 
 @router.delete("/me/api-keys/{key_id}")
-def delete_api_key(key_id: int, current_user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
+def delete_api_key(key_id: int, current_user: UserPrincipal = Depends(get_current_principal), db: Session = Depends(database.get_db)):
     """Delete an API key"""
     api_key = db.query(models.APIKey).filter(
         models.APIKey.id == key_id,
@@ -154,5 +196,6 @@ def delete_api_key(key_id: int, current_user: models.User = Depends(get_current_
     
     db.delete(api_key)
     db.commit()
+    api_key_resolver.invalidate_key(api_key.key)
     return {"message": "API key deleted successfully"}
 
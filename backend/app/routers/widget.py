@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Header
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import Annotated, Optional
-import json
-from ..database import SessionLocal
-from ..models import APIKey, User, KnowledgeBase
+from ..database import SessionLocal, get_detached_db
 from ..schemas import FileSearchResponse, SearchResult
 from ..services.file_search import file_search_service
+from ..services.quota import quota_service
+from ..services.api_keys import api_key_resolver, APIKeyPrincipal, hash_api_key
+from ..services.widget_config import widget_config_cache, etag_matches
+from ..services.sse import sse_engine
 from pydantic import BaseModel
 
 router = APIRouter(
@@ -22,6 +24,8 @@ def get_db():
         db.close()
 
 db_dependency = Annotated[Session, Depends(get_db)]
+# Search commits before awaiting the model and keeps using the KB and documents it loaded
+search_db_dependency = Annotated[Session, Depends(get_detached_db)]
 
 class WidgetSearchRequest(BaseModel):
     query: str
@@ -30,79 +34,80 @@ class WidgetSearchRequest(BaseModel):
 async def verify_api_key(
     x_api_key: Annotated[str, Header()] = None,
     db: Session = Depends(get_db)
-) -> User:
+) -> APIKeyPrincipal:
     if not x_api_key:
         raise HTTPException(status_code=403, detail="API Key header missing")
     
-    key_record = db.query(APIKey).filter(APIKey.key == x_api_key).first()
-    if not key_record:
+    principal = api_key_resolver.resolve(db, x_api_key)
+    if not principal:
         raise HTTPException(status_code=403, detail="Invalid API Key")
-        
-    return key_record.user
+    return principal
+
+principal_dependency = Annotated[APIKeyPrincipal, Depends(verify_api_key)]
+
+def resolve_knowledge_base(request: WidgetSearchRequest, principal: APIKeyPrincipal) -> int:
+    """The requested KB if the key owner has it, else their default KB"""
+    if not request.knowledge_base_id:
+        if not principal.default_knowledge_base_id:
+            raise HTTPException(status_code=400, detail="No knowledge base specified or found")
+        return principal.default_knowledge_base_id
+    if request.knowledge_base_id not in principal.knowledge_base_ids:
+        raise HTTPException(status_code=404, detail="Knowledge base not accessible")
+    return request.knowledge_base_id
+
+@router.get("/bootstrap/{api_key}")
+def get_widget_bootstrap(
+    api_key: str,
+    db: db_dependency,
+    if_none_match: Annotated[Optional[str], Header()] = None
+):
+    """
+    Everything the widget needs on page load: settings, theme and default knowledge base.
+    Served from memory with a strong ETag; clients and CDNs revalidate with If-None-Match.
+    """
+    principal = api_key_resolver.resolve(db, api_key)
+    if not principal:
+        raise HTTPException(status_code=404, detail="Invalid API Key")
+
+    etag, body = widget_config_cache.get(hash_api_key(api_key), principal)
+    headers = {"ETag": etag, "Cache-Control": widget_config_cache.cache_control}
+    if etag_matches(if_none_match, etag):
+        widget_config_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/config/{api_key}")
 def get_widget_config(
     api_key: str,
-    db: db_dependency
+    db: db_dependency,
+    if_none_match: Annotated[Optional[str], Header()] = None
 ):
     """
     Get configuration for the widget based on API Key.
-    Returns the user's preferred settings and available knowledge bases.
+    Kept for widgets built before /bootstrap; returns the same cacheable payload.
     """
-    key_record = db.query(APIKey).filter(APIKey.key == api_key).first()
-    if not key_record:
-        raise HTTPException(status_code=404, detail="Invalid API Key")
-        
-    user = key_record.user
-    
-    # Get first knowledge base as default if not specified
-    kb = db.query(KnowledgeBase).filter(KnowledgeBase.user_id == user.id).first()
-    kb_id = kb.id if kb else None
-    
-    return {
-        "valid": True,
-        "company_name": user.company_name,
-        "company_url": user.company_url or "https://web.smartbot.co.nz",
-        "default_knowledge_base_id": kb_id,
-        "theme": {
-            "primaryColor": "#6366f1", # Default Indigo
-            "position": "bottom-right"
-        }
-    }
+    return get_widget_bootstrap(api_key, db, if_none_match)
 
 @router.post("/search", response_model=FileSearchResponse)
-def widget_search(
+async def widget_search(
     request: WidgetSearchRequest,
-    user: Annotated[User, Depends(verify_api_key)],
-    db: db_dependency
+    principal: principal_dependency,
+    db: search_db_dependency
 ):
     """
     Public search endpoint for the widget.
     Usage is charged to the owner of the API Key.
     """
-    if not request.knowledge_base_id:
-        # Try to find a default KB
-        kb = db.query(KnowledgeBase).filter(KnowledgeBase.user_id == user.id).first()
-        if not kb:
-            raise HTTPException(status_code=400, detail="No knowledge base specified or found")
-        request.knowledge_base_id = kb.id
-    else:
-        # Verify KB belongs to user
-        kb = db.query(KnowledgeBase).filter(
-            KnowledgeBase.id == request.knowledge_base_id,
-            KnowledgeBase.user_id == user.id
-        ).first()
-        if not kb:
-            raise HTTPException(status_code=404, detail="Knowledge base not accessible")
+    request.knowledge_base_id = resolve_knowledge_base(request, principal)
 
-    results = file_search_service.search(
+    results = await file_search_service.search(
         db,
-        user.id,
+        principal.user_id,
         request.knowledge_base_id,
         request.query
     )
     
-    remaining = file_search_service.check_quota(db, user.id)
+    remaining = quota_service.remaining(db, principal.user_id)
     
     return FileSearchResponse(
         results=results,
@@ -112,50 +117,27 @@ def widget_search(
 @router.post("/search/stream")
 async def widget_search_stream(
     request: WidgetSearchRequest,
-    user: Annotated[User, Depends(verify_api_key)],
-    db: db_dependency
+    principal: principal_dependency,
+    db: search_db_dependency,
+    last_event_id: Annotated[Optional[str], Header()] = None
 ):
     """
     Streaming search endpoint for the widget - provides typewriter effect.
     Usage is charged to the owner of the API Key.
-    """
-    if not request.knowledge_base_id:
-        # Try to find a default KB
-        kb = db.query(KnowledgeBase).filter(KnowledgeBase.user_id == user.id).first()
-        if not kb:
-            raise HTTPException(status_code=400, detail="No knowledge base specified or found")
-        request.knowledge_base_id = kb.id
-    else:
-        # Verify KB belongs to user
-        kb = db.query(KnowledgeBase).filter(
-            KnowledgeBase.id == request.knowledge_base_id,
-            KnowledgeBase.user_id == user.id
-        ).first()
-        if not kb:
-            raise HTTPException(status_code=404, detail="Knowledge base not accessible")
 
-    async def generate():
-        try:
-            async for chunk in file_search_service.search_stream(
-                db,
-                user.id,
-                request.knowledge_base_id,
-                request.query
-            ):
-                # Send as Server-Sent Events format
-                yield f"data: {json.dumps({'text': chunk})}\n\n"
-            
-            # Send done signal
-            yield f"data: {json.dumps({'done': True})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    Events: `accepted` at once, then {"text"} chunks and {"done": true} or
+    {"error"}. Sending Last-Event-ID after a dropped connection resumes the
+    same answer instead of starting (and paying for) a new one.
+    """
+    request.knowledge_base_id = resolve_knowledge_base(request, principal)
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"  # Disable nginx buffering
-        }
+    return sse_engine.response(
+        lambda: file_search_service.search_stream(
+            db,
+            principal.user_id,
+            request.knowledge_base_id,
+            request.query
+        ),
+        owner=principal.user_id,
+        last_event_id=last_event_id
     )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from .models import PlanType
 
@@ -99,3 +99,15 @@ class FileSearchResponse(BaseModel):
     results: List[SearchResult]
     remaining_quota: int
 
+
+class UsageBucket(BaseModel):
+    start: datetime
+    total: int
+    by_service: Dict[str, Dict[str, int]]  # service_type -> status -> count
+
+class UsageSeries(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    totals: Dict[str, int]  # service_type -> count over the whole range
+    buckets: List[UsageBucket]
@@ -1 +1,2 @@
-from .legacy import email_service, twilio_service, chatbot_service, payment_service
+from .legacy import email_service, twilio_service, payment_service
+from .chatbot import chatbot_service
@@ -0,0 +1,93 @@
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "600"))
+
+# Fixed per-entry overhead charged against the byte budget (key tuple, bookkeeping)
+_ENTRY_OVERHEAD = 128
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?!.,;:。？！，；：…"
+
+
+def normalize_query(query_text: str) -> str:
+    """Fold case, width and whitespace so trivially different phrasings share an entry"""
+    text = unicodedata.normalize("NFKC", query_text).casefold()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION + " ")
+
+
+class AnswerCache:
+    """LRU + TTL cache of generated answers with a total byte budget.
+
+    Keys combine the knowledge base id, its `content_version` and the
+    normalized query, so uploading or deleting a document makes every older
+    entry for that KB unreachable; those entries then age out via LRU/TTL.
+    Values are the answer as a list of text chunks, which lets the streaming
+    endpoint replay a cached answer the same way as a live one.
+    """
+
+    def __init__(self, max_bytes: int = ANSWER_CACHE_MAX_BYTES, ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, size, chunks)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(knowledge_base_id: int, content_version: int, query_text: str):
+        return (knowledge_base_id, content_version or 0, normalize_query(query_text))
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, chunks = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return chunks
+
+    def put(self, key, chunks):
+        chunks = list(chunks)
+        size = _ENTRY_OVERHEAD + len(key[2].encode("utf-8")) + sum(len(c.encode("utf-8")) for c in chunks)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, size, chunks)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+answer_cache = AnswerCache()
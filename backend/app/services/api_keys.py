@@ -0,0 +1,146 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from ..models import APIKey, User, KnowledgeBase, Subscription
+
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+# Bounds how long another process's key deletion can go unnoticed here
+API_KEY_CACHE_TTL_SECONDS = int(os.getenv("API_KEY_CACHE_TTL_SECONDS", "300"))
+API_KEY_NEGATIVE_CACHE_SIZE = int(os.getenv("API_KEY_NEGATIVE_CACHE_SIZE", "50000"))
+API_KEY_NEGATIVE_TTL_SECONDS = int(os.getenv("API_KEY_NEGATIVE_TTL_SECONDS", "60"))
+
+
+def hash_api_key(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def generate_api_key() -> str:
+    return f"sk_{secrets.token_hex(16)}"
+
+
+class APIKeyPrincipal:
+    """What widget endpoints need to know about the owner of an API key"""
+    __slots__ = ("user_id", "company_name", "company_url", "config_version",
+                 "default_knowledge_base_id", "knowledge_base_ids", "plan")
+
+    def __init__(self, user_id: int, company_name: str, company_url: str, config_version: int, knowledge_base_ids, plan=None):
+        self.user_id = user_id
+        self.plan = plan  # PlanType of the active subscription, None for free
+        self.company_name = company_name
+        self.company_url = company_url
+        self.config_version = config_version or 1
+        self.knowledge_base_ids = frozenset(knowledge_base_ids)
+        self.default_knowledge_base_id = min(knowledge_base_ids) if knowledge_base_ids else None
+
+
+class APIKeyResolver:
+    """Resolves API keys to principals through an in-process LRU keyed by key digest.
+
+    Known keys cost no DB round trip once cached; unknown keys are remembered
+    in a separate, bounded negative cache so repeated bad keys never reach the
+    DB either. Entries expire after a TTL so changes made by other processes
+    are picked up; changes made here invalidate immediately.
+    """
+
+    def __init__(self):
+        self._principals = OrderedDict()  # key hash -> (expires_at, APIKeyPrincipal)
+        self._unknown = OrderedDict()     # key hash -> expires_at
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def peek(self, key_hash: str) -> Optional[APIKeyPrincipal]:
+        """The cached principal for a key digest, without touching the DB or the counters"""
+        with self._lock:
+            entry = self._principals.get(key_hash)
+        return entry[1] if entry and entry[0] > time.monotonic() else None
+
+    def resolve(self, db: Session, key: str) -> Optional[APIKeyPrincipal]:
+        key_hash = hash_api_key(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._principals.get(key_hash)
+            if entry and entry[0] > now:
+                self._principals.move_to_end(key_hash)
+                self.hits += 1
+                return entry[1]
+            unknown_until = self._unknown.get(key_hash)
+            if unknown_until and unknown_until > now:
+                self.negative_hits += 1
+                return None
+            self.misses += 1
+
+        row = db.query(
+            APIKey.user_id, User.company_name, User.company_url, User.config_version, Subscription.plan_type
+        ).join(
+            User, User.id == APIKey.user_id
+        ).outerjoin(
+            Subscription, (Subscription.user_id == User.id) & (Subscription.is_active == True)
+        ).filter(APIKey.key_hash == key_hash, User.is_active == True).order_by(
+            # Several active subscriptions: the newest decides the plan, as for quota
+            Subscription.start_date.desc(), Subscription.id.desc()
+        ).first()
+        principal = None
+        if row:
+            kb_ids = [kb_id for (kb_id,) in db.query(KnowledgeBase.id).filter(KnowledgeBase.user_id == row.user_id)]
+            principal = APIKeyPrincipal(row.user_id, row.company_name, row.company_url, row.config_version, kb_ids, row.plan_type)
+        # Hand the connection back before the caller awaits anything
+        db.commit()
+
+        with self._lock:
+            if principal is None:
+                self._unknown[key_hash] = now + API_KEY_NEGATIVE_TTL_SECONDS
+                self._unknown.move_to_end(key_hash)
+                while len(self._unknown) > API_KEY_NEGATIVE_CACHE_SIZE:
+                    self._unknown.popitem(last=False)
+            else:
+                self._principals[key_hash] = (now + API_KEY_CACHE_TTL_SECONDS, principal)
+                self._principals.move_to_end(key_hash)
+                while len(self._principals) > API_KEY_CACHE_SIZE:
+                    self._principals.popitem(last=False)
+        return principal
+
+    def invalidate_key(self, key: str):
+        """Forget a key in both caches (deleted, or newly created after a failed lookup)"""
+        key_hash = hash_api_key(key)
+        with self._lock:
+            self._principals.pop(key_hash, None)
+            self._unknown.pop(key_hash, None)
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached key of a user after their profile or knowledge bases change"""
+        with self._lock:
+            for key_hash in [h for h, (_, p) in self._principals.items() if p.user_id == user_id]:
+                del self._principals[key_hash]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "cached_keys": len(self._principals),
+            "cached_unknown_keys": len(self._unknown),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def backfill_key_hashes(engine):
+    """Fill in `api_keys.key_hash` for keys created before it existed"""
+    with engine.begin() as conn:
+        table = APIKey.__table__
+        rows = conn.execute(select(table.c.id, table.c.key).where(table.c.key_hash.is_(None))).fetchall()
+        for key_id, key in rows:
+            conn.execute(table.update().where(table.c.id == key_id).values(key_hash=hash_api_key(key)))
+    if rows:
+        print(f"Backfilled key_hash for {len(rows)} API keys")
+
+
+api_key_resolver = APIKeyResolver()
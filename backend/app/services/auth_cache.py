@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from typing import Optional
+from sqlalchemy.orm import Session
+from ..models import User
+
+# How long a verified user is trusted without re-reading the users table
+AUTH_PRINCIPAL_TTL_SECONDS = int(os.getenv("AUTH_PRINCIPAL_TTL_SECONDS", "30"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+class UserPrincipal:
+    """The authenticated user as carried through request handlers that don't need the ORM row"""
+    __slots__ = ("id", "email", "company_name", "is_active", "token_version")
+
+    def __init__(self, id: int, email: str, company_name: str, is_active: bool, token_version: int):
+        self.id = id
+        self.email = email
+        self.company_name = company_name
+        self.is_active = is_active
+        self.token_version = token_version or 1
+
+
+class PrincipalCache:
+    """Short-TTL map of user id to principal for JWT authentication.
+
+    Tokens carry the user id and `token_version`; a request is authenticated
+    by comparing those claims with the cached principal, so the users table
+    is read at most once per user per TTL. Updating a user here invalidates
+    immediately; changes from other processes apply within the TTL.
+    """
+
+    def __init__(self):
+        self._principals = {}  # user id -> (expires_at, UserPrincipal)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, user_id: int) -> Optional[UserPrincipal]:
+        now = time.monotonic()
+        entry = self._principals.get(user_id)
+        if entry and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        row = db.query(
+            User.id, User.email, User.company_name, User.is_active, User.token_version
+        ).filter(User.id == user_id).first()
+        db.commit()
+        if row is None:
+            return None
+        principal = UserPrincipal(*row)
+        with self._lock:
+            if len(self._principals) >= AUTH_PRINCIPAL_CACHE_SIZE:
+                # Expired entries go first; a full cache of live entries is simply reset
+                expired = [k for k, (expires_at, _) in self._principals.items() if expires_at <= now]
+                for key in expired or list(self._principals):
+                    del self._principals[key]
+            self._principals[user_id] = (now + AUTH_PRINCIPAL_TTL_SECONDS, principal)
+        return principal
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._principals.pop(user_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_users": len(self._principals),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,148 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import Blob, Document
+from .blob_store import blob_store
+from .blocking import run_blocking
+
+# Unreferenced blobs are kept this long (a re-upload of the same content reuses them)
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+BLOB_GC_INTERVAL_SECONDS = int(os.getenv("BLOB_GC_INTERVAL_SECONDS", "600"))
+BLOB_GC_BATCH_SIZE = int(os.getenv("BLOB_GC_BATCH_SIZE", "500"))
+
+
+def hold_blob(db: Session, sha256: str):
+    """Restart a blob's grace period; commit it before storing the file.
+
+    The collector only removes blobs unreferenced for longer than the grace
+    period, so the file stored next stays put until `retain_blob` counts the
+    reference. If the collector is removing the blob right now, this waits on
+    its row lock and the file is then missing and gets stored again.
+    """
+    db.query(Blob).filter(Blob.sha256 == sha256).update(
+        {Blob.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def retain_blob(db: Session, sha256: str):
+    """Count one more reference to a blob, after `hold_blob` and storing the file.
+
+    Commit it with the Document that references the blob, in one short
+    transaction: the row lock it takes is held until then.
+    """
+    now = datetime.utcnow()
+    updated = db.query(Blob).filter(Blob.sha256 == sha256).update(
+        {Blob.ref_count: Blob.ref_count + 1, Blob.updated_at: now}, synchronize_session=False
+    )
+    if updated:
+        return
+    try:
+        with db.begin_nested():
+            db.add(Blob(sha256=sha256, ref_count=1, updated_at=now))
+    except IntegrityError:
+        # Another request created the row first; count on it instead
+        db.query(Blob).filter(Blob.sha256 == sha256).update(
+            {Blob.ref_count: Blob.ref_count + 1, Blob.updated_at: now}, synchronize_session=False
+        )
+
+
+def release_blob(db: Session, sha256: str):
+    """Drop one reference, in the transaction deleting the Document; the collector removes the file later"""
+    db.query(Blob).filter(Blob.sha256 == sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1, Blob.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def backfill_blob_refs(engine):
+    """Create reference counts for blobs stored before they were counted"""
+    blobs = Blob.__table__
+    documents = Document.__table__
+    counted = select(blobs.c.sha256)
+    rows = select(
+        documents.c.content_sha256, func.count(documents.c.id), func.now()
+    ).where(
+        documents.c.content_sha256.isnot(None), documents.c.content_sha256.not_in(counted)
+    ).group_by(documents.c.content_sha256)
+    with engine.begin() as conn:
+        result = conn.execute(insert(blobs).from_select(["sha256", "ref_count", "updated_at"], rows))
+    if result.rowcount:
+        print(f"Counted references for {result.rowcount} blobs")
+
+
+class BlobCollector:
+    """Background task deleting blobs that no document has referenced for BLOB_GC_GRACE_SECONDS.
+
+    Each candidate is removed with a DELETE that re-checks ref_count = 0,
+    which locks its row while the file is deleted: an upload holding the
+    same content either got there first (and the blob is skipped) or waits
+    and stores the file again.
+    """
+
+    def __init__(self):
+        self._task = None
+        self.runs = 0
+        self.removed = 0
+        self.last_error = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                # Waits on row locks held by uploads, so keep it off the event loop
+                await run_blocking(self.collect)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Blob collector run failed: {e}")
+            await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+
+    def collect(self, grace_seconds: int = BLOB_GC_GRACE_SECONDS) -> int:
+        """Blocking: delete up to BLOB_GC_BATCH_SIZE collectable blobs; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        removed = 0
+        db = SessionLocal()
+        try:
+            candidates = [sha256 for (sha256,) in db.query(Blob.sha256).filter(
+                Blob.ref_count <= 0, Blob.updated_at < cutoff
+            ).order_by(Blob.updated_at).limit(BLOB_GC_BATCH_SIZE)]
+            db.commit()
+            for sha256 in candidates:
+                claimed = db.query(Blob).filter(
+                    Blob.sha256 == sha256, Blob.ref_count <= 0, Blob.updated_at < cutoff
+                ).delete(synchronize_session=False)
+                if claimed:
+                    blob_store.delete(sha256)
+                    removed += 1
+                db.commit()
+        finally:
+            db.close()
+        self.runs += 1
+        self.removed += removed
+        self.last_error = None
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "runs_total": self.runs,
+            "removed_total": self.removed,
+            "last_error": self.last_error,
+        }
+
+
+blob_collector = BlobCollector()
@@ -0,0 +1,133 @@
+import abc
+import contextlib
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "local")
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", os.path.abspath("blob_store"))
+
+
+class BlobStore(abc.ABC):
+    """Content-addressed storage for document bytes, keyed by SHA-256 hex digest.
+
+    Identical content uploaded to any KB by any tenant is stored once.
+    Backends implement the methods below; `local_path` may return None for
+    stores without a local file (callers then fall back to `read_bytes`).
+    """
+
+    @abc.abstractmethod
+    def put_file(self, path: str, sha256: str) -> bool:
+        """Move a finished temp file into the store; False if the content was already there"""
+        raise NotImplementedError
+
+    def put_bytes(self, content: bytes) -> str:
+        """Store in-memory content (migrations, small files); returns its digest"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        if not self.exists(sha256):
+            fd, path = tempfile.mkstemp(prefix="blob_")
+            with os.fdopen(fd, "wb") as out:
+                out.write(content)
+            self.put_file(path, sha256)
+        return sha256
+
+    @abc.abstractmethod
+    def exists(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def local_path(self, sha256: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_bytes(self, sha256: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def mmap(self, sha256: str):
+        """Context manager yielding a read-only memory map of the blob (None if missing)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, sha256: str):
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/ab/cd/<sha256>, written atomically via rename"""
+
+    def __init__(self, root: str = BLOB_STORE_PATH):
+        self.root = root
+
+    def _path(self, sha256: str) -> str:
+        if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+            raise ValueError(f"Invalid blob id: {sha256!r}")
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put_file(self, path: str, sha256: str) -> bool:
+        target = self._path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(path, target)
+        except OSError:
+            # Temp dir on another filesystem: copy next to the target, then rename
+            fd, staging = tempfile.mkstemp(dir=os.path.dirname(target))
+            with os.fdopen(fd, "wb") as out, open(path, "rb") as src:
+                shutil.copyfileobj(src, out)
+            os.replace(staging, target)
+            os.remove(path)
+        return True
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self._path(sha256))
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        path = self._path(sha256)
+        return path if os.path.exists(path) else None
+
+    def read_bytes(self, sha256: str) -> Optional[bytes]:
+        try:
+            with open(self._path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @contextlib.contextmanager
+    def mmap(self, sha256: str):
+        try:
+            f = open(self._path(sha256), "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def delete(self, sha256: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(sha256))
+
+
+_BACKENDS = {
+    "local": LocalBlobStore,
+}
+
+
+def get_blob_store() -> BlobStore:
+    try:
+        return _BACKENDS[BLOB_STORE_BACKEND]()
+    except KeyError:
+        raise ValueError(f"Unknown BLOB_STORE_BACKEND: {BLOB_STORE_BACKEND}")
+
+
+blob_store = get_blob_store()
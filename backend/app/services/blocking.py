@@ -0,0 +1,65 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# The Google AI SDK (and the other provider SDKs) only expose blocking calls.
+# They run on a dedicated, bounded pool so they never stall the event loop and
+# never compete with FastAPI's own threadpool used by sync route handlers.
+GENAI_MAX_WORKERS = int(os.getenv("GENAI_MAX_WORKERS", "128"))
+STREAM_BUFFER_CHUNKS = int(os.getenv("GENAI_STREAM_BUFFER_CHUNKS", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=GENAI_MAX_WORKERS, thread_name_prefix="genai")
+
+_DONE = object()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the provider pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_blocking(factory, *args, max_buffer: int = STREAM_BUFFER_CHUNKS, **kwargs):
+    """Consume a blocking iterator on the provider pool, yielding items on the loop.
+
+    `factory(*args, **kwargs)` is called inside the worker thread and must return
+    an iterable (e.g. `model.generate_content(..., stream=True)`). Items are handed
+    to the loop through an asyncio.Queue; at most `max_buffer` items are buffered
+    before the worker waits, so a slow consumer applies backpressure upstream.
+    Closing the async generator early stops the worker after its current item.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(max_buffer)
+    stopped = threading.Event()
+
+    def publish(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def produce():
+        try:
+            for item in factory(*args, **kwargs):
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                publish((item, None))
+            publish((_DONE, None))
+        except BaseException as e:  # surfaced to the consumer
+            publish((_DONE, e))
+
+    loop.run_in_executor(_executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                break
+            slots.release()
+            yield item
+    finally:
+        stopped.set()
+        # Unblock a producer waiting for a free slot so the worker can exit
+        slots.release()
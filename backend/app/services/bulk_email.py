@@ -0,0 +1,99 @@
+import asyncio
+import os
+from .legacy import email_service
+
+# SendGrid accepts at most 1000 personalizations per mail/send request
+BULK_EMAIL_BATCH_SIZE = min(int(os.getenv("BULK_EMAIL_BATCH_SIZE", "1000")), 1000)
+BULK_EMAIL_CONCURRENCY = int(os.getenv("BULK_EMAIL_CONCURRENCY", "4"))
+BULK_EMAIL_MAX_RECIPIENTS = int(os.getenv("BULK_EMAIL_MAX_RECIPIENTS", "10000"))
+
+
+def _is_valid_email(email: str) -> bool:
+    local, _, domain = email.partition("@")
+    return bool(local) and "." in domain and " " not in email
+
+
+def _personalization(recipient: dict) -> dict:
+    to = {"email": recipient["email"]}
+    if recipient.get("name"):
+        to["name"] = recipient["name"]
+    personalization = {"to": [to]}
+    if recipient.get("substitutions"):
+        # `{{first_name}}` in the subject or content becomes this recipient's value
+        personalization["substitutions"] = {
+            f"{{{{{key}}}}}": str(value) for key, value in recipient["substitutions"].items()
+        }
+    return personalization
+
+
+class BulkEmailSender:
+    """Sends one message to many recipients as SendGrid personalization batches.
+
+    Recipients are packed BULK_EMAIL_BATCH_SIZE to a request, and up to
+    BULK_EMAIL_CONCURRENCY requests are in flight at once on the provider
+    pool. Results are reported per recipient: every recipient of a batch
+    shares that batch's outcome, and malformed addresses are rejected up
+    front without being sent.
+    """
+
+    def __init__(self):
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.recipients_accepted = 0
+
+    async def send(self, subject: str, content: str, recipients: list) -> dict:
+        results = [None] * len(recipients)
+        batches = []
+        batch = []
+        for i, recipient in enumerate(recipients):
+            if not _is_valid_email(recipient["email"]):
+                results[i] = {"email": recipient["email"], "status": "rejected", "error": "Invalid email address"}
+                continue
+            batch.append(i)
+            if len(batch) == BULK_EMAIL_BATCH_SIZE:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+
+        limit = asyncio.Semaphore(BULK_EMAIL_CONCURRENCY)
+
+        async def dispatch(number: int, indexes: list):
+            async with limit:
+                success, detail = await email_service.send_personalizations(
+                    subject, content, [_personalization(recipients[i]) for i in indexes]
+                )
+            if success:
+                self.batches_sent += 1
+                self.recipients_accepted += len(indexes)
+            else:
+                self.batches_failed += 1
+            for i in indexes:
+                result = {"email": recipients[i]["email"], "status": "accepted" if success else "failed", "batch": number}
+                if success:
+                    result["message_id"] = detail
+                else:
+                    result["error"] = detail
+                results[i] = result
+
+        await asyncio.gather(*(dispatch(n, indexes) for n, indexes in enumerate(batches)))
+        accepted = sum(1 for r in results if r["status"] == "accepted")
+        return {
+            "total": len(recipients),
+            "accepted": accepted,
+            "failed": len(recipients) - accepted,
+            "batches": len(batches),
+            "results": results,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "batch_size": BULK_EMAIL_BATCH_SIZE,
+            "concurrency": BULK_EMAIL_CONCURRENCY,
+            "batches_sent_total": self.batches_sent,
+            "batches_failed_total": self.batches_failed,
+            "recipients_accepted_total": self.recipients_accepted,
+        }
+
+
+bulk_email_sender = BulkEmailSender()
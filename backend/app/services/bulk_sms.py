@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import random
+import time
+from .legacy import twilio_service
+
+# Twilio queues anything above the sender's rate (1/s for a long code, more for
+# toll-free and short codes); pacing to it keeps sends from piling up there
+SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", "1"))
+BULK_SMS_CONCURRENCY = int(os.getenv("BULK_SMS_CONCURRENCY", "8"))
+BULK_SMS_MAX_MESSAGES = int(os.getenv("BULK_SMS_MAX_MESSAGES", "10000"))
+SMS_MAX_RETRIES = int(os.getenv("SMS_MAX_RETRIES", "3"))
+SMS_RETRY_BASE_SECONDS = float(os.getenv("SMS_RETRY_BASE_SECONDS", "1"))
+
+
+class _Pacer:
+    """Hands out send slots 1/rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> float:
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class BulkSMSSender:
+    """Fans a list of messages out to Twilio at the sender's rate.
+
+    Up to BULK_SMS_CONCURRENCY sends are in flight on the provider pool, and
+    every send (retries included) first takes a slot from the pacer of its
+    sending number, shared by all bulk requests in the process, so throughput
+    is SMS_RATE_PER_SECOND per sender however many requests are running.
+    Transient failures are retried with jittered exponential backoff.
+    """
+
+    def __init__(self):
+        self._pacers = {}  # from number -> _Pacer
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.paced_seconds = 0.0
+
+    def _pacer(self, sender: str) -> _Pacer:
+        pacer = self._pacers.get(sender)
+        if pacer is None:
+            pacer = self._pacers[sender] = _Pacer(SMS_RATE_PER_SECOND)
+        return pacer
+
+    async def _send_one(self, index: int, to_number: str, body: str) -> dict:
+        pacer = self._pacer(twilio_service.from_number or "mock")
+        for attempt in range(1, SMS_MAX_RETRIES + 2):
+            self.paced_seconds += await pacer.wait()
+            sid, message, retryable = await twilio_service.deliver_sms(to_number, body)
+            if sid:
+                self.sent += 1
+                return {"index": index, "to_number": to_number, "status": "sent", "sid": sid, "attempts": attempt}
+            if not retryable or attempt > SMS_MAX_RETRIES:
+                break
+            self.retries += 1
+            await asyncio.sleep(SMS_RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+        self.failed += 1
+        return {"index": index, "to_number": to_number, "status": "failed", "error": message, "attempts": attempt}
+
+    async def stream(self, messages: list):
+        """Yield each message's result as it completes, then a summary.
+
+        `messages` is a list of (to_number, body). Closing the generator early
+        (client disconnected) cancels the sends not yet made.
+        """
+        results = asyncio.Queue()
+        limit = asyncio.Semaphore(BULK_SMS_CONCURRENCY)
+
+        async def worker(index: int, to_number: str, body: str):
+            async with limit:
+                await results.put(await self._send_one(index, to_number, body))
+
+        tasks = [asyncio.ensure_future(worker(i, to, body)) for i, (to, body) in enumerate(messages)]
+        started = time.monotonic()
+        sent = 0
+        try:
+            for _ in range(len(tasks)):
+                result = await results.get()
+                sent += result["status"] == "sent"
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield {
+            "summary": {
+                "total": len(messages),
+                "sent": sent,
+                "failed": len(messages) - sent,
+                "seconds": round(time.monotonic() - started, 3),
+            }
+        }
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": SMS_RATE_PER_SECOND,
+            "concurrency": BULK_SMS_CONCURRENCY,
+            "sent_total": self.sent,
+            "failed_total": self.failed,
+            "retries_total": self.retries,
+            "paced_seconds_total": round(self.paced_seconds, 3),
+        }
+
+
+def ndjson(item: dict) -> str:
+    return json.dumps(item) + "\n"
+
+
+bulk_sms_sender = BulkSMSSender()
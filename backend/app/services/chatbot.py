@@ -0,0 +1,125 @@
+import json
+import os
+from typing import Optional
+import httpx
+from .http_transport import http_transport
+
+CHATBOT_TIMEOUT_SECONDS = float(os.getenv("CHATBOT_TIMEOUT_SECONDS", "120"))
+
+
+class ChatbotError(Exception):
+    pass
+
+
+class ChatbotService:
+    """OpenAI Assistants over async HTTP, answering through streamed runs.
+
+    A run is started with the user's message attached (one request, or one
+    that also creates the thread when there is none yet) and its server-sent
+    events are relayed as they arrive, so nothing polls, nothing blocks the
+    event loop, and the reply never requires listing the thread's history.
+    Requests share the "openai" connection pool in http_transport.
+    """
+
+    def __init__(self):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "OpenAI-Beta": "assistants=v2",
+        }
+
+    @property
+    def client(self) -> Optional[httpx.AsyncClient]:
+        return http_transport.client("openai") if self.api_key else None
+
+    async def create_thread(self) -> Optional[str]:
+        if not self.client:
+            return "mock_thread_id"
+        try:
+            response = await self.client.post("/threads", json={}, headers=self.headers)
+            response.raise_for_status()
+            return response.json()["id"]
+        except httpx.HTTPError as e:
+            print(f"Error creating thread: {e}")
+            return None
+
+    async def stream_reply(self, thread_id: Optional[str], content: str):
+        """Yield ("thread", id) once, then ("text", delta) chunks of the assistant's reply.
+
+        Without a thread_id a new thread is created by the same request.
+        Raises ChatbotError if the run fails.
+        """
+        if not self.client:
+            yield "thread", thread_id or "mock_thread_id"
+            for word in f"[Mock AI Response] You said: {content}".split(" "):
+                yield "text", word + " "
+            return
+
+        message = {"role": "user", "content": content}
+        if thread_id:
+            path = f"/threads/{thread_id}/runs"
+            body = {"assistant_id": self.assistant_id, "additional_messages": [message], "stream": True}
+        else:
+            path = "/threads/runs"
+            body = {"assistant_id": self.assistant_id, "thread": {"messages": [message]}, "stream": True}
+
+        run = None
+        finished = False
+        try:
+            async with self.client.stream(
+                "POST", path, json=body, headers=self.headers, timeout=CHATBOT_TIMEOUT_SECONDS
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise ChatbotError(f"OpenAI returned {response.status_code}: {response.text[:500]}")
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                        continue
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    payload = json.loads(data)
+                    if event == "thread.run.created":
+                        run = payload
+                        yield "thread", payload["thread_id"]
+                    elif event == "thread.message.delta":
+                        for part in payload["delta"].get("content", []):
+                            if part.get("type") == "text":
+                                yield "text", part["text"]["value"]
+                    elif event in ("thread.run.failed", "thread.run.expired", "thread.run.cancelled", "error"):
+                        finished = True
+                        error = payload.get("last_error") or payload.get("error") or payload
+                        raise ChatbotError(f"Run {event.rsplit('.', 1)[-1]}: {error}")
+                    elif event in ("thread.run.completed", "thread.run.requires_action", "thread.run.incomplete"):
+                        finished = True
+        finally:
+            if run is not None and not finished:
+                # Client went away or the stream broke: stop the run rather than let it finish unseen
+                try:
+                    await self.client.post(
+                        f"/threads/{run['thread_id']}/runs/{run['id']}/cancel", headers=self.headers
+                    )
+                except httpx.HTTPError:
+                    pass
+
+    async def send_message(self, thread_id: Optional[str], content: str):
+        """The full reply and the thread it belongs to"""
+        parts = []
+        try:
+            async for kind, value in self.stream_reply(thread_id, content):
+                if kind == "thread":
+                    thread_id = value
+                else:
+                    parts.append(value)
+        except (ChatbotError, httpx.HTTPError) as e:
+            print(f"Error in chatbot: {e}")
+            return "Sorry, I encountered an error.", thread_id
+        return "".join(parts).strip() or "I'm thinking...", thread_id
+
+
+chatbot_service = ChatbotService()
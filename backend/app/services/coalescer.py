@@ -0,0 +1,146 @@
+import asyncio
+
+
+class _Flight:
+    """One upstream generation: its chunks so far, completion state and subscribers"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.linger = None  # pending cancellation once the last subscriber left
+        self._wake = asyncio.Event()
+
+    @property
+    def changed(self) -> asyncio.Event:
+        """Set on the next new chunk or completion; fetch it before checking `chunks`"""
+        return self._wake
+
+    def _notify(self):
+        wake, self._wake = self._wake, asyncio.Event()
+        wake.set()
+
+    async def _produce(self, upstream):
+        try:
+            async for chunk in upstream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self, start: int = 0):
+        """Replay the chunks buffered so far (from index `start`), then follow live ones"""
+        index = start
+        while True:
+            wake = self.changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await wake.wait()
+
+
+class Coalescer:
+    """Single-flight for streamed results: concurrent callers with the same key
+    share one upstream async iterator.
+
+    The first caller starts the upstream in a task of its own; callers that
+    join while it runs first receive every chunk produced so far, then the
+    live ones, and all of them see the same end or error. The upstream is
+    cancelled when every subscriber has gone away (after `linger_seconds`,
+    in case one comes back). A finished flight stays joinable for
+    `retain_seconds`; by default the key is free as soon as it finishes, so
+    completed results are never served from here (that is the answer
+    cache's job).
+    """
+
+    def __init__(self, linger_seconds: float = 0.0, retain_seconds: float = 0.0):
+        self.linger_seconds = linger_seconds
+        self.retain_seconds = retain_seconds
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+        self.abandoned = 0
+
+    def join(self, key, upstream_factory=None):
+        """Subscribe to the flight for `key`, starting it with `upstream_factory()` if needed.
+
+        Returns None when there is no flight and no factory. Every join must
+        be paired with a `leave`.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            if upstream_factory is None:
+                return None
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(flight._produce(upstream_factory()))
+            flight.task.add_done_callback(lambda _: self._finished(key, flight))
+            self.started += 1
+        else:
+            self.joined += 1
+            if flight.linger is not None:
+                flight.linger.cancel()
+                flight.linger = None
+        flight.subscribers += 1
+        return flight
+
+    def leave(self, key, flight: _Flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            if self.linger_seconds > 0:
+                flight.linger = asyncio.get_running_loop().call_later(
+                    self.linger_seconds, self._abandon, key, flight
+                )
+            else:
+                self._abandon(key, flight)
+
+    async def stream(self, key, upstream_factory):
+        """Yield the chunks of the flight for `key`, starting it with `upstream_factory()` if needed"""
+        flight = self.join(key, upstream_factory)
+        try:
+            async for chunk in flight.subscribe():
+                yield chunk
+        finally:
+            self.leave(key, flight)
+
+    def _abandon(self, key, flight: _Flight):
+        flight.linger = None
+        if flight.subscribers == 0 and not flight.done:
+            # Nobody is left to read the answer: stop paying for it
+            self.abandoned += 1
+            self._release(key, flight)
+            flight.task.cancel()
+
+    def _finished(self, key, flight: _Flight):
+        if self.retain_seconds > 0 and not flight.task.cancelled():
+            asyncio.get_running_loop().call_later(self.retain_seconds, self._release, key, flight)
+        else:
+            self._release(key, flight)
+
+    def _release(self, key, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        return {
+            "inflight": sum(1 for f in self._flights.values() if not f.done),
+            "retained": sum(1 for f in self._flights.values() if f.done),
+            "started_total": self.started,
+            "joined_total": self.joined,
+            "abandoned_total": self.abandoned,
+        }
+
+
+query_coalescer = Coalescer()
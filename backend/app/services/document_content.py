@@ -0,0 +1,46 @@
+import base64
+import codecs
+from typing import Optional
+from .blob_store import blob_store
+
+
+def stored_path(doc) -> Optional[str]:
+    """Local file holding the document bytes, if the blob store has one"""
+    return blob_store.local_path(doc.content_sha256) if doc.content_sha256 else None
+
+
+def stored_content(doc) -> Optional[bytes]:
+    """Raw bytes kept for re-upload and indexing.
+
+    Documents reference their bytes in the blob store by `content_sha256`.
+    Rows not yet moved by migrate_blobs.py still carry them inline as base64
+    text in `file_content`.
+    """
+    if doc.content_sha256:
+        content = blob_store.read_bytes(doc.content_sha256)
+        if content is not None:
+            return content
+    if doc.file_content:
+        try:
+            return base64.b64decode(doc.file_content)
+        except ValueError:
+            return None
+    return None
+
+
+def stored_text(doc) -> Optional[str]:
+    """The document decoded as UTF-8, read through a memory map when stored as a blob"""
+    if doc.content_sha256:
+        with blob_store.mmap(doc.content_sha256) as mapped:
+            if mapped is not None:
+                try:
+                    return codecs.decode(mapped, "utf-8")
+                except UnicodeDecodeError:
+                    return None
+    content = stored_content(doc)
+    if content is None:
+        return None
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
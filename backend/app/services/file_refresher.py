@@ -0,0 +1,290 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import google.generativeai as genai
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import Document
+from .blocking import run_blocking
+from .file_registry import file_handle_registry
+
+# Re-upload documents this long before their recorded expiry
+REFRESH_AHEAD_HOURS = float(os.getenv("FILE_REFRESH_AHEAD_HOURS", "2"))
+REFRESH_INTERVAL_SECONDS = int(os.getenv("FILE_REFRESH_INTERVAL_SECONDS", "300"))
+REFRESH_CONCURRENCY = int(os.getenv("FILE_REFRESH_CONCURRENCY", "4"))
+REFRESH_BATCH_SIZE = int(os.getenv("FILE_REFRESH_BATCH_SIZE", "200"))
+# Documents expiring within this window are also checked against the remote
+# listing, so files deleted on Google's side are re-uploaded before they are due
+RECONCILE_AHEAD_HOURS = float(os.getenv("FILE_RECONCILE_AHEAD_HOURS", "12"))
+# A claimed document is left alone by other workers for this long
+REFRESH_LEASE_MINUTES = 10
+
+# Documents with bytes to re-upload from (blob store, or legacy inline content)
+_HAS_STORED_CONTENT = or_(Document.content_sha256.isnot(None), Document.file_content.isnot(None))
+
+
+def _list_remote_files() -> dict:
+    """Blocking: fetch every file visible to this API key in one paged listing"""
+    return {f.name: f for f in genai.list_files()}
+
+
+class DocumentRefresher:
+    """Background task that re-uploads Google AI files before they expire.
+
+    Every interval it scans `Document.google_file_expires_at` (indexed) for
+    documents expiring within REFRESH_AHEAD_HOURS, reconciles those expiring
+    within RECONCILE_AHEAD_HOURS against a single `genai.list_files` listing
+    (files missing remotely are re-uploaded, present ones warm the handle
+    registry) and re-uploads with bounded concurrency. Both scans read the
+    expiry index in windows of REFRESH_BATCH_SIZE rows, so a run costs the
+    same however many documents are far from expiry. Re-uploads are claimed with a conditional UPDATE so several
+    API processes never upload the same document twice.
+
+    Documents without stored content cannot be re-uploaded: once their file
+    is gone they are retired (status "expired" with no expiry), which takes
+    them out of every scan and tells the query path not to schedule them.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._semaphore = None
+        self._scheduled = set()
+        self._background = set()
+        self._undated_after = 0  # keyset position of the undated-rows pass
+        self.runs = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.retired = 0
+        self.backlog = 0
+        self.missing_remote = 0
+        self.lag_seconds = 0.0
+        self.last_run_at = None
+        self.last_run_seconds = None
+        self.last_error = None
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Document refresher run failed: {e}")
+            await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+
+    # -- scanning --------------------------------------------------------
+
+    async def run_once(self):
+        started = time.monotonic()
+        now = datetime.utcnow()
+        horizon = now + timedelta(hours=REFRESH_AHEAD_HOURS)
+
+        db = SessionLocal()
+        try:
+            self._retire(db, Document.google_file_expires_at < now)
+            due = db.query(Document.id, Document.google_file_expires_at).filter(
+                Document.google_file_expires_at < horizon,
+                _HAS_STORED_CONTENT
+            ).order_by(Document.google_file_expires_at).limit(REFRESH_BATCH_SIZE).all()
+            due_ids = [doc_id for doc_id, _ in due]
+            due_total = db.query(func.count(Document.id)).filter(
+                Document.google_file_expires_at < horizon,
+                _HAS_STORED_CONTENT
+            ).scalar()
+
+            # Lag: how far past its recorded expiry the most overdue document is
+            oldest = due[0][1] if due else None
+            self.lag_seconds = max(0.0, (now - oldest).total_seconds()) if oldest else 0.0
+
+            db.commit()
+        finally:
+            db.close()
+
+        try:
+            remote = await run_blocking(_list_remote_files)
+        except Exception as e:
+            # Still refresh what is due by date; reconcile on the next run
+            print(f"Document refresher could not list remote files: {e}")
+            remote = None
+        missing = []
+        if remote is not None:
+            db = SessionLocal()
+            try:
+                missing = self._reconcile(db, remote, horizon, now + timedelta(hours=RECONCILE_AHEAD_HOURS))
+            finally:
+                db.close()
+        self.missing_remote = len(missing)
+
+        self.backlog = due_total + len(missing)
+        targets = [doc_id for doc_id in due_ids + missing if doc_id not in self._scheduled]
+        self._scheduled.update(targets)
+        for i in range(0, len(targets), REFRESH_BATCH_SIZE):
+            await asyncio.gather(*(self._refresh(doc_id) for doc_id in targets[i:i + REFRESH_BATCH_SIZE]))
+
+        self.runs += 1
+        self.last_error = None
+        self.last_run_at = now
+        self.last_run_seconds = round(time.monotonic() - started, 3)
+
+    def _reconcile(self, db: Session, remote: dict, start: datetime, end: datetime) -> list:
+        """Ids of documents expiring in [start, end) whose file is gone remotely.
+
+        Pages through the window by keyset on (expiry, id). Rows without a
+        recorded expiry are checked a batch per run (resuming where the last
+        run stopped) and given the remote file's expiry, which moves them into
+        the indexed windows from then on.
+        """
+        missing = []
+        columns = (Document.id, Document.google_file_id, Document.google_file_expires_at)
+        after = None
+        while True:
+            query = db.query(*columns).filter(
+                Document.google_file_expires_at >= start,
+                Document.google_file_expires_at < end
+            )
+            if after:
+                query = query.filter(or_(
+                    Document.google_file_expires_at > after[0],
+                    and_(Document.google_file_expires_at == after[0], Document.id > after[1])
+                ))
+            batch = query.order_by(Document.google_file_expires_at, Document.id).limit(REFRESH_BATCH_SIZE).all()
+            for doc_id, file_id, expires_at in batch:
+                handle = remote.get(file_id)
+                if handle is None:
+                    missing.append(doc_id)
+                else:
+                    file_handle_registry.put(doc_id, file_id, handle, expires_at)
+            if len(batch) < REFRESH_BATCH_SIZE:
+                break
+            after = (batch[-1][2], batch[-1][0])
+
+        undated = db.query(*columns).filter(
+            Document.google_file_expires_at.is_(None),
+            Document.id > self._undated_after,
+            # Not retired
+            or_(_HAS_STORED_CONTENT, Document.status.is_(None), Document.status != "expired")
+        ).order_by(Document.id).limit(REFRESH_BATCH_SIZE).all()
+        self._undated_after = undated[-1][0] if len(undated) == REFRESH_BATCH_SIZE else 0
+        for doc_id, file_id, _ in undated:
+            handle = remote.get(file_id)
+            expires_at = getattr(handle, "expiration_time", None)
+            if handle is None or expires_at is None:
+                missing.append(doc_id)
+                continue
+            if expires_at.tzinfo is not None:
+                expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+            db.query(Document).filter(Document.id == doc_id).update(
+                {Document.google_file_expires_at: expires_at}, synchronize_session=False
+            )
+            file_handle_registry.put(doc_id, file_id, handle, expires_at)
+        if missing:
+            retired = self._retire(db, Document.id.in_(missing))
+            missing = [doc_id for doc_id in missing if doc_id not in retired]
+        db.commit()
+        return missing
+
+    def _retire(self, db: Session, condition) -> set:
+        """Retire up to a batch of documents matching `condition` that have no stored content; returns their ids"""
+        ids = {doc_id for (doc_id,) in db.query(Document.id).filter(
+            condition, Document.content_sha256.is_(None), Document.file_content.is_(None)
+        ).limit(REFRESH_BATCH_SIZE)}
+        if ids:
+            db.query(Document).filter(Document.id.in_(ids)).update({
+                Document.status: "expired",
+                Document.google_file_expires_at: None,
+            }, synchronize_session=False)
+            self.retired += len(ids)
+            print(f"Retired {len(ids)} documents whose file is gone and that have no stored content")
+        return ids
+
+    def schedule(self, document_id: int):
+        """Queue a document for re-upload in the background (used by the query path)"""
+        if document_id in self._scheduled:
+            return
+        self._scheduled.add(document_id)
+        task = asyncio.get_running_loop().create_task(self._refresh(document_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # -- re-upload -------------------------------------------------------
+
+    def _claim(self, db: Session, doc: Document) -> bool:
+        """Atomically take a short lease on the document; False if another worker holds it.
+
+        The lease is `status='refreshing'` with the expiry moved to the end of the
+        lease, so a worker that dies mid-upload leaves the document due again.
+        """
+        now = datetime.utcnow()
+        claimed = db.query(Document).filter(
+            Document.id == doc.id,
+            Document.google_file_id == doc.google_file_id,
+            _HAS_STORED_CONTENT,
+            or_(Document.status != "refreshing", Document.google_file_expires_at < now)
+        ).update({
+            Document.status: "refreshing",
+            Document.google_file_expires_at: now + timedelta(minutes=REFRESH_LEASE_MINUTES),
+        }, synchronize_session=False)
+        db.commit()
+        if claimed != 1:
+            return False
+        db.refresh(doc)
+        return True
+
+    async def _refresh(self, document_id: int):
+        from .file_search import file_search_service
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+        try:
+            async with self._semaphore:
+                # The document is read from worker threads after each commit
+                db = SessionLocal(expire_on_commit=False)
+                try:
+                    doc = db.query(Document).filter(Document.id == document_id).first()
+                    if not doc or not self._claim(db, doc):
+                        return
+                    handle = await file_search_service._reupload_expired_file(db, doc)
+                    if handle:
+                        self.refreshed += 1
+                    else:
+                        self.failed += 1
+                finally:
+                    db.close()
+        finally:
+            self._scheduled.discard(document_id)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "backlog": self.backlog,
+            "pending_refreshes": len(self._scheduled),
+            "lag_seconds": self.lag_seconds,
+            "missing_remote": self.missing_remote,
+            "refreshed_total": self.refreshed,
+            "failed_total": self.failed,
+            "retired_total": self.retired,
+            "runs_total": self.runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": self.last_run_seconds,
+            "last_error": self.last_error,
+        }
+
+
+document_refresher = DocumentRefresher()
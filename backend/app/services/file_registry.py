@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+
+
+class FileHandleRegistry:
+    """Per-process cache of resolved Google AI file handles.
+
+    Handles are keyed by `google_file_id` and stay valid until the document's
+    `google_file_expires_at`. The registry also remembers the newest file id
+    per document, so a request holding a stale `Document` row (loaded before
+    another request re-uploaded it) still finds the fresh handle.
+    """
+
+    def __init__(self):
+        self._handles = {}       # google_file_id -> (handle, expires_at)
+        self._by_document = {}   # document id -> latest google_file_id
+        self._inflight = {}      # single-flight key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, document_id: int, google_file_id: str):
+        """Return a cached, unexpired handle for the document or None"""
+        now = datetime.utcnow()
+        for file_id in (self._by_document.get(document_id), google_file_id):
+            entry = self._handles.get(file_id) if file_id else None
+            if not entry:
+                continue
+            handle, expires_at = entry
+            if expires_at is None or expires_at > now:
+                self.hits += 1
+                return handle
+            self._handles.pop(file_id, None)
+        self.misses += 1
+        return None
+
+    def put(self, document_id: int, google_file_id: str, handle, expires_at: datetime = None):
+        previous = self._by_document.get(document_id)
+        if previous and previous != google_file_id:
+            self._handles.pop(previous, None)
+        self._handles[google_file_id] = (handle, expires_at)
+        self._by_document[document_id] = google_file_id
+
+    def invalidate(self, document_id: int, google_file_id: str = None):
+        file_id = self._by_document.pop(document_id, None)
+        for key in (file_id, google_file_id):
+            if key:
+                self._handles.pop(key, None)
+
+    async def single_flight(self, key, factory):
+        """Run `factory()` once per key; concurrent callers await the same result.
+
+        The work runs in a task of its own, so a caller being cancelled (e.g.
+        its client disconnected) only stops that caller's wait, never the
+        shared result the other callers are waiting on.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_flight(key, t))
+        return await asyncio.shield(task)
+
+    def _finish_flight(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieved so a failure nobody is left to await is not logged as unhandled
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "cached_handles": len(self._handles),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+file_handle_registry = FileHandleRegistry()
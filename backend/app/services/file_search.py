@@ -1,12 +1,27 @@
 import os
 import google.generativeai as genai
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, UploadFile
 from typing import List
 import time
-import base64
-from ..models import KnowledgeBase, Document, FileSearchQuery, User, UsageLog
+import asyncio
+import hashlib
+import tempfile
+from ..models import KnowledgeBase, Document, User
 from ..schemas import SearchResult
+from .blocking import run_blocking, iterate_blocking
+from .file_registry import file_handle_registry
+from .answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from .retrieval import retrieval_index, format_passages, RETRIEVAL_MODE
+from .quota import quota_service
+from .usage_writer import usage_writer
+from .api_keys import api_key_resolver
+from .document_content import stored_content, stored_path
+from .blob_store import blob_store
+from .blob_gc import hold_blob, retain_blob, release_blob
+from .generation import generation_provider, context_cache, user_prompt, Answer
+from .coalescer import query_coalescer
 from datetime import datetime, timedelta
 
 # Initialize Google AI
@@ -14,25 +29,49 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_AI_API_KEY")
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
 
-FREE_QUOTA_LIMIT = int(os.getenv("FREE_SEARCH_QUOTA", "100"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 # Google AI files expire after 48 hours, we refresh at 47 hours to be safe
 GOOGLE_FILE_EXPIRY_HOURS = 47
 
+BLOCKED_ANSWER = "抱歉，我无法处理这个请求。请尝试用其他方式提问。\n\nSorry, I couldn't process this request. Please try rephrasing your question."
+EMPTY_ANSWER = "抱歉，我无法回答这个问题。请尝试其他问题。\n\nSorry, I couldn't answer this question. Please try a different one."
+
+
+# Answer status for a KB none of whose documents could be used
+NO_DOCUMENTS = "no_documents"
+NO_DOCUMENTS_TEXT = "No accessible documents found in this knowledge base. Please try re-uploading your documents."
+
+
+def _answer_text(answer: Answer) -> str:
+    if answer.status == "blocked":
+        return BLOCKED_ANSWER
+    if answer.status == "empty":
+        return EMPTY_ANSWER
+    return answer.text
+
+
+def _collect_answer(chunks: list) -> Answer:
+    """The Answer of a non-streamed flight, or the joined text of a streamed one"""
+    if len(chunks) == 1 and isinstance(chunks[0], Answer):
+        return chunks[0]
+    return Answer("".join(chunks), "complete")
+
+
+def _prompt_parts(remote_files: list, passages: list, query_text: str, cached: bool) -> list:
+    """Files (unless already in the KB's context cache), retrieved passages, then the question"""
+    context_parts = [format_passages(passages)] if passages else []
+    files = [] if cached else remote_files
+    return files + context_parts + [user_prompt(query_text)]
+
 class FileSearchService:
-    def get_quota_usage(self, db: Session, user_id: int) -> int:
-        """Calculate total number of search queries made by user"""
-        return db.query(FileSearchQuery).filter(FileSearchQuery.user_id == user_id).count()
-
-    def check_quota(self, db: Session, user_id: int):
-        """Raise error if quota exceeded"""
-        usage = self.get_quota_usage(db, user_id)
-        if usage >= FREE_QUOTA_LIMIT:
-            raise HTTPException(
-                status_code=402, 
-                detail=f"Free quota exceeded ({FREE_QUOTA_LIMIT} calls). Please upgrade your plan."
-            )
-        return FREE_QUOTA_LIMIT - usage
+    def _bump_content_version(self, db: Session, knowledge_base_id: int):
+        """Atomically advance the KB content version so cached answers for it stop matching"""
+        db.query(KnowledgeBase).filter(KnowledgeBase.id == knowledge_base_id).update(
+            {KnowledgeBase.content_version: func.coalesce(KnowledgeBase.content_version, 0) + 1},
+            synchronize_session=False
+        )
 
     def create_knowledge_base(self, db: Session, user_id: int, name: str, description: str = None):
         """Create a new knowledge base (Logical grouping)"""
@@ -46,8 +85,15 @@ class FileSearchService:
             google_vector_store_id="logical-kb" 
         )
         db.add(kb)
+        # The widget's default KB may change
+        db.query(User).filter(User.id == user_id).update(
+            {User.config_version: func.coalesce(User.config_version, 1) + 1},
+            synchronize_session=False
+        )
         db.commit()
         db.refresh(kb)
+        # Widget keys of this user cache their KB list
+        api_key_resolver.invalidate_user(user_id)
         return kb
 
     async def upload_document(self, db: Session, user_id: int, knowledge_base_id: int, file: UploadFile):
@@ -59,31 +105,33 @@ class FileSearchService:
         
         if not kb:
             raise HTTPException(status_code=404, detail="Knowledge base not found")
+        # Hand the connection back while the file is spooled and uploaded
+        db.commit()
 
-        # Save file temporarily
-        temp_filename = f"temp_{file.filename}"
-        with open(temp_filename, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-            file_size = len(content)
+        # Spool to a private temp file, hashing and enforcing the size limit on the way
+        path, file_size, content_sha256 = await self._spool_upload(file)
+        mime_type = file.content_type or 'application/octet-stream'
 
         try:
             # Upload to Google AI (using genai imported at top of file)
             print(f"DEBUG: genai version: {genai.__version__}")
-            google_file = genai.upload_file(path=temp_filename, display_name=file.filename)
-            
-            # Read file content for potential re-upload later (Google files expire in 48h)
-            with open(temp_filename, "rb") as f:
-                file_content_bytes = f.read()
-            # Store as base64 for text column compatibility
-            file_content_b64 = base64.b64encode(file_content_bytes).decode('utf-8')
+            google_file = await run_blocking(
+                genai.upload_file, path=path, display_name=file.filename, mime_type=mime_type
+            )
             
-            # Handle None content_type
-            mime_type = file.content_type or 'application/octet-stream'
+            # Keep the bytes for re-upload later (Google files expire in 48h); the spool
+            # file is moved into the content-addressed store, or dropped if already there.
+            # Holding the blob keeps the collector away from it meanwhile, without
+            # keeping a row locked while the file is written.
+            hold_blob(db, content_sha256)
+            db.commit()
+            await run_blocking(blob_store.put_file, path, content_sha256)
             
             # Calculate expiry time (48 hours from now, but we use 47 to be safe)
             expires_at = datetime.utcnow() + timedelta(hours=GOOGLE_FILE_EXPIRY_HOURS)
             
+            # The reference and the document are committed together
+            retain_blob(db, content_sha256)
             doc = Document(
                 knowledge_base_id=kb.id,
                 filename=file.filename,
@@ -91,19 +139,56 @@ class FileSearchService:
                 file_size=file_size,
                 mime_type=mime_type,
                 status="active",
-                file_content=file_content_b64,
+                content_sha256=content_sha256,
                 google_file_expires_at=expires_at
             )
             db.add(doc)
+            self._bump_content_version(db, kb.id)
             db.commit()
             db.refresh(doc)
-            
-            return doc
+            file_handle_registry.put(doc.id, google_file.name, google_file, expires_at)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to upload to Google AI: {str(e)}")
         finally:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
+            if os.path.exists(path):
+                os.remove(path)
+
+        # Chunk at ingestion so the next query only rebuilds the KB index. The
+        # document is stored either way: a failure here only means it is
+        # chunked lazily when its KB index is next built.
+        try:
+            await run_blocking(retrieval_index.ingest, doc)
+        except Exception as e:
+            print(f"Failed to chunk {doc.filename} at upload: {e}")
+        return doc
+
+    async def _spool_upload(self, file: UploadFile):
+        """Copy an upload to a private temp file in chunks; returns (path, size, sha256 hex).
+
+        Only one chunk is held in memory at a time. The suffix keeps the original
+        extension for tools that sniff it.
+        """
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES} bytes)")
+
+        fd, path = tempfile.mkstemp(prefix="upload_", suffix=os.path.splitext(file.filename or "")[1])
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES} bytes)")
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, size, digest.hexdigest()
 
     def delete_document(self, db: Session, user_id: int, knowledge_base_id: int, document_id: int):
         """Delete a document from knowledge base and Google AI"""
@@ -132,42 +217,65 @@ class FileSearchService:
             print(f"Warning: Could not delete file from Google AI: {e}")
             # Continue with local deletion even if Google delete fails
         
-        # Delete from database
+        file_handle_registry.invalidate(doc.id, doc.google_file_id)
+        retrieval_index.forget(doc.id)
+        
+        # Delete from database; the blob (shared by identical uploads) is removed
+        # by the collector once no document has used it for a while
         db.delete(doc)
+        if doc.content_sha256:
+            release_blob(db, doc.content_sha256)
+        self._bump_content_version(db, kb.id)
         db.commit()
         
         return {"message": "Document deleted successfully"}
 
-    def _reupload_expired_file(self, db: Session, doc: Document) -> str:
-        """Re-upload an expired file to Google AI and update the document record"""
-        if not doc.file_content:
-            print(f"Cannot re-upload {doc.filename}: no stored content")
-            return None
-            
+    @staticmethod
+    def _upload_stored_content(content: bytes, filename: str, mime_type: str):
+        """Blocking: upload inline (not yet migrated) content via a private temp file"""
+        fd, path = tempfile.mkstemp(prefix="reupload_", suffix=os.path.splitext(filename or "")[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            return genai.upload_file(path=path, display_name=filename, mime_type=mime_type)
+        finally:
+            os.remove(path)
+
+    async def _reupload_expired_file(self, db: Session, doc: Document):
+        """Re-upload an expired file to Google AI and update the document record.
+
+        Concurrent callers for the same document share one upload (single-flight);
+        returns the new file handle, or None if the upload failed.
+        """
+        return await file_handle_registry.single_flight(
+            ("reupload", doc.id),
+            lambda: self._do_reupload(db, doc)
+        )
+
+    async def _do_reupload(self, db: Session, doc: Document):
         try:
-            # Decode the stored base64 content
-            file_content_bytes = base64.b64decode(doc.file_content)
+            # Upload to Google AI off the event loop, straight from the blob store when possible
+            path = stored_path(doc)
+            if path:
+                google_file = await run_blocking(
+                    genai.upload_file, path=path, display_name=doc.filename, mime_type=doc.mime_type
+                )
+            else:
+                content = stored_content(doc)
+                if content is None:
+                    print(f"Cannot re-upload {doc.filename}: no stored content")
+                    return None
+                google_file = await run_blocking(self._upload_stored_content, content, doc.filename, doc.mime_type)
             
-            # Write to temp file
-            temp_filename = f"temp_reupload_{doc.filename}"
-            with open(temp_filename, "wb") as f:
-                f.write(file_content_bytes)
+            # Update document record
+            doc.google_file_id = google_file.name
+            doc.google_file_expires_at = datetime.utcnow() + timedelta(hours=GOOGLE_FILE_EXPIRY_HOURS)
+            doc.status = "active"
+            db.commit()
+            file_handle_registry.put(doc.id, google_file.name, google_file, doc.google_file_expires_at)
             
-            try:
-                # Upload to Google AI
-                google_file = genai.upload_file(path=temp_filename, display_name=doc.filename)
-                
-                # Update document record
-                doc.google_file_id = google_file.name
-                doc.google_file_expires_at = datetime.utcnow() + timedelta(hours=GOOGLE_FILE_EXPIRY_HOURS)
-                doc.status = "active"
-                db.commit()
-                
-                print(f"Re-uploaded expired file {doc.filename} -> {google_file.name}")
-                return google_file.name
-            finally:
-                if os.path.exists(temp_filename):
-                    os.remove(temp_filename)
+            print(f"Re-uploaded expired file {doc.filename} -> {google_file.name}")
+            return google_file
                     
         except Exception as e:
             print(f"Failed to re-upload {doc.filename}: {e}")
@@ -175,44 +283,117 @@ class FileSearchService:
             db.commit()
             return None
 
-    def _get_valid_file(self, db: Session, doc: Document):
-        """Get a valid Google AI file object, re-uploading if expired"""
+    async def _get_valid_file(self, db: Session, doc: Document):
+        """Get a valid Google AI file object, scheduling a re-upload if expired"""
+        # Resolved handles are cached per process until the file expires
+        cached = file_handle_registry.get(doc.id, doc.google_file_id)
+        if cached:
+            return cached
+        
+        # Re-uploads never run on the query path: the background refresher
+        # normally renews files well ahead of expiry, and anything it missed is
+        # queued for it here while the old file (valid for up to another hour)
+        # is still tried.
+        from .file_refresher import document_refresher
+
+        if doc.status == "expired" and doc.google_file_expires_at is None:
+            # Retired by the refresher: gone, with nothing stored to re-upload from
+            return None
+        
         # Check if file is expired or about to expire
         now = datetime.utcnow()
-        is_expired = (doc.google_file_expires_at and doc.google_file_expires_at < now)
+        expires_at = doc.google_file_expires_at
+        is_expired = (expires_at and expires_at < now)
         
         if is_expired:
-            print(f"File {doc.filename} is expired, attempting re-upload...")
-            new_file_id = self._reupload_expired_file(db, doc)
-            if not new_file_id:
-                return None
+            print(f"File {doc.filename} is expired, scheduling re-upload...")
+            document_refresher.schedule(doc.id)
+            expires_at = now + timedelta(minutes=5)
         
         # Try to get the file from Google AI
+        file_id = doc.google_file_id
         try:
-            rf = genai.get_file(doc.google_file_id)
+            rf = await file_handle_registry.single_flight(
+                ("get", file_id),
+                lambda: run_blocking(genai.get_file, file_id)
+            )
+            # Rows without a recorded expiry are re-checked after an hour
+            file_handle_registry.put(doc.id, file_id, rf, expires_at or now + timedelta(hours=1))
             return rf
         except Exception as e:
             error_str = str(e)
             # Check if it's a 403/404 error (file expired or deleted)
             if "403" in error_str or "404" in error_str or "not exist" in error_str.lower():
-                print(f"File {doc.filename} not accessible, attempting re-upload...")
-                new_file_id = self._reupload_expired_file(db, doc)
-                if new_file_id:
-                    try:
-                        return genai.get_file(new_file_id)
-                    except Exception as e2:
-                        print(f"Still cannot access re-uploaded file: {e2}")
-                        return None
+                print(f"File {doc.filename} not accessible, scheduling re-upload...")
+                document_refresher.schedule(doc.id)
+                return None
             else:
-                print(f"Error accessing file {doc.google_file_id}: {e}")
+                print(f"Error accessing file {file_id}: {e}")
                 return None
 
-    def search(self, db: Session, user_id: int, knowledge_base_id: int, query_text: str):
-        """Perform semantic search using Google AI"""
-        # 1. Check quota
-        self.check_quota(db, user_id)
+    async def _get_valid_files(self, db: Session, docs: List[Document]):
+        """Resolve file objects for all documents concurrently, skipping inaccessible ones"""
+        handles = await asyncio.gather(*(self._get_valid_file(db, d) for d in docs))
+        return [h for h in handles if h]
+
+    async def _select_context(self, kb: KnowledgeBase, docs: List[Document], query_text: str):
+        """Choose the prompt context: (documents to attach as files, retrieved text passages).
+
+        In "chunks" mode text documents contribute only their top-ranked passages;
+        documents that cannot be read as text (PDFs, images) are still attached.
+        """
+        if RETRIEVAL_MODE != "chunks":
+            return docs, []
+        passages, indexed = await retrieval_index.select_passages(kb, docs, query_text)
+        attach = [d for d in docs if d.id not in indexed]
+        return attach, passages
+
+    async def _generate(self, db: Session, kb: KnowledgeBase, docs: List[Document], query_text: str, cache_key, stream: bool):
+        """Upstream of a coalesced query: text chunks when streaming, otherwise one Answer.
+
+        The flight takes its shape from whoever starts it; callers of either
+        kind accept both. Complete answers go to the answer cache once here.
+        """
+        # Get file objects (with automatic re-upload of expired files)
+        attach_docs, passages = await self._select_context(kb, docs, query_text)
+        remote_files = await self._get_valid_files(db, attach_docs)
         
-        # 2. Get knowledge base and docs
+        if not remote_files and not passages:
+            yield Answer(NO_DOCUMENTS_TEXT, NO_DOCUMENTS)
+            return
+
+        # The KB's documents and the system prompt are sent once into a
+        # provider-side context cache; the query then carries only the question
+        async with context_cache.lease(kb.id, kb.content_version, remote_files) as cache:
+            prompt_parts = _prompt_parts(remote_files, passages, query_text, cache is not None)
+
+            if stream:
+                # Use streaming generation; the blocking SDK iterator is drained on
+                # the provider pool and chunks are handed back through a queue
+                chunks = []
+                status = "complete"
+                async for item in iterate_blocking(generation_provider.generate_stream, prompt_parts, cache):
+                    if isinstance(item, Answer):
+                        # Stopped early (token limit, safety, ...): clients without
+                        # any text get the explanation the non-streamed path gives
+                        status = item.status
+                        if not chunks:
+                            yield item
+                        continue
+                    chunks.append(item)
+                    yield item
+                # Only complete, error-free answers are cached
+                if status == "complete" and ANSWER_CACHE_ENABLED and chunks:
+                    answer_cache.put(cache_key, chunks)
+            else:
+                answer = await run_blocking(generation_provider.generate, prompt_parts, cache)
+                if answer.status == "complete" and ANSWER_CACHE_ENABLED:
+                    answer_cache.put(cache_key, [answer.text])
+                yield answer
+
+    async def search(self, db: Session, user_id: int, knowledge_base_id: int, query_text: str):
+        """Perform semantic search using Google AI"""
+        # 1. Get knowledge base and docs
         kb = db.query(KnowledgeBase).filter(
             KnowledgeBase.id == knowledge_base_id,
             KnowledgeBase.user_id == user_id
@@ -225,113 +406,34 @@ class FileSearchService:
         if not docs:
             return []
             
-        # 3. Perform search
-        # We will use the generative model to answer based on these files.
-        # This acts as a RAG system.
-        file_uris = [d.google_file_id for d in docs]
-        
-        # Note: We need to properly attach files to the generation request
-        # The SDK constructs a content query.
-        
-        model = genai.GenerativeModel('gemini-flash-latest')
-        
-        # Track usage
-        usage = FileSearchQuery(
-            user_id=user_id,
-            knowledge_base_id=knowledge_base_id,
-            query_text=query_text
-        )
-        db.add(usage)
-        
-        # Log generic usage
-        log = UsageLog(
-            user_id=user_id,
-            service_type="file_search",
-            status="success",
-            details=f"KB: {kb.name}"
-        )
-        db.add(log)
+        # 2. Take one search from the quota (raises 402 when used up), track usage.
+        # The commit ends the read transaction so no connection is held while we await.
+        quota_service.consume(db, user_id)
         db.commit()
+        await usage_writer.record_search(user_id, knowledge_base_id, query_text, "file_search", f"KB: {kb.name}")
+        
+        # Repeated questions are answered from the cache; usage above is still recorded
+        cache_key = answer_cache.make_key(kb.id, kb.content_version, query_text)
+        if ANSWER_CACHE_ENABLED:
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                return [SearchResult(text="".join(cached), score=1.0, source_document="combined")]
         
         try:
-            # We use the generate_content with context
-            # Get file objects (with automatic re-upload of expired files)
-            remote_files = []
-            for d in docs:
-                rf = self._get_valid_file(db, d)
-                if rf:
-                    remote_files.append(rf)
-            
-            if not remote_files:
-                return [SearchResult(text="No accessible documents found in this knowledge base. Please try re-uploading your documents.")]
-
-            # RAG System Prompt - This is the key to good responses!
-            # Supports multiple languages (Chinese, English, etc.)
-            system_prompt = """You are a helpful multilingual AI assistant that answers questions based on the provided documents.
-
-IMPORTANT INSTRUCTIONS:
-1. RESPOND IN THE SAME LANGUAGE as the user's question (if user asks in Chinese, respond in Chinese; if English, respond in English)
-2. ONLY answer based on information found in the provided documents
-3. If the user's question is a greeting (like "hello", "hi", "你好", "嗨"), respond with a friendly greeting in their language and briefly describe what information is available in the documents
-4. If the information is not in the documents, say "I couldn't find specific information about that in the documents" (in the user's language)
-5. Provide clear, concise, and helpful answers
-6. Use a friendly, conversational tone
-7. Format your response nicely - use bullet points or numbered lists when appropriate
-8. Keep responses focused and not too long unless the user asks for detailed information
-
-Remember: You are a helpful AI assistant for documentation. Be professional and supportive."""
-
-            # Construct the full prompt
-            user_prompt = f"""Based on the attached documents, please answer the following question.
-Reply in the same language as the question.
-
-User Question: {query_text}
-
-Please provide a helpful and relevant response."""
-
-            # Construct prompt parts: system instruction, files, then user query
-            prompt_parts = remote_files + [system_prompt + "\n\n" + user_prompt]
-            
-            # Configure safety settings to be less restrictive for normal Q&A
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
+            # Identical questions in flight share one generation (each caller was billed above)
+            chunks = [
+                chunk async for chunk in query_coalescer.stream(
+                    cache_key, lambda: self._generate(db, kb, docs, query_text, cache_key, stream=False)
+                )
             ]
+            answer = _collect_answer(chunks)
             
-            response = model.generate_content(
-                prompt_parts,
-                safety_settings=safety_settings
-            )
-            
-            # Check if response was blocked or empty
-            if not response.candidates:
-                return [SearchResult(
-                    text="抱歉，我无法处理这个请求。请尝试用其他方式提问。\n\nSorry, I couldn't process this request. Please try rephrasing your question.",
-                    score=0.0,
-                    source_document="system"
-                )]
-            
-            candidate = response.candidates[0]
-            
-            # Check finish reason
-            if candidate.finish_reason and candidate.finish_reason != 1:  # 1 = STOP (normal)
-                # Check if there's still text content
-                if candidate.content and candidate.content.parts:
-                    response_text = candidate.content.parts[0].text
-                else:
-                    return [SearchResult(
-                        text="抱歉，我无法回答这个问题。请尝试其他问题。\n\nSorry, I couldn't answer this question. Please try a different one.",
-                        score=0.0,
-                        source_document="system"
-                    )]
-            else:
-                # Normal response
-                response_text = response.text
-            
+            if answer.status == NO_DOCUMENTS:
+                return [SearchResult(text=answer.text)]
+            if answer.status in ("blocked", "empty"):
+                return [SearchResult(text=_answer_text(answer), score=0.0, source_document="system")]
             return [SearchResult(
-                text=response_text,
+                text=answer.text,
                 score=1.0, 
                 source_document="combined"
             )]
@@ -352,12 +454,7 @@ Please provide a helpful and relevant response."""
 
     async def search_stream(self, db: Session, user_id: int, knowledge_base_id: int, query_text: str):
         """Perform streaming semantic search using Google AI - yields text chunks"""
-        import asyncio
-        
-        # 1. Check quota
-        self.check_quota(db, user_id)
-        
-        # 2. Get knowledge base and docs
+        # 1. Get knowledge base and docs
         kb = db.query(KnowledgeBase).filter(
             KnowledgeBase.id == knowledge_base_id,
             KnowledgeBase.user_id == user_id
@@ -371,83 +468,29 @@ Please provide a helpful and relevant response."""
         if not docs:
             yield "No documents found in this knowledge base."
             return
-            
-        # 3. Get file objects (with automatic re-upload of expired files)
-        remote_files = []
-        for d in docs:
-            rf = self._get_valid_file(db, d)
-            if rf:
-                remote_files.append(rf)
         
-        if not remote_files:
-            yield "No accessible documents found in this knowledge base. Please try re-uploading your documents."
-            return
-
-        # Track usage
-        usage = FileSearchQuery(
-            user_id=user_id,
-            knowledge_base_id=knowledge_base_id,
-            query_text=query_text
-        )
-        db.add(usage)
-        
-        log = UsageLog(
-            user_id=user_id,
-            service_type="file_search_stream",
-            status="success",
-            details=f"KB: {kb.name}"
-        )
-        db.add(log)
+        # Take one search from the quota and track usage
+        # (the commit hands the connection back before we await Google AI)
+        quota_service.consume(db, user_id)
         db.commit()
-
-        # RAG System Prompt
-        system_prompt = """You are a helpful multilingual AI assistant that answers questions based on the provided documents.
-
-IMPORTANT INSTRUCTIONS:
-1. RESPOND IN THE SAME LANGUAGE as the user's question (if user asks in Chinese, respond in Chinese; if English, respond in English)
-2. ONLY answer based on information found in the provided documents
-3. If the user's question is a greeting (like "hello", "hi", "你好", "嗨"), respond with a friendly greeting in their language and briefly describe what information is available in the documents
-4. If the information is not in the documents, say "I couldn't find specific information about that in the documents" (in the user's language)
-5. Provide clear, concise, and helpful answers
-6. Use a friendly, conversational tone
-7. Format your response nicely - use bullet points or numbered lists when appropriate
-8. Keep responses focused and not too long unless the user asks for detailed information
-
-Remember: You are a helpful AI assistant for documentation. Be professional and supportive."""
-
-        user_prompt = f"""Based on the attached documents, please answer the following question.
-Reply in the same language as the question.
-
-User Question: {query_text}
-
-Please provide a helpful and relevant response."""
-
-        prompt_parts = remote_files + [system_prompt + "\n\n" + user_prompt]
+        await usage_writer.record_search(user_id, knowledge_base_id, query_text, "file_search_stream", f"KB: {kb.name}")
         
-        # Configure safety settings
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
-        ]
-
-        try:
-            model = genai.GenerativeModel('gemini-flash-latest')
+        # Replay cached answers through the same stream
+        cache_key = answer_cache.make_key(kb.id, kb.content_version, query_text)
+        if ANSWER_CACHE_ENABLED:
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                for chunk in cached:
+                    yield chunk
+                return
             
-            # Use streaming generation
-            response = model.generate_content(
-                prompt_parts,
-                safety_settings=safety_settings,
-                stream=True  # Enable streaming!
-            )
-            
-            # Iterate through chunks and yield with small delay for proper streaming
-            for chunk in response:
-                if chunk.text:
-                    yield chunk.text
-                    # Small delay to ensure proper chunk delivery
-                    await asyncio.sleep(0.01)
+        try:
+            # Joins an identical query already in flight (streamed or not): chunks
+            # produced so far are replayed, then live ones follow
+            async for chunk in query_coalescer.stream(
+                cache_key, lambda: self._generate(db, kb, docs, query_text, cache_key, stream=True)
+            ):
+                yield chunk if isinstance(chunk, str) else _answer_text(chunk)
                     
         except Exception as e:
             error_msg = str(e)
@@ -0,0 +1,398 @@
+import abc
+import asyncio
+import contextlib
+import itertools
+import os
+import time
+from collections import namedtuple
+from datetime import timedelta
+import google.generativeai as genai
+from .blocking import run_blocking
+from .file_registry import file_handle_registry
+
+GENERATION_PROVIDER = os.getenv("GENERATION_PROVIDER", "gemini")
+GENERATION_MODEL = os.getenv("GENERATION_MODEL", "gemini-flash-latest")
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# A cache still in use is extended once less than this much of its TTL remains
+CONTEXT_CACHE_REFRESH_SECONDS = int(os.getenv("CONTEXT_CACHE_REFRESH_SECONDS", "600"))
+# After a failed creation (e.g. the documents are below the provider's minimum
+# cacheable size) the KB is answered uncached for this long before retrying
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "1800"))
+
+# RAG System Prompt - This is the key to good responses!
+# Supports multiple languages (Chinese, English, etc.)
+SYSTEM_PROMPT = """You are a helpful multilingual AI assistant that answers questions based on the provided documents.
+
+IMPORTANT INSTRUCTIONS:
+1. RESPOND IN THE SAME LANGUAGE as the user's question (if user asks in Chinese, respond in Chinese; if English, respond in English)
+2. ONLY answer based on information found in the provided documents
+3. If the user's question is a greeting (like "hello", "hi", "你好", "嗨"), respond with a friendly greeting in their language and briefly describe what information is available in the documents
+4. If the information is not in the documents, say "I couldn't find specific information about that in the documents" (in the user's language)
+5. Provide clear, concise, and helpful answers
+6. Use a friendly, conversational tone
+7. Format your response nicely - use bullet points or numbered lists when appropriate
+8. Keep responses focused and not too long unless the user asks for detailed information
+
+Remember: You are a helpful AI assistant for documentation. Be professional and supportive."""
+
+# Configure safety settings to be less restrictive for normal Q&A
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
+]
+
+# status: "complete", "partial" (stopped early but produced text), "blocked" (no
+# candidates) or "empty" (stopped early without text); only complete answers are cached
+Answer = namedtuple("Answer", ["text", "status"])
+
+
+def user_prompt(query_text: str) -> str:
+    return f"""Based on the attached documents, please answer the following question.
+Reply in the same language as the question.
+
+User Question: {query_text}
+
+Please provide a helpful and relevant response."""
+
+
+class GenerationProvider(abc.ABC):
+    """Answer generation behind a provider-neutral interface.
+
+    `files` are provider file handles; a cache handle returned by
+    `create_cache` holds those files plus SYSTEM_PROMPT on the provider side,
+    and `generate` with that cache sends only the remaining parts. All
+    methods block and are called through run_blocking/iterate_blocking,
+    except `release_cache`.
+    """
+
+    @abc.abstractmethod
+    def create_cache(self, display_name: str, files: list, ttl_seconds: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def extend_cache(self, cache, ttl_seconds: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_cache(self, cache):
+        """Delete the cache on the provider side and forget it locally"""
+        raise NotImplementedError
+
+    def release_cache(self, cache):
+        """Forget local state for a cache that expired on its own (nothing to delete)"""
+
+    @abc.abstractmethod
+    def generate(self, parts: list, cache=None) -> Answer:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def generate_stream(self, parts: list, cache=None):
+        """Iterator of text chunks; an answer that did not finish normally ends
+        with Answer(None, status) ("partial", "blocked" or "empty")"""
+        raise NotImplementedError
+
+
+class ModelRegistry:
+    """GenerativeModel instances built once: the configured model, and one per context cache"""
+
+    def __init__(self, model_name: str = GENERATION_MODEL):
+        self.model_name = model_name
+        self._default = None
+        self._cached = {}  # cache name -> model bound to it
+
+    def get(self, cache=None):
+        if cache is None:
+            if self._default is None:
+                self._default = genai.GenerativeModel(
+                    self.model_name, safety_settings=SAFETY_SETTINGS, system_instruction=SYSTEM_PROMPT
+                )
+            return self._default
+        model = self._cached.get(cache.name)
+        if model is None:
+            # The system instruction lives in the cache itself
+            model = self._cached[cache.name] = genai.GenerativeModel.from_cached_content(
+                cache, safety_settings=SAFETY_SETTINGS
+            )
+        return model
+
+    def discard(self, cache):
+        self._cached.pop(cache.name, None)
+
+
+class GeminiProvider(GenerationProvider):
+    def __init__(self):
+        self.models = ModelRegistry()
+
+    def create_cache(self, display_name: str, files: list, ttl_seconds: int):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=self.models.model_name,
+            display_name=display_name,
+            system_instruction=SYSTEM_PROMPT,
+            contents=files,
+            ttl=timedelta(seconds=ttl_seconds),
+        )
+
+    def extend_cache(self, cache, ttl_seconds: int):
+        cache.update(ttl=timedelta(seconds=ttl_seconds))
+
+    def delete_cache(self, cache):
+        self.models.discard(cache)
+        cache.delete()
+
+    def release_cache(self, cache):
+        self.models.discard(cache)
+
+    def generate(self, parts: list, cache=None) -> Answer:
+        response = self.models.get(cache).generate_content(parts)
+        # Check if response was blocked or empty
+        if not response.candidates:
+            return Answer(None, "blocked")
+        candidate = response.candidates[0]
+        if candidate.finish_reason and candidate.finish_reason != 1:  # 1 = STOP (normal)
+            if candidate.content and candidate.content.parts:
+                return Answer(candidate.content.parts[0].text, "partial")
+            return Answer(None, "empty")
+        return Answer(response.text, "complete")
+
+    def generate_stream(self, parts: list, cache=None):
+        finish_reason = None
+        produced = False
+        for chunk in self.models.get(cache).generate_content(parts, stream=True):
+            if not chunk.candidates:
+                continue
+            candidate = chunk.candidates[0]
+            finish_reason = candidate.finish_reason or finish_reason
+            if candidate.content and candidate.content.parts and chunk.text:
+                produced = True
+                yield chunk.text
+        if finish_reason is None and not produced:
+            yield Answer(None, "blocked")
+        elif finish_reason and finish_reason != 1:  # 1 = STOP (normal)
+            yield Answer(None, "partial" if produced else "empty")
+        elif not produced:
+            yield Answer(None, "empty")
+
+
+FakeCache = namedtuple("FakeCache", ["name", "display_name", "files"])
+
+
+class FakeProvider(GenerationProvider):
+    """Offline provider for development and tests: no network, deterministic answers.
+
+    Records every call in `calls` so a test can check what a query sent
+    (e.g. that a cached query carries no files).
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.caches = {}
+        self.calls = []
+
+    def create_cache(self, display_name: str, files: list, ttl_seconds: int):
+        cache = FakeCache(f"cachedContents/fake-{next(self._ids)}", display_name, list(files))
+        self.caches[cache.name] = cache
+        self.calls.append(("create_cache", display_name, len(files)))
+        return cache
+
+    def extend_cache(self, cache, ttl_seconds: int):
+        self.calls.append(("extend_cache", cache.name, ttl_seconds))
+
+    def delete_cache(self, cache):
+        self.caches.pop(cache.name, None)
+        self.calls.append(("delete_cache", cache.name))
+
+    def release_cache(self, cache):
+        self.caches.pop(cache.name, None)
+        self.calls.append(("release_cache", cache.name))
+
+    def _answer(self, parts: list, cache) -> str:
+        self.calls.append(("generate", list(parts), cache.name if cache else None))
+        question = parts[-1].split("User Question: ", 1)[-1].split("\n", 1)[0] if parts else ""
+        files = len(cache.files) if cache else len(parts) - 1
+        return f"[Fake answer from {files} context parts] {question}"
+
+    def generate(self, parts: list, cache=None) -> Answer:
+        return Answer(self._answer(parts, cache), "complete")
+
+    def generate_stream(self, parts: list, cache=None):
+        for word in self._answer(parts, cache).split(" "):
+            yield word + " "
+
+
+_PROVIDERS = {
+    "gemini": GeminiProvider,
+    "fake": FakeProvider,
+}
+
+
+def get_generation_provider() -> GenerationProvider:
+    try:
+        return _PROVIDERS[GENERATION_PROVIDER]()
+    except KeyError:
+        raise ValueError(f"Unknown GENERATION_PROVIDER: {GENERATION_PROVIDER}")
+
+
+generation_provider = get_generation_provider()
+
+
+class _CacheEntry:
+    __slots__ = ("key", "cache", "expires_at", "refreshing", "users", "retired")
+
+    def __init__(self, key, cache, expires_at: float):
+        self.key = key              # (content version, file names)
+        self.cache = cache          # None marks a failed creation
+        self.expires_at = expires_at
+        self.refreshing = False
+        self.users = 0              # generations currently using the cache
+        self.retired = False        # superseded; deleted once unused
+
+
+class ContextCacheRegistry:
+    """One provider-side context cache per knowledge base.
+
+    A KB's cache holds its attached document files and the system prompt, so
+    queries send only the question (and any retrieved passages). It is keyed
+    to the KB content version and the file ids it was built from: an upload,
+    delete or re-upload builds a new cache, and the old one is deleted once
+    the generations leasing it have finished. A request still working from
+    an older content version never replaces a newer cache; it queries
+    uncached. A cache in use is extended in the background before its TTL
+    runs out; caches of idle KBs simply expire. Each process keeps its own
+    caches.
+    """
+
+    def __init__(self, provider: GenerationProvider):
+        self.provider = provider
+        self._entries = {}  # kb id -> _CacheEntry
+        self._tasks = set()
+        self.hits = 0
+        self.created = 0
+        self.extended = 0
+        self.failed = 0
+
+    @contextlib.asynccontextmanager
+    async def lease(self, kb_id: int, content_version: int, files: list):
+        """The KB's cache for exactly these files (None to query uncached), creating
+        it if needed; it is not deleted before the block exits."""
+        entry = await self._entry(kb_id, content_version, files)
+        if entry is None or entry.cache is None or entry.retired:
+            yield None
+            return
+        entry.users += 1
+        try:
+            yield entry.cache
+        finally:
+            entry.users -= 1
+            if entry.retired and entry.users == 0:
+                self._drop(entry)
+
+    async def _entry(self, kb_id: int, content_version: int, files: list):
+        if not CONTEXT_CACHE_ENABLED or not files:
+            return None
+        key = (content_version or 0, tuple(sorted(f.name for f in files)))
+        entry = self._entries.get(kb_id)
+        now = time.monotonic()
+        if entry is not None and entry.expires_at > now:
+            if entry.key == key:
+                if entry.cache is not None:
+                    self.hits += 1
+                    if entry.expires_at - now < CONTEXT_CACHE_REFRESH_SECONDS and not entry.refreshing:
+                        entry.refreshing = True
+                        self._spawn(self._extend(entry))
+                return entry
+            if entry.key[0] > key[0]:
+                # Loaded before the KB changed: answer uncached rather than cache a stale set
+                return None
+        return await file_handle_registry.single_flight(
+            ("context_cache", kb_id, key), lambda: self._create(kb_id, key, files)
+        )
+
+    async def _create(self, kb_id: int, key, files: list):
+        self._prune(kb_id)
+        try:
+            cache = await run_blocking(
+                self.provider.create_cache, f"kb-{kb_id}-v{key[0]}", files, CONTEXT_CACHE_TTL_SECONDS
+            )
+        except Exception as e:
+            print(f"Context cache for KB {kb_id} not created, querying uncached: {e}")
+            self.failed += 1
+            entry = _CacheEntry(key, None, time.monotonic() + CONTEXT_CACHE_RETRY_SECONDS)
+        else:
+            self.created += 1
+            entry = _CacheEntry(key, cache, time.monotonic() + CONTEXT_CACHE_TTL_SECONDS)
+        self._replace(kb_id, entry)
+        return entry
+
+    async def _extend(self, entry: _CacheEntry):
+        try:
+            await run_blocking(self.provider.extend_cache, entry.cache, CONTEXT_CACHE_TTL_SECONDS)
+            entry.expires_at = time.monotonic() + CONTEXT_CACHE_TTL_SECONDS
+            self.extended += 1
+        except Exception as e:
+            # Used as is until it expires, then rebuilt
+            print(f"Failed to extend context cache {entry.cache.name}: {e}")
+        finally:
+            entry.refreshing = False
+
+    def _replace(self, kb_id: int, entry: _CacheEntry):
+        old = self._entries.get(kb_id)
+        if old is not None and old.key[0] > entry.key[0]:
+            # A newer document set registered while this one was being created
+            self._retire(entry)
+            return
+        self._entries[kb_id] = entry
+        if old is not None:
+            self._retire(old)
+
+    def _retire(self, entry: _CacheEntry):
+        entry.retired = True
+        if entry.users == 0:
+            # Otherwise the last lease drops it
+            self._drop(entry)
+
+    def _drop(self, entry: _CacheEntry):
+        if entry.cache is None:
+            return
+        if entry.expires_at > time.monotonic():
+            self._spawn(self._delete(entry.cache))
+        else:
+            # Expired caches are already gone on the provider side
+            self.provider.release_cache(entry.cache)
+
+    def _prune(self, keep_kb_id: int):
+        """Forget the expired caches of other KBs that have not been queried since"""
+        now = time.monotonic()
+        for kb_id, entry in list(self._entries.items()):
+            if kb_id != keep_kb_id and entry.expires_at <= now and entry.users == 0:
+                del self._entries[kb_id]
+                self._retire(entry)
+
+    async def _delete(self, cache):
+        try:
+            await run_blocking(self.provider.delete_cache, cache)
+        except Exception as e:
+            print(f"Failed to delete context cache {cache.name}: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CONTEXT_CACHE_ENABLED,
+            "provider": GENERATION_PROVIDER,
+            "model": GENERATION_MODEL,
+            "caches": sum(1 for e in self._entries.values() if e.cache is not None),
+            "hits": self.hits,
+            "created_total": self.created,
+            "extended_total": self.extended,
+            "failed_total": self.failed,
+        }
+
+
+context_cache = ContextCacheRegistry(generation_provider)
@@ -0,0 +1,118 @@
+import os
+import httpx
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+# Retries of failed connection attempts (e.g. a pooled connection the server already closed)
+HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", "1"))
+
+# name -> (base URL, max connections, request timeout seconds); each is
+# overridable with <NAME>_BASE_URL, HTTP_<NAME>_MAX_CONNECTIONS, HTTP_<NAME>_TIMEOUT_SECONDS
+PROVIDERS = {
+    "sendgrid": ("https://api.sendgrid.com", 20, 30),
+    "twilio": ("https://api.twilio.com", 20, 30),
+    "openai": ("https://api.openai.com/v1", 50, 120),
+    "stripe": ("https://api.stripe.com", 10, 30),
+}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ProviderPool:
+    """One provider's pooled AsyncClient, its limits and request counters"""
+
+    def __init__(self, name: str, base_url: str, max_connections: int, timeout: float, http2: bool):
+        self.name = name
+        self.base_url = os.getenv(f"{name.upper()}_BASE_URL", base_url)
+        self.max_connections = int(os.getenv(f"HTTP_{name.upper()}_MAX_CONNECTIONS", str(max_connections)))
+        self.timeout = float(os.getenv(f"HTTP_{name.upper()}_TIMEOUT_SECONDS", str(timeout)))
+        self.http2 = http2
+        self.client = None
+        self.requests = 0
+        self.responses = {}  # status class ("2xx", ...) -> count
+
+    def open(self) -> httpx.AsyncClient:
+        if self.client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+            )
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+                transport=httpx.AsyncHTTPTransport(
+                    limits=limits, http2=self.http2, retries=HTTP_CONNECT_RETRIES
+                ),
+                event_hooks={"request": [self._on_request], "response": [self._on_response]},
+            )
+        return self.client
+
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+
+    async def _on_response(self, response: httpx.Response):
+        status_class = f"{response.status_code // 100}xx"
+        self.responses[status_class] = self.responses.get(status_class, 0) + 1
+
+    def stats(self) -> dict:
+        connections = []
+        if self.client is not None:
+            # httpcore's pool; not public API, so tolerate its absence
+            pool = getattr(self.client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        return {
+            "base_url": self.base_url,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "timeout_seconds": self.timeout,
+            "connections": len(connections),
+            "idle_connections": sum(1 for c in connections if c.is_idle()),
+            "http2_connections": sum(1 for c in connections if "HTTP/2" in repr(c)),
+            "requests_total": self.requests,
+            "responses_total": dict(self.responses),
+        }
+
+
+class HTTPTransport:
+    """Shared keep-alive connection pools for the outbound provider APIs.
+
+    Every provider (SendGrid, Twilio, OpenAI, Stripe) gets one long-lived
+    httpx.AsyncClient with its own connection limit and timeout, so requests
+    reuse warm TLS connections instead of handshaking per call and never
+    block the event loop. Credentials stay with the calling service and are
+    sent per request. HTTP/2 is used when HTTP2_ENABLED is set and the `h2`
+    package is installed.
+    """
+
+    def __init__(self):
+        http2 = HTTP2_ENABLED and _http2_available()
+        if HTTP2_ENABLED and not http2:
+            print("HTTPTransport: HTTP2_ENABLED is set but h2 is not installed, using HTTP/1.1")
+        self.pools = {
+            name: ProviderPool(name, base_url, max_connections, timeout, http2)
+            for name, (base_url, max_connections, timeout) in PROVIDERS.items()
+        }
+
+    def client(self, provider: str) -> httpx.AsyncClient:
+        """The provider's pooled client, created on first use; paths are relative to its base URL"""
+        return self.pools[provider].open()
+
+    async def close(self):
+        for pool in self.pools.values():
+            if pool.client is not None:
+                await pool.client.aclose()
+                pool.client = None
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+http_transport = HTTPTransport()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import OutboundJob
+from .blocking import run_blocking
+from .legacy import email_service, twilio_service
+from .usage_writer import usage_writer
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+# A running job whose worker has not finished it within this long is assumed lost and requeued
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "16"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+JOB_MAINTENANCE_SECONDS = 30
+# Succeeded jobs are deleted after this many days; dead jobs are kept for inspection
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+
+async def _send_email(payload: dict):
+    return await email_service.deliver_email(payload["to_email"], payload["subject"], payload["content"])
+
+
+async def _send_sms(payload: dict):
+    sid, message, retryable = await twilio_service.deliver_sms(payload["to_number"], payload["body"])
+    return bool(sid), sid or message, retryable
+
+
+async def _make_call(payload: dict):
+    sid, message, retryable = await twilio_service.deliver_call(payload["to_number"], payload["url"])
+    return bool(sid), sid or message, retryable
+
+
+# kind -> async handler(payload) returning (success, result or error, retryable)
+HANDLERS = {
+    "email": _send_email,
+    "sms": _send_sms,
+    "call": _make_call,
+}
+
+
+def enqueue(db: Session, kind: str, payload: dict, user_id: Optional[int] = None) -> OutboundJob:
+    """Persist a job for the workers; committed before returning"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = OutboundJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        kind=kind,
+        payload=json.dumps(payload),
+        status="queued",
+        attempts=0,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        run_after=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def retry_delay(attempts: int) -> float:
+    """Jittered exponential backoff after the given number of failed attempts"""
+    return min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS) * random.uniform(0.8, 1.2)
+
+
+def requeue_dead(db: Session, kind: Optional[str] = None) -> int:
+    """Give dead-lettered jobs a fresh set of attempts"""
+    query = db.query(OutboundJob).filter(OutboundJob.status == "dead")
+    if kind:
+        query = query.filter(OutboundJob.kind == kind)
+    count = query.update({
+        OutboundJob.status: "queued",
+        OutboundJob.attempts: 0,
+        OutboundJob.run_after: datetime.utcnow(),
+        OutboundJob.finished_at: None,
+    }, synchronize_session=False)
+    db.commit()
+    return count
+
+
+class JobWorker:
+    """Claims due jobs from the outbound_jobs table and runs them.
+
+    Claiming is a conditional UPDATE (status queued -> running) per job, so
+    any number of workers in any number of processes can share the table
+    without row locks; it works the same on SQLite and MySQL. Failed jobs go
+    back to the queue with exponential backoff until max_attempts, then are
+    dead-lettered (status "dead"). Jobs left running by a worker that died
+    are requeued once their lease expires, or dead-lettered if that was their
+    last attempt (a job that keeps killing its worker is not retried forever).
+    """
+
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._task = None
+        self._last_prune = None
+        self.succeeded = 0
+        self.retried = 0
+        self.dead = 0
+        self.reclaimed = 0
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_forever(self):
+        print(f"Job worker {self.worker_id} started (concurrency {self.concurrency})")
+        running = set()
+        last_maintenance = 0.0
+        try:
+            while True:
+                if time.monotonic() - last_maintenance > JOB_MAINTENANCE_SECONDS:
+                    await run_blocking(self.maintain)
+                    last_maintenance = time.monotonic()
+                free = self.concurrency - len(running)
+                jobs = await run_blocking(self.claim, free) if free else []
+                for job_id, kind, payload in jobs:
+                    running.add(asyncio.ensure_future(self._run(job_id, kind, payload)))
+                if jobs and len(running) < self.concurrency:
+                    # More may be due right away
+                    continue
+                if running:
+                    done, running = await asyncio.wait(
+                        running, timeout=JOB_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if not task.cancelled() and task.exception() is not None:
+                            # Its job stays running until the lease expires
+                            print(f"Job task failed: {task.exception()!r}")
+                else:
+                    await asyncio.sleep(JOB_POLL_SECONDS)
+        finally:
+            # Jobs cut short here are requeued when their lease expires
+            for task in running:
+                task.cancel()
+
+    # -- queue operations (blocking) -------------------------------------
+
+    def claim(self, limit: int):
+        """Take up to `limit` due jobs; returns (id, kind, payload) tuples"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            candidates = db.query(OutboundJob.id).filter(
+                OutboundJob.status == "queued",
+                OutboundJob.run_after <= now
+            ).order_by(OutboundJob.run_after).limit(limit).all()
+            claimed = []
+            for (job_id,) in candidates:
+                taken = db.query(OutboundJob).filter(
+                    OutboundJob.id == job_id,
+                    OutboundJob.status == "queued"
+                ).update({
+                    OutboundJob.status: "running",
+                    OutboundJob.locked_by: self.worker_id,
+                    OutboundJob.locked_at: now,
+                    OutboundJob.attempts: OutboundJob.attempts + 1,
+                }, synchronize_session=False)
+                if taken:
+                    claimed.append(job_id)
+            db.commit()
+            if not claimed:
+                return []
+            rows = db.query(OutboundJob.id, OutboundJob.kind, OutboundJob.payload).filter(
+                OutboundJob.id.in_(claimed)
+            ).all()
+            db.commit()
+            return [(job_id, kind, json.loads(payload)) for job_id, kind, payload in rows]
+        finally:
+            db.close()
+
+    def _finish(self, job_id: str, success: bool, detail: str, retryable: bool):
+        """Record the outcome; (new status, user id, kind), or None if the job is no longer ours"""
+        db = SessionLocal()
+        try:
+            job = db.get(OutboundJob, job_id)
+            if job is None or job.locked_by != self.worker_id:
+                # Lease expired and another worker took it over
+                return None
+            now = datetime.utcnow()
+            job.locked_by = None
+            job.locked_at = None
+            if success:
+                job.status = "succeeded"
+                job.result = (detail or "")[:500]
+                job.finished_at = now
+            elif retryable and job.attempts < job.max_attempts:
+                job.status = "queued"
+                job.last_error = (detail or "")[:1000]
+                job.run_after = now + timedelta(seconds=retry_delay(job.attempts))
+            else:
+                job.status = "dead"
+                job.last_error = (detail or "")[:1000]
+                job.finished_at = now
+            db.commit()
+            return job.status, job.user_id, job.kind
+        finally:
+            db.close()
+
+    def maintain(self):
+        """Requeue (or, on their last attempt, dead-letter) jobs with an expired lease and prune old finished ones"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            exhausted = OutboundJob.attempts >= OutboundJob.max_attempts
+            reclaimed = db.query(OutboundJob).filter(
+                OutboundJob.status == "running",
+                OutboundJob.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)
+            ).update({
+                OutboundJob.status: case((exhausted, "dead"), else_="queued"),
+                OutboundJob.last_error: case(
+                    (exhausted, f"Lease expired on the last attempt ({JOB_LEASE_SECONDS}s)"),
+                    else_=OutboundJob.last_error,
+                ),
+                OutboundJob.finished_at: case((exhausted, now), else_=None),
+                OutboundJob.locked_by: None,
+                OutboundJob.locked_at: None,
+                OutboundJob.run_after: now,
+            }, synchronize_session=False)
+            if reclaimed:
+                self.reclaimed += reclaimed
+                print(f"Reclaimed {reclaimed} jobs with an expired lease")
+            if self._last_prune is None or now - self._last_prune > timedelta(hours=1):
+                self._last_prune = now
+                db.query(OutboundJob).filter(
+                    OutboundJob.status == "succeeded",
+                    OutboundJob.finished_at < now - timedelta(days=JOB_RETENTION_DAYS)
+                ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    # -- running ---------------------------------------------------------
+
+    async def _run(self, job_id: str, kind: str, payload: dict):
+        try:
+            success, detail, retryable = await HANDLERS[kind](payload)
+        except Exception as e:
+            success, detail, retryable = False, f"{type(e).__name__}: {e}", True
+        outcome = await run_blocking(self._finish, job_id, success, detail, retryable)
+        if outcome is None:
+            return
+        status, user_id, kind = outcome
+        if status == "succeeded":
+            self.succeeded += 1
+            await usage_writer.record_usage(user_id, kind, "success", f"job {job_id} {detail or ''}")
+        elif status == "dead":
+            self.dead += 1
+            print(f"Job {job_id} ({kind}) dead-lettered: {detail}")
+            await usage_writer.record_usage(user_id, kind, "failed", f"job {job_id}")
+        else:
+            self.retried += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "succeeded_total": self.succeeded,
+            "retried_total": self.retried,
+            "dead_total": self.dead,
+            "reclaimed_total": self.reclaimed,
+        }
+
+
+job_worker = JobWorker()
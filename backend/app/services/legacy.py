@@ -3,14 +3,15 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from twilio.rest import Client as TwilioClient
-import stripe
-from openai import OpenAI
+import httpx
+from .http_transport import http_transport
 
-# Initialize clients with environment variables
-# In a real app, you would load these from os.environ
+# Provider REST APIs are called directly over the shared connection pools in
+# http_transport (no SDK clients), so every call is async and reuses a warm connection
+
+def _is_transient_status(status: int) -> bool:
+    """Statuses worth retrying: rate limiting and server errors"""
+    return status == 429 or status >= 500
 
 class EmailService:
     def __init__(self):
@@ -18,155 +19,159 @@ class EmailService:
         self.from_email = os.getenv("SENDGRID_FROM_EMAIL", "support@smartbot.co.nz")
         if self.api_key:
             print(f"EmailService: Loaded API Key (starts with {self.api_key[:4]}...)")
-            self.client = SendGridAPIClient(self.api_key)
         else:
             print("EmailService: No API Key found, using Mock mode.")
-            self.client = None
 
-    def send_email(self, to_email: str, subject: str, content: str):
-        if not self.client:
+    async def _post_mail(self, payload: dict) -> httpx.Response:
+        return await http_transport.client("sendgrid").post(
+            "/v3/mail/send",
+            json=payload,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+        )
+
+    async def send_email(self, to_email: str, subject: str, content: str):
+        success, message, _ = await self.deliver_email(to_email, subject, content)
+        return success, message
+
+    async def deliver_email(self, to_email: str, subject: str, content: str):
+        """Like send_email, plus whether a failure is transient (rate limited, 5xx, network) and worth retrying"""
+        if not self.api_key:
             print(f"[Mock] Sending email to {to_email}: {subject}")
-            return True, "Mock email sent successfully"
-        
-        message = Mail(
-            from_email=self.from_email,
-            to_emails=to_email,
-            subject=subject,
-            html_content=content)
+            return True, "Mock email sent successfully", False
+
+        payload = {
+            "personalizations": [{"to": [{"email": to_email}]}],
+            "from": {"email": self.from_email},
+            "subject": subject,
+            "content": [{"type": "text/html", "value": content}],
+        }
         try:
-            response = self.client.send(message)
-            if response.status_code in [200, 201, 202]:
-                return True, "Email sent successfully"
-            else:
-                return False, f"SendGrid returned status {response.status_code}"
-        except Exception as e:
+            response = await self._post_mail(payload)
+        except httpx.HTTPError as e:
             print(f"Error sending email: {e}")
-            error_msg = str(e)
-            if hasattr(e, 'body'):
-                print(f"SendGrid Error Body: {e.body}")
-                try:
-                    # Try to decode bytes to string if needed
-                    body_str = e.body.decode('utf-8') if isinstance(e.body, bytes) else str(e.body)
-                    error_msg = f"{error_msg}: {body_str}"
-                except:
-                    pass
-            
-            # If 401, it might be a bad key or unverified sender
-            if hasattr(e, 'status_code') and e.status_code == 401:
-                print("Tip: Check if your SendGrid API Key is valid and has 'Mail Send' permissions.")
-                error_msg += " (Unauthorized - Check API Key or Credits)"
-            
-            return False, error_msg
+            return False, f"{type(e).__name__}: {e}", True
+        if response.status_code in [200, 201, 202]:
+            return True, "Email sent successfully", False
+        return False, self._describe_error(response), _is_transient_status(response.status_code)
+
+    async def send_personalizations(self, subject: str, content: str, personalizations: list):
+        """One SendGrid request carrying up to 1000 personalizations (recipients).
+
+        Returns (success, message id or error). Each personalization may carry
+        `substitutions`, replaced in the subject and content per recipient.
+        """
+        if not self.api_key:
+            print(f"[Mock] Sending email to {len(personalizations)} recipients: {subject}")
+            return True, "mock_message_id"
+
+        payload = {
+            "personalizations": personalizations,
+            "from": {"email": self.from_email},
+            "subject": subject,
+            "content": [{"type": "text/html", "value": content}],
+        }
+        try:
+            response = await self._post_mail(payload)
+        except httpx.HTTPError as e:
+            print(f"Error sending email: {e}")
+            return False, f"{type(e).__name__}: {e}"
+        if response.status_code in [200, 201, 202]:
+            return True, response.headers.get("X-Message-Id")
+        return False, self._describe_error(response)
+
+    def _describe_error(self, response: httpx.Response) -> str:
+        error_msg = f"SendGrid returned status {response.status_code}"
+        print(f"Error sending email: {error_msg}")
+        if response.text:
+            print(f"SendGrid Error Body: {response.text}")
+            error_msg = f"{error_msg}: {response.text}"
+
+        # If 401, it might be a bad key or unverified sender
+        if response.status_code == 401:
+            print("Tip: Check if your SendGrid API Key is valid and has 'Mail Send' permissions.")
+            error_msg += " (Unauthorized - Check API Key or Credits)"
+
+        return error_msg
 
 class TwilioService:
     def __init__(self):
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN")
         self.from_number = os.getenv("TWILIO_FROM_NUMBER")
-        self.client = TwilioClient(self.account_sid, self.auth_token) if self.account_sid else None
-
-    def send_sms(self, to_number: str, body: str):
-        if not self.client:
-            print(f"[Mock] Sending SMS to {to_number}: {body}")
-            return "mock_sms_sid", "Mock SMS sent successfully"
-
-        try:
-            message = self.client.messages.create(
-                body=body,
-                from_=self.from_number,
-                to=to_number
-            )
-            return message.sid, "SMS sent successfully"
-        except Exception as e:
-            print(f"Error sending SMS: {e}")
-            error_msg = str(e)
-            if "Authenticate" in error_msg or "20003" in error_msg:
-                error_msg += " (Authentication Failed - Check Account SID and Auth Token)"
-            return None, error_msg
-
-    def make_call(self, to_number: str, url: str = "http://demo.twilio.com/docs/voice.xml"):
-        if not self.client:
-            print(f"[Mock] Making call to {to_number} with url {url}")
-            return "mock_call_sid", "Mock call initiated successfully"
 
+    async def _create(self, resource: str, form: dict, action: str):
+        """POST a Messages/Calls resource; (sid, message, retryable)"""
         try:
-            call = self.client.calls.create(
-                from_=self.from_number,
-                to=to_number,
-                url=url
+            response = await http_transport.client("twilio").post(
+                f"/2010-04-01/Accounts/{self.account_sid}/{resource}.json",
+                data={k: v for k, v in form.items() if v is not None},
+                auth=(self.account_sid, self.auth_token or ""),
             )
-            return call.sid, "Call initiated successfully"
-        except Exception as e:
-            print(f"Error making call: {e}")
-            error_msg = str(e)
-            if "Authenticate" in error_msg or "20003" in error_msg:
-                error_msg += " (Authentication Failed - Check Account SID and Auth Token)"
-            return None, error_msg
+        except httpx.HTTPError as e:
+            print(f"Error {action}: {e}")
+            return None, f"{type(e).__name__}: {e}", True
+        if response.status_code in [200, 201]:
+            return response.json()["sid"], None, False
 
-class ChatbotService:
-    def __init__(self):
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        self.assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
-        self.client = OpenAI(api_key=self.api_key) if self.api_key else None
-
-    def create_thread(self):
-        if not self.client:
-            return "mock_thread_id"
         try:
-            thread = self.client.beta.threads.create()
-            return thread.id
-        except Exception as e:
-            print(f"Error creating thread: {e}")
-            return None
+            body = response.json()
+            error_msg = f"HTTP {response.status_code} error: Unable to create record: {body.get('message')} (code {body.get('code')})"
+        except ValueError:
+            error_msg = f"HTTP {response.status_code} error: {response.text[:500]}"
+        print(f"Error {action}: {error_msg}")
+        if response.status_code == 401 or "20003" in error_msg:
+            error_msg += " (Authentication Failed - Check Account SID and Auth Token)"
+        return None, error_msg, _is_transient_status(response.status_code)
+
+    async def send_sms(self, to_number: str, body: str):
+        sid, message, _ = await self.deliver_sms(to_number, body)
+        return sid, message
+
+    async def deliver_sms(self, to_number: str, body: str):
+        """Like send_sms, plus whether a failure is transient (rate limited, 5xx, network) and worth retrying"""
+        if not self.account_sid:
+            print(f"[Mock] Sending SMS to {to_number}: {body}")
+            return "mock_sms_sid", "Mock SMS sent successfully", False
 
-    def send_message(self, thread_id: str, content: str):
-        if not self.client:
-            return f"[Mock AI Response] You said: {content}"
-        
-        try:
-            # Add message to thread
-            self.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=content
-            )
+        sid, error_msg, retryable = await self._create(
+            "Messages", {"Body": body, "From": self.from_number, "To": to_number}, "sending SMS"
+        )
+        return sid, error_msg or "SMS sent successfully", retryable
 
-            # Run assistant
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=self.assistant_id
-            )
+    async def make_call(self, to_number: str, url: str = "http://demo.twilio.com/docs/voice.xml"):
+        sid, message, _ = await self.deliver_call(to_number, url)
+        return sid, message
 
-            # Wait for completion (simplified for demo, ideally use async or webhooks)
-            import time
-            while run.status in ['queued', 'in_progress', 'cancelling']:
-                time.sleep(1)
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-
-            if run.status == 'completed':
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread_id
-                )
-                # Return the latest message from assistant
-                for msg in messages.data:
-                    if msg.role == "assistant":
-                        return msg.content[0].text.value
-            
-            return "I'm thinking..."
-            
-        except Exception as e:
-            print(f"Error in chatbot: {e}")
-            return "Sorry, I encountered an error."
+    async def deliver_call(self, to_number: str, url: str = "http://demo.twilio.com/docs/voice.xml"):
+        """Like make_call, plus whether a failure is transient and worth retrying"""
+        if not self.account_sid:
+            print(f"[Mock] Making call to {to_number} with url {url}")
+            return "mock_call_sid", "Mock call initiated successfully", False
+
+        sid, error_msg, retryable = await self._create(
+            "Calls", {"From": self.from_number, "To": to_number, "Url": url}, "making call"
+        )
+        return sid, error_msg or "Call initiated successfully", retryable
+
+def _stripe_form(value, prefix: str = "") -> dict:
+    """Flatten nested params into Stripe's form encoding: line_items[0][price_data][currency]=usd"""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    form = {}
+    for key, item in items:
+        form.update(_stripe_form(item, f"{prefix}[{key}]" if prefix else str(key)))
+    return form
 
 class PaymentService:
     def __init__(self):
-        stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+        self.api_key = os.getenv("STRIPE_SECRET_KEY")
     
-    def create_checkout_session(self, customer_email: str, success_url: str, cancel_url: str, price_id: str = None, amount: int = None, currency: str = "usd", plan_name: str = None, interval: str = "month"):
-        if not stripe.api_key:
+    async def create_checkout_session(self, customer_email: str, success_url: str, cancel_url: str, price_id: str = None, amount: int = None, currency: str = "usd", plan_name: str = None, interval: str = "month"):
+        if not self.api_key:
             print(f"[Mock] Creating Stripe session for {customer_email}")
             return {"id": "sess_mock_12345", "url": success_url}
 
@@ -210,19 +215,25 @@ class PaymentService:
             else:
                 raise ValueError("Either price_id or amount must be provided")
 
-            checkout_session = stripe.checkout.Session.create(
-                customer_email=customer_email,
-                line_items=[line_item],
-                mode=mode,
-                success_url=success_url,
-                cancel_url=cancel_url,
+            response = await http_transport.client("stripe").post(
+                "/v1/checkout/sessions",
+                data=_stripe_form({
+                    'customer_email': customer_email,
+                    'line_items': [line_item],
+                    'mode': mode,
+                    'success_url': success_url,
+                    'cancel_url': cancel_url,
+                }),
+                auth=(self.api_key, ""),
             )
-            return checkout_session
+            if response.status_code != 200:
+                print(f"Error creating Stripe session: HTTP {response.status_code}: {response.text[:500]}")
+                return None
+            return response.json()
         except Exception as e:
             print(f"Error creating Stripe session: {e}")
             return None
 
 email_service = EmailService()
 twilio_service = TwilioService()
-chatbot_service = ChatbotService()
 payment_service = PaymentService()
@@ -0,0 +1,50 @@
+import base64
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(query, model, response: Response, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """One page of `query` in (created_at, id) order, via keyset rather than OFFSET.
+
+    Reads limit + 1 rows to tell whether another page exists; if so its
+    cursor is returned in the X-Next-Cursor header. Needs an index ending in
+    (created_at, id) after the query's equality filters to stay bounded.
+
+    Without `limit` or `cursor` every row is returned, as before pagination
+    existed, so clients that expect the full list keep getting it.
+    """
+    if limit is None and not cursor:
+        return query.order_by(model.created_at, model.id).all()
+    limit = max(1, min(limit or PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX))
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at > created_at,
+            and_(model.created_at == created_at, model.id > row_id)
+        ))
+    rows = query.order_by(model.created_at, model.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows
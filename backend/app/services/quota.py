@@ -0,0 +1,268 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import FileSearchQuery, QuotaCounter, Subscription, PlanType
+from .blocking import run_blocking
+
+# Search quota per period; users without an active subscription get the free limit
+QUOTA_LIMITS = {
+    None: int(os.getenv("FREE_SEARCH_QUOTA", "100")),
+    PlanType.STANDARD: int(os.getenv("STANDARD_SEARCH_QUOTA", "5000")),
+    PlanType.ENTERPRISE: int(os.getenv("ENTERPRISE_SEARCH_QUOTA", "50000")),
+    PlanType.CUSTOM: int(os.getenv("CUSTOM_SEARCH_QUOTA", "100000")),
+}
+# "lifetime" (one counter per user, previous behaviour) or "monthly"
+QUOTA_PERIOD = os.getenv("QUOTA_PERIOD", "lifetime")
+QUOTA_FLUSH_INTERVAL_SECONDS = float(os.getenv("QUOTA_FLUSH_INTERVAL_SECONDS", "2"))
+# How long a cached plan limit is trusted before Subscription is read again
+QUOTA_PLAN_TTL_SECONDS = int(os.getenv("QUOTA_PLAN_TTL_SECONDS", "60"))
+
+
+def current_period(now: datetime = None) -> str:
+    if QUOTA_PERIOD == "monthly":
+        return (now or datetime.utcnow()).strftime("%Y-%m")
+    return "lifetime"
+
+
+def period_start(period: str):
+    if period == "lifetime":
+        return None
+    return datetime.strptime(period, "%Y-%m")
+
+
+class _Counter:
+    __slots__ = ("used", "pending", "limit", "limit_loaded_at")
+
+    def __init__(self, used: int, limit: int):
+        self.used = used          # last value read from the DB plus local pending
+        self.pending = 0          # increments not yet written back
+        self.limit = limit
+        self.limit_loaded_at = time.monotonic()
+
+
+class QuotaService:
+    """Per-user, per-period search quota backed by `quota_counters`.
+
+    A counter row is seeded once from `file_search_queries` (indexed on
+    user_id, created_at); after that a check never counts history again.
+
+    While the flusher is running, counters are held in-process and increments
+    are written back every QUOTA_FLUSH_INTERVAL_SECONDS with an atomic
+    `used = used + n`, re-reading the total so other processes' usage is
+    picked up. Several API processes may overshoot a limit by at most what
+    they serve within one flush interval. Without the flusher (scripts, tests)
+    each check is a single conditional UPDATE against the row.
+    """
+
+    def __init__(self):
+        self._counters = {}   # (user id, period) -> _Counter
+        self._lock = threading.Lock()
+        self._task = None
+        self.seeds = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(QUOTA_FLUSH_INTERVAL_SECONDS)
+            try:
+                await run_blocking(self.flush)
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"Quota flush failed: {e}")
+
+    @property
+    def write_behind(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # -- limits and seeding ----------------------------------------------
+
+    def get_limit(self, db: Session, user_id: int) -> int:
+        # A user may have several active rows; the newest one decides
+        plan = db.query(Subscription.plan_type).filter(
+            Subscription.user_id == user_id,
+            Subscription.is_active == True
+        ).order_by(Subscription.start_date.desc(), Subscription.id.desc()).limit(1).scalar()
+        return QUOTA_LIMITS.get(plan, QUOTA_LIMITS[None])
+
+    def _load_row(self, db: Session, user_id: int, period: str) -> QuotaCounter:
+        """Return the counter row, creating it from a one-off count of past queries"""
+        row = db.query(QuotaCounter).filter(
+            QuotaCounter.user_id == user_id,
+            QuotaCounter.period == period
+        ).first()
+        if row:
+            return row
+
+        count = db.query(func.count(FileSearchQuery.id)).filter(FileSearchQuery.user_id == user_id)
+        start = period_start(period)
+        if start is not None:
+            count = count.filter(FileSearchQuery.created_at >= start)
+        row = QuotaCounter(user_id=user_id, period=period, used=count.scalar() or 0)
+        db.add(row)
+        try:
+            db.commit()
+            self.seeds += 1
+        except IntegrityError:
+            # Another process seeded it first
+            db.rollback()
+            row = db.query(QuotaCounter).filter(
+                QuotaCounter.user_id == user_id,
+                QuotaCounter.period == period
+            ).first()
+        return row
+
+    def _counter(self, db: Session, user_id: int, period: str) -> _Counter:
+        key = (user_id, period)
+        counter = self._counters.get(key)
+        if counter is None:
+            row = self._load_row(db, user_id, period)
+            limit = self.get_limit(db, user_id)
+            with self._lock:
+                counter = self._counters.setdefault(key, _Counter(row.used or 0, limit))
+        elif time.monotonic() - counter.limit_loaded_at > QUOTA_PLAN_TTL_SECONDS:
+            counter.limit = self.get_limit(db, user_id)
+            counter.limit_loaded_at = time.monotonic()
+        return counter
+
+    # -- public API ------------------------------------------------------
+
+    def consume(self, db: Session, user_id: int) -> int:
+        """Atomically check and take one search from the quota; returns what remains.
+
+        Raises 402 when the quota for the current period is used up.
+        """
+        period = current_period()
+        counter = self._counter(db, user_id, period)
+
+        if not self.write_behind:
+            taken = db.query(QuotaCounter).filter(
+                QuotaCounter.user_id == user_id,
+                QuotaCounter.period == period,
+                QuotaCounter.used < counter.limit
+            ).update({
+                QuotaCounter.used: QuotaCounter.used + 1,
+                QuotaCounter.updated_at: datetime.utcnow(),
+            }, synchronize_session=False)
+            db.commit()
+            with self._lock:
+                counter.used = counter.limit if taken != 1 else counter.used + 1
+            if taken != 1:
+                self._exceeded(counter.limit)
+            return max(0, counter.limit - counter.used)
+
+        with self._lock:
+            if counter.used >= counter.limit:
+                allowed = False
+            else:
+                allowed = True
+                counter.used += 1
+                counter.pending += 1
+        if not allowed:
+            self._exceeded(counter.limit)
+        return counter.limit - counter.used
+
+    def usage(self, db: Session, user_id: int):
+        """(used, limit) for the current period"""
+        counter = self._counter(db, user_id, current_period())
+        return counter.used, counter.limit
+
+    def remaining(self, db: Session, user_id: int) -> int:
+        used, limit = self.usage(db, user_id)
+        return max(0, limit - used)
+
+    def invalidate_plan(self, user_id: int):
+        """Force the next check to re-read the user's plan (after a subscription change)"""
+        for (counter_user, _), counter in list(self._counters.items()):
+            if counter_user == user_id:
+                counter.limit_loaded_at = 0.0
+
+    def _exceeded(self, limit: int):
+        raise HTTPException(
+            status_code=402,
+            detail=f"Search quota exceeded ({limit} calls). Please upgrade your plan."
+        )
+
+    def flush(self):
+        """Write pending increments back and resync each counter with the DB total"""
+        period = current_period()
+        with self._lock:
+            batch = [(key, c, c.pending) for key, c in self._counters.items() if c.pending]
+            for _, counter, delta in batch:
+                counter.pending -= delta
+            # Counters of finished periods are no longer needed once written back
+            for key in [k for k, c in self._counters.items() if k[1] != period and not c.pending]:
+                if all(key != b[0] for b in batch):
+                    del self._counters[key]
+        if not batch:
+            return
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            for (user_id, period), _, delta in batch:
+                db.query(QuotaCounter).filter(
+                    QuotaCounter.user_id == user_id,
+                    QuotaCounter.period == period
+                ).update({
+                    QuotaCounter.used: QuotaCounter.used + delta,
+                    QuotaCounter.updated_at: now,
+                }, synchronize_session=False)
+            db.commit()
+            totals = dict(
+                ((user_id, period), used) for user_id, period, used in db.query(
+                    QuotaCounter.user_id, QuotaCounter.period, QuotaCounter.used
+                ).filter(QuotaCounter.user_id.in_({key[0] for key, _, _ in batch})).all()
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put the increments back so the next flush retries them
+            with self._lock:
+                for _, counter, delta in batch:
+                    counter.pending += delta
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            for key, counter, _ in batch:
+                if key in totals:
+                    counter.used = totals[key] + counter.pending
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        return {
+            "write_behind": self.write_behind,
+            "counters": len(self._counters),
+            "pending_increments": sum(c.pending for c in self._counters.values()),
+            "seeds": self.seeds,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+quota_service = QuotaService()
@@ -0,0 +1,275 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional
+import google.generativeai as genai
+from .blocking import run_blocking
+from .document_content import stored_text
+
+# "files": attach every document to the prompt (previous behaviour)
+# "chunks": send only the best matching passages from text documents
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "chunks")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+# Chunked documents kept in memory (least recently used are re-chunked on demand)
+RETRIEVAL_MAX_DOCUMENTS = int(os.getenv("RETRIEVAL_MAX_DOCUMENTS", "5000"))
+CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP_TOKENS", "40"))
+# Optional dense scoring blended with BM25 (costs one embedding call per chunk at index time)
+EMBEDDING_MODEL = os.getenv("RETRIEVAL_EMBEDDING_MODEL", "")
+EMBEDDING_WEIGHT = float(os.getenv("RETRIEVAL_EMBEDDING_WEIGHT", "0.5"))
+# Passages scoring below this fraction of the best match are dropped (stop-word-only overlaps)
+MIN_RELATIVE_SCORE = float(os.getenv("RETRIEVAL_MIN_RELATIVE_SCORE", "0.25"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TEXT_MIME_TYPES = ("text/", "application/json", "application/xml", "application/x-yaml", "application/csv")
+
+# CJK characters are scored one character per term; everything else by word
+_TERM = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]|\w+", re.UNICODE)
+# Ignored in queries only; passages keep every term so chunk lengths stay comparable
+_STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or our
+please tell that the this to was what when where which who why will with you your
+""".split())
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?。！？])\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TERM.findall(text.casefold())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough model-token estimate used for chunk sizing and the prompt budget"""
+    return max(1, len(tokenize(text)) * 4 // 3)
+
+
+class Chunk:
+    __slots__ = ("document_id", "filename", "ordinal", "text", "tokens", "term_counts", "length", "embedding")
+
+    def __init__(self, document_id: int, filename: str, ordinal: int, text: str):
+        self.document_id = document_id
+        self.filename = filename
+        self.ordinal = ordinal
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        terms = tokenize(text)
+        self.term_counts = Counter(terms)
+        self.length = len(terms)
+        self.embedding = None
+
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Split text into ~chunk_tokens passages on paragraph/sentence boundaries with overlap"""
+    units = []
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= chunk_tokens:
+            units.append(paragraph)
+        else:
+            units.extend(s.strip() for s in _SENTENCE.split(paragraph) if s.strip())
+
+    chunks, current, current_tokens = [], [], 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            # Carry trailing units over so facts spanning a boundary stay retrievable
+            carried, carried_tokens = [], 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if carried_tokens + previous_tokens > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            current, current_tokens = carried, carried_tokens
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def extract_text(doc) -> Optional[str]:
+    """Decode a stored document to text, or None for binary formats (PDF, images...)"""
+    mime_type = doc.mime_type or ""
+    if not mime_type.startswith(TEXT_MIME_TYPES):
+        return None
+    return stored_text(doc)
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks, optionally blended with embedding cosine"""
+
+    def __init__(self, chunks: List[Chunk]):
+        self.chunks = chunks
+        self.document_ids = frozenset(c.document_id for c in chunks)
+        self.postings = {}
+        for i, chunk in enumerate(chunks):
+            for term, tf in chunk.term_counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+        n = len(chunks)
+        self.avg_length = (sum(c.length for c in chunks) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+
+    def bm25_scores(self, query_text: str) -> dict:
+        scores = {}
+        for term in set(tokenize(query_text)) - _STOP_WORDS:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                length_norm = 1 - BM25_B + BM25_B * self.chunks[i].length / (self.avg_length or 1)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+        return scores
+
+    def search(self, query_text: str, top_k: int = RETRIEVAL_TOP_K, token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+               query_embedding: Optional[List[float]] = None) -> List[Chunk]:
+        scores = self.bm25_scores(query_text)
+        if query_embedding is not None:
+            best = max(scores.values(), default=0.0) or 1.0
+            blended = {}
+            for i, chunk in enumerate(self.chunks):
+                dense = _cosine(query_embedding, chunk.embedding) if chunk.embedding else 0.0
+                blended[i] = (1 - EMBEDDING_WEIGHT) * scores.get(i, 0.0) / best + EMBEDDING_WEIGHT * dense
+            scores = blended
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        min_score = ranked[0][1] * MIN_RELATIVE_SCORE if ranked else 0.0
+        selected, used = [], 0
+        for i, score in ranked:
+            if len(selected) >= top_k or score <= 0 or score < min_score:
+                break
+            chunk = self.chunks[i]
+            if used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        # Keep reading order so adjacent passages of one document read naturally
+        return sorted(selected, key=lambda c: (c.document_id, c.ordinal))
+
+    def overview(self, token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[Chunk]:
+        """Opening passage of each document, for questions nothing matches (e.g. greetings)"""
+        selected, used, seen = [], 0, set()
+        for chunk in self.chunks:
+            if chunk.document_id in seen or used + chunk.tokens > token_budget:
+                continue
+            seen.add(chunk.document_id)
+            selected.append(chunk)
+            used += chunk.tokens
+        return selected
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _embed(texts: List[str], task_type: str, batch_size: int = 100) -> List[List[float]]:
+    """Blocking: embed texts with the configured Google AI embedding model"""
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=texts[start:start + batch_size], task_type=task_type)
+        vectors.extend(result["embedding"])
+    return vectors
+
+
+class RetrievalIndexCache:
+    """Per-process chunk store and per-KB BM25 indexes.
+
+    Documents are chunked once (at upload, or lazily from the stored content)
+    and kept by document id. A KB index is rebuilt from those chunks only when the
+    KB `content_version` changes, which is cheap compared to re-chunking. Both
+    are LRUs: at most `max_documents` chunked documents and `max_indexes`
+    indexes are kept.
+    """
+
+    def __init__(self, max_indexes: int = 64, max_documents: int = RETRIEVAL_MAX_DOCUMENTS):
+        self.max_indexes = max_indexes
+        self.max_documents = max_documents
+        self._chunks = OrderedDict()   # document id -> List[Chunk] (empty list: not text)
+        self._indexes = OrderedDict()  # (kb id, content version) -> BM25Index
+        self._lock = threading.Lock()  # _chunks is used from worker threads
+
+    def ingest(self, doc) -> List[Chunk]:
+        """Blocking: chunk a document and remember its passages; returns [] for non-text documents"""
+        text = extract_text(doc)
+        chunks = [] if text is None else [
+            Chunk(doc.id, doc.filename, i, passage) for i, passage in enumerate(chunk_text(text))
+        ]
+        with self._lock:
+            self._chunks[doc.id] = chunks
+            self._chunks.move_to_end(doc.id)
+            while len(self._chunks) > self.max_documents:
+                self._chunks.popitem(last=False)
+        return chunks
+
+    def forget(self, document_id: int):
+        with self._lock:
+            self._chunks.pop(document_id, None)
+
+    def _build(self, docs) -> BM25Index:
+        chunks = []
+        for doc in docs:
+            with self._lock:
+                doc_chunks = self._chunks.get(doc.id)
+                if doc_chunks is not None:
+                    self._chunks.move_to_end(doc.id)
+            if doc_chunks is None:
+                doc_chunks = self.ingest(doc)
+            chunks.extend(doc_chunks)
+        return BM25Index(chunks)
+
+    async def get_index(self, kb, docs) -> BM25Index:
+        key = (kb.id, kb.content_version or 0)
+        index = self._indexes.get(key)
+        if index is None:
+            index = await run_blocking(self._build, docs)
+            if EMBEDDING_MODEL:
+                missing = [c for c in index.chunks if c.embedding is None]
+                if missing:
+                    vectors = await run_blocking(_embed, [c.text for c in missing], "retrieval_document")
+                    for chunk, vector in zip(missing, vectors):
+                        chunk.embedding = vector
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(key)
+        return index
+
+    async def select_passages(self, kb, docs, query_text: str):
+        """(passages, ids of the documents the KB index covers as text)"""
+        index = await self.get_index(kb, docs)
+        if not index.chunks:
+            return [], index.document_ids
+        query_embedding = None
+        if EMBEDDING_MODEL:
+            query_embedding = (await run_blocking(_embed, [query_text], "retrieval_query"))[0]
+        return index.search(query_text, query_embedding=query_embedding) or index.overview(), index.document_ids
+
+    def stats(self) -> dict:
+        return {
+            "mode": RETRIEVAL_MODE,
+            "documents": len(self._chunks),
+            "chunks": sum(len(c) for c in list(self._chunks.values())),
+            "indexes": len(self._indexes),
+        }
+
+
+def format_passages(passages: List[Chunk]) -> str:
+    blocks = [f"[{c.filename} - passage {c.ordinal + 1}]\n{c.text}" for c in passages]
+    return "Relevant document excerpts:\n\n" + "\n\n---\n\n".join(blocks)
+
+
+retrieval_index = RetrievalIndexCache()
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import namedtuple
+from typing import Optional
+from fastapi.responses import StreamingResponse
+from .coalescer import Coalescer
+
+# Comment line sent after this long without an event, so proxies keep the connection open
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Text chunks are merged into one event until it holds this many characters
+# or the first of them has waited this long
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "64"))
+SSE_COALESCE_SECONDS = float(os.getenv("SSE_COALESCE_SECONDS", "0.05"))
+# After a disconnect the upstream keeps running this long for a resume (Last-Event-ID)
+SSE_RESUME_GRACE_SECONDS = float(os.getenv("SSE_RESUME_GRACE_SECONDS", "5"))
+# A finished stream can still be resumed (its tail replayed) for this long
+SSE_RESUME_SECONDS = float(os.getenv("SSE_RESUME_SECONDS", "60"))
+# Items read ahead of the event loop that merges them; the source then waits
+SSE_READ_AHEAD = int(os.getenv("SSE_READ_AHEAD", "64"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"  # Disable nginx buffering
+}
+
+# seq numbers events within a stream; text events carry {"text": ...} and may be merged
+Event = namedtuple("Event", ["seq", "name", "data"])
+
+_END = object()
+
+
+def format_event(data: dict, event_id: str = None, name: str = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if name:
+        lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class SSEEngine:
+    """Runs event sources behind Server-Sent Events responses.
+
+    A source is an async iterator of text chunks (str) and whole events
+    (dict, sent as is; one holding "done" or "error" ends the stream,
+    otherwise {"done": true} is added). Each response:
+
+    - sends an `accepted` event at once, so the first byte does not wait on
+      the upstream, and a comment heartbeat whenever the stream is idle;
+    - merges small text chunks by size or time, and merges everything a
+      slow client has fallen behind on into one event per write, while the
+      server's flow control holds back reads (the source itself runs on
+      regardless for other readers);
+    - numbers events `<stream id>:<seq>`: a request carrying Last-Event-ID
+      of a live or recently finished stream gets the rest of that stream
+      instead of a new one;
+    - cancels the source once the client has disconnected and not resumed
+      within SSE_RESUME_GRACE_SECONDS.
+
+    Sources run in their own task (see Coalescer), so a request being
+    cancelled on disconnect never interrupts them mid-chunk.
+    """
+
+    def __init__(self):
+        self._streams = Coalescer(linger_seconds=SSE_RESUME_GRACE_SECONDS, retain_seconds=SSE_RESUME_SECONDS)
+        self.heartbeats = 0
+        self.resumed = 0
+
+    def response(self, source_factory, owner=None, last_event_id: Optional[str] = None) -> StreamingResponse:
+        """StreamingResponse for `source_factory()`; `owner` scopes which streams a resume may attach to"""
+        return StreamingResponse(
+            self.stream(source_factory, owner, last_event_id),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    async def stream(self, source_factory, owner=None, last_event_id: Optional[str] = None):
+        flight, key, start = None, None, 0
+        if last_event_id and ":" in last_event_id:
+            stream_id, _, seq = last_event_id.partition(":")
+            if seq.isdigit():
+                key = (owner, stream_id)
+                flight = self._streams.join(key)
+                start = int(seq) + 1
+                if flight is not None:
+                    self.resumed += 1
+        if flight is None:
+            stream_id = uuid.uuid4().hex
+            key = (owner, stream_id)
+            flight = self._streams.join(key, lambda: self._events(source_factory(), stream_id))
+            start = 0
+
+        try:
+            index = start
+            while True:
+                wake = flight.changed
+                if index < len(flight.chunks):
+                    # Everything the client has not seen yet goes out in as few writes as possible
+                    pending = flight.chunks[index:]
+                    index += len(pending)
+                    yield self._render(stream_id, pending)
+                    continue
+                if flight.done:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    self.heartbeats += 1
+                    yield ": keep-alive\n\n"
+        finally:
+            self._streams.leave(key, flight)
+
+    def _render(self, stream_id: str, events: list) -> str:
+        out = []
+        text = []
+        for event in events:
+            if event.name is None and "text" in event.data and len(event.data) == 1:
+                text.append((event.seq, event.data["text"]))
+                continue
+            if text:
+                out.append(format_event({"text": "".join(t for _, t in text)}, f"{stream_id}:{text[-1][0]}"))
+                text = []
+            out.append(format_event(event.data, f"{stream_id}:{event.seq}", event.name))
+        if text:
+            out.append(format_event({"text": "".join(t for _, t in text)}, f"{stream_id}:{text[-1][0]}"))
+        return "".join(out)
+
+    async def _events(self, source, stream_id: str):
+        """The stream's events: accepted, coalesced text and whole events, then done or error"""
+        yield Event(0, "accepted", {"stream_id": stream_id})
+        seq = 0
+        queue = asyncio.Queue(maxsize=SSE_READ_AHEAD)
+
+        async def pump():
+            ended = False
+            try:
+                async for item in source:
+                    if ended:
+                        # Nobody reads past the final event; the source is only left to finish
+                        continue
+                    await queue.put(item)
+                    ended = isinstance(item, dict) and ("done" in item or "error" in item)
+                if not ended:
+                    await queue.put(_END)
+            except Exception as e:
+                print(f"SSE source failed: {e}")
+                if not ended:
+                    await queue.put({"error": str(e)})
+
+        loop = asyncio.get_running_loop()
+        pump_task = loop.create_task(pump())
+        get = None
+        pending = []
+        pending_chars = 0
+        deadline = None
+        finished = False
+        try:
+            while True:
+                if get is None:
+                    get = asyncio.ensure_future(queue.get())
+                timeout = max(deadline - loop.time(), 0) if pending else None
+                done, _ = await asyncio.wait({get}, timeout=timeout)
+                item = get.result() if done else None
+                if done:
+                    get = None
+                if isinstance(item, str):
+                    if not item:
+                        continue
+                    if not pending:
+                        deadline = loop.time() + SSE_COALESCE_SECONDS
+                    pending.append(item)
+                    pending_chars += len(item)
+                    if pending_chars < SSE_COALESCE_CHARS:
+                        continue
+                if pending:
+                    seq += 1
+                    yield Event(seq, None, {"text": "".join(pending)})
+                    pending = []
+                    pending_chars = 0
+                if item is _END:
+                    seq += 1
+                    finished = True
+                    yield Event(seq, None, {"done": True})
+                    return
+                if isinstance(item, dict):
+                    seq += 1
+                    yield Event(seq, None, item)
+                    if "done" in item or "error" in item:
+                        # The source may still be wrapping up (e.g. recording usage); let it finish
+                        finished = True
+                        return
+        finally:
+            if get is not None:
+                get.cancel()
+            if not finished:
+                pump_task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            **self._streams.stats(),
+            "heartbeats_total": self.heartbeats,
+            "resumed_total": self.resumed,
+        }
+
+
+sse_engine = SSEEngine()
@@ -0,0 +1,166 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..models import UsageLog, UsageRollup
+
+GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+# Longest time-series one request may ask for
+USAGE_MAX_BUCKETS = 1000
+
+_table = UsageRollup.__table__
+
+
+def _naive_utc(ts: Optional[datetime]) -> Optional[datetime]:
+    # Rows store naive UTC; clients may send offsets
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def count_buckets(rows) -> Counter:
+    """(user_id, granularity, bucket_start, service_type, status) -> count for usage_logs rows"""
+    counts = Counter()
+    for row in rows:
+        if row["user_id"] is None:
+            # Anonymous API calls have no dashboard to show them on
+            continue
+        for granularity in GRANULARITIES:
+            counts[(
+                row["user_id"], granularity, bucket_start(row["created_at"], granularity),
+                row["service_type"], row["status"]
+            )] += 1
+    return counts
+
+
+def _bucket_filter(key):
+    user_id, granularity, start, service_type, status = key
+    return (
+        _table.c.user_id == user_id,
+        _table.c.granularity == granularity,
+        _table.c.bucket_start == start,
+        _table.c.service_type == service_type,
+        _table.c.status == status,
+    )
+
+
+def apply_rollups(db: Session, counts: Counter):
+    """Add counts to their rollup rows, creating missing ones; runs in the caller's transaction"""
+    for key, n in counts.items():
+        increment = update(_table).where(*_bucket_filter(key)).values(count=_table.c.count + n)
+        if db.execute(increment).rowcount:
+            continue
+        user_id, granularity, start, service_type, status = key
+        try:
+            with db.begin_nested():
+                db.execute(insert(_table).values(
+                    user_id=user_id, granularity=granularity, bucket_start=start,
+                    service_type=service_type, status=status, count=n
+                ))
+        except IntegrityError:
+            # Another writer created the bucket first
+            db.execute(increment)
+
+
+def rebuild_rollups(db: Session, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    user_id: Optional[int] = None, batch_size: int = 5000) -> int:
+    """Recompute rollups from usage_logs for whole days in [since, until); returns logs read.
+
+    Buckets in the range are replaced, so run it while no usage is being
+    written to those days (e.g. for days before rollups were deployed).
+    """
+    if since is not None:
+        since = bucket_start(since, "day")
+    if until is not None:
+        until = bucket_start(until, "day")
+    logs = UsageLog.__table__
+
+    stale = delete(_table)
+    if since is not None:
+        stale = stale.where(_table.c.bucket_start >= since)
+    if until is not None:
+        stale = stale.where(_table.c.bucket_start < until)
+    if user_id is not None:
+        stale = stale.where(_table.c.user_id == user_id)
+    db.execute(stale)
+
+    read = 0
+    last_id = 0
+    while True:
+        query = db.query(
+            logs.c.id, logs.c.user_id, logs.c.service_type, logs.c.status, logs.c.created_at
+        ).filter(logs.c.id > last_id, logs.c.created_at.isnot(None))
+        if since is not None:
+            query = query.filter(logs.c.created_at >= since)
+        if until is not None:
+            query = query.filter(logs.c.created_at < until)
+        if user_id is not None:
+            query = query.filter(logs.c.user_id == user_id)
+        rows = query.order_by(logs.c.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        read += len(rows)
+        apply_rollups(db, count_buckets(row._mapping for row in rows))
+    db.commit()
+    return read
+
+
+def usage_series(db: Session, user_id: int, granularity: str, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, service_type: Optional[str] = None) -> dict:
+    """Zero-filled time-series of one user's usage, read only from rollups"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    step = GRANULARITIES[granularity]
+    start, end = _naive_utc(start), _naive_utc(end)
+    end = bucket_start(end or datetime.utcnow(), granularity) + step
+    start = bucket_start(start, granularity) if start else end - step * (24 if granularity == "hour" else 30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / step > USAGE_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {USAGE_MAX_BUCKETS} buckets per request")
+
+    query = db.query(
+        UsageRollup.bucket_start, UsageRollup.service_type, UsageRollup.status, UsageRollup.count
+    ).filter(
+        UsageRollup.user_id == user_id,
+        UsageRollup.granularity == granularity,
+        UsageRollup.bucket_start >= start,
+        UsageRollup.bucket_start < end
+    )
+    if service_type:
+        query = query.filter(UsageRollup.service_type == service_type)
+
+    buckets = {}
+    t = start
+    while t < end:
+        buckets[t] = {"start": t, "total": 0, "by_service": {}}
+        t += step
+    totals = {}
+    for ts, service, status, count in query.all():
+        bucket = buckets.get(ts)
+        if bucket is None:
+            continue
+        bucket["total"] += count
+        statuses = bucket["by_service"].setdefault(service, {})
+        statuses[status] = statuses.get(status, 0) + count
+        totals[service] = totals.get(service, 0) + count
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "totals": totals,
+        "buckets": list(buckets.values()),
+    }
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from ..database import SessionLocal
+from ..models import FileSearchQuery, UsageLog
+from .blocking import run_blocking
+from .usage_rollups import apply_rollups, count_buckets
+
+USAGE_BUFFER_MAX_EVENTS = int(os.getenv("USAGE_BUFFER_MAX_EVENTS", "10000"))
+USAGE_FLUSH_BATCH_SIZE = int(os.getenv("USAGE_FLUSH_BATCH_SIZE", "500"))
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "1"))
+# A batch that keeps failing is retried this many times before it is dropped
+USAGE_FLUSH_RETRIES = 3
+USAGE_POLL_SECONDS = 0.05
+
+_TABLES = {
+    "file_search_queries": FileSearchQuery.__table__,
+    "usage_logs": UsageLog.__table__,
+}
+
+
+class UsageWriter:
+    """In-process buffer of usage rows, bulk-inserted by a background task.
+
+    Request handlers `await record(...)` instead of inserting and committing on
+    the request path. The drain task writes a batch when USAGE_FLUSH_BATCH_SIZE
+    rows are waiting or USAGE_FLUSH_INTERVAL_SECONDS has passed, one
+    executemany INSERT per table. Hourly and daily usage rollups are updated
+    in the same transaction, so the dashboard never reads raw logs and never
+    disagrees with them. The buffer is bounded: when it is full
+    `record` waits for the writer to catch up. Rows carry their own
+    `created_at`, so buffering does not shift timestamps.
+
+    When the task is not running (scripts, tests) rows are written immediately.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._task = None
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.last_flush_seconds = None
+        self.last_error = None
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=USAGE_BUFFER_MAX_EVENTS)
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Flush whatever is still buffered
+        if self._queue is not None:
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            if pending:
+                await self._write_with_retry(pending)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _run_forever(self):
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = time.monotonic() + USAGE_FLUSH_INTERVAL_SECONDS
+                while len(batch) < USAGE_FLUSH_BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        pass
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    # Poll rather than wait_for(queue.get()): before Python 3.12, wait_for
+                    # can swallow a cancellation that races with an item arriving, and
+                    # stop() would then wait forever
+                    await asyncio.sleep(min(timeout, USAGE_POLL_SECONDS))
+            except asyncio.CancelledError:
+                # Shutting down mid-batch: rows already taken off the queue are written here
+                if batch:
+                    await self._write_with_retry(batch)
+                raise
+            # Once started the batch completes (retries included) even if we are cancelled
+            flush = asyncio.ensure_future(self._write_with_retry(batch))
+            try:
+                await asyncio.shield(flush)
+            except asyncio.CancelledError:
+                await flush
+                raise
+
+    # -- recording -------------------------------------------------------
+
+    async def record(self, table: str, **values):
+        values.setdefault("created_at", datetime.utcnow())
+        event = (table, values)
+        if self.running:
+            await self._queue.put(event)
+        else:
+            await self._write_with_retry([event])
+
+    async def record_usage(self, user_id, service_type: str, status: str, details: str = ""):
+        await self.record(
+            "usage_logs",
+            user_id=user_id,
+            service_type=service_type,
+            status=status,
+            details=(details or "")[:500],
+        )
+
+    async def record_search(self, user_id: int, knowledge_base_id: int, query_text: str,
+                            service_type: str, details: str):
+        """The query row (quota seeding, history) plus the generic usage log row"""
+        await self.record(
+            "file_search_queries",
+            user_id=user_id,
+            knowledge_base_id=knowledge_base_id,
+            query_text=query_text[:5000],
+        )
+        await self.record_usage(user_id, service_type, "success", details)
+
+    # -- writing ---------------------------------------------------------
+
+    def _write(self, batch):
+        rows = {}
+        for table, values in batch:
+            rows.setdefault(table, []).append(values)
+        db = SessionLocal()
+        try:
+            for table, values in rows.items():
+                db.execute(_TABLES[table].insert(), values)
+            apply_rollups(db, count_buckets(rows.get("usage_logs", [])))
+            db.commit()
+        finally:
+            db.close()
+
+    async def _write_with_retry(self, batch):
+        """Insert the batch on a worker thread, retrying with backoff before giving up on it"""
+        started = time.monotonic()
+        for attempt in range(USAGE_FLUSH_RETRIES + 1):
+            try:
+                await run_blocking(self._write, batch)
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Usage flush failed (attempt {attempt + 1}): {e}")
+                if attempt == USAGE_FLUSH_RETRIES:
+                    self.dropped += len(batch)
+                    return
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        self.written += len(batch)
+        self.batches += 1
+        self.last_flush_seconds = round(time.monotonic() - started, 4)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "buffered": self._queue.qsize() if self._queue is not None else 0,
+            "capacity": USAGE_BUFFER_MAX_EVENTS,
+            "written_total": self.written,
+            "batches_total": self.batches,
+            "dropped_total": self.dropped,
+            "last_flush_seconds": self.last_flush_seconds,
+            "last_error": self.last_error,
+        }
+
+
+usage_writer = UsageWriter()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from .api_keys import APIKeyPrincipal
+
+WIDGET_CONFIG_MAX_AGE = int(os.getenv("WIDGET_CONFIG_MAX_AGE", "60"))
+WIDGET_CONFIG_STALE_SECONDS = int(os.getenv("WIDGET_CONFIG_STALE_SECONDS", "600"))
+WIDGET_CONFIG_CACHE_SIZE = int(os.getenv("WIDGET_CONFIG_CACHE_SIZE", "10000"))
+DEFAULT_COMPANY_URL = "https://web.smartbot.co.nz"
+# Bump when the payload layout changes so cached copies are revalidated
+BOOTSTRAP_SCHEMA_VERSION = 1
+
+
+class WidgetConfigCache:
+    """Serialized widget bootstrap payloads and their ETags.
+
+    The payload depends only on tenant settings that bump `User.config_version`
+    when they change, so an entry keyed by (key digest, config version) never
+    goes stale and the ETag can be derived from the same pair.
+    """
+
+    def __init__(self, max_entries: int = WIDGET_CONFIG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (key hash, config version) -> (etag, body)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @property
+    def cache_control(self) -> str:
+        return f"public, max-age={WIDGET_CONFIG_MAX_AGE}, stale-while-revalidate={WIDGET_CONFIG_STALE_SECONDS}"
+
+    def get(self, key_hash: str, principal: APIKeyPrincipal):
+        """(etag, JSON body bytes) for the key's current configuration"""
+        cache_key = (key_hash, principal.config_version)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        payload = {
+            "valid": True,
+            "company_name": principal.company_name,
+            "company_url": principal.company_url or DEFAULT_COMPANY_URL,
+            "default_knowledge_base_id": principal.default_knowledge_base_id,
+            "theme": {
+                "primaryColor": "#6366f1", # Default Indigo
+                "position": "bottom-right"
+            },
+            "config_version": principal.config_version,
+        }
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(f"{key_hash}:{principal.config_version}:{BOOTSTRAP_SCHEMA_VERSION}".encode()).hexdigest()
+        entry = (f'"{digest[:32]}"', body)
+        with self._lock:
+            self._entries[cache_key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison as RFC 9110 requires for If-None-Match; CDNs may add W/
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+widget_config_cache = WidgetConfigCache()
@@ -0,0 +1,58 @@
+import json
+import re
+from fastapi import HTTPException
+from .services.file_search import MAX_UPLOAD_BYTES
+
+# Document uploads: POST /api/file-search/knowledge-bases/{kb_id}/documents
+UPLOAD_PATH = re.compile(r"^/api/file-search/knowledge-bases/[^/]+/documents/?$")
+# Multipart framing around the file: boundaries, part headers and the filename
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES} bytes)")
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware enforcing MAX_UPLOAD_BYTES while an upload is still arriving.
+
+    The multipart body is parsed (and spooled) before the route runs, so the
+    handler's own check only fires once the whole upload has been received.
+    Here a Content-Length over the limit is answered 413 before any of the
+    body is read, and a body without one (chunked) is cut off with 413 as
+    soon as it passes the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not UPLOAD_PATH.match(scope["path"]):
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                error = _too_large()
+                body = json.dumps({"detail": error.detail}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": error.status_code,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside body parsing; FastAPI answers it like any HTTPException
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,40 @@
+"""
+Usage Rollup Backfill
+Rebuilds the hourly and daily usage rollups from the raw usage_logs table,
+e.g. for history recorded before rollups existed. Buckets are rebuilt for
+whole UTC days in the range; the API keeps rollups current from then on.
+Run it for days that are no longer receiving usage (by default everything
+before today), or with the API stopped.
+
+Usage:
+    python backfill_usage_rollups.py [--since 2025-01-01] [--until 2025-06-01] [--user-id 42]
+
+Example:
+    python backfill_usage_rollups.py
+"""
+
+import argparse
+from datetime import datetime
+from app.database import SessionLocal
+from app.services.usage_rollups import rebuild_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild usage rollups from usage_logs")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="first day (UTC), default: all history")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="day to stop before (UTC), default: today")
+    parser.add_argument("--user-id", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    until = args.until or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        read = rebuild_rollups(db, since=args.since, until=until, user_id=args.user_id, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"✅ Rebuilt rollups from {read} usage log rows (before {until.date()})")
+
+
+if __name__ == "__main__":
+    main()
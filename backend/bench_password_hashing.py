@@ -0,0 +1,62 @@
+"""
+Password Hashing Benchmark
+Measures login verification throughput with the configured pbkdf2 rounds:
+first inline on one core, then through the password worker pool with
+1..N workers, reporting logins per second and per second per core.
+
+Usage:
+    python bench_password_hashing.py [--logins 200] [--max-workers 4] [--rounds 29000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark password verification throughput")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rounds", type=int, default=None, help="override PASSWORD_PBKDF2_ROUNDS")
+    args = parser.parse_args()
+
+    if args.rounds:
+        os.environ["PASSWORD_PBKDF2_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_MAX_PENDING"] = str(args.logins)
+
+    import app.passwords as passwords
+
+    stored = passwords.pwd_context.hash("correct horse battery staple")
+    print(f"pbkdf2_sha256 rounds: {passwords.PBKDF2_ROUNDS}, cores: {os.cpu_count()}")
+
+    started = time.perf_counter()
+    for _ in range(args.logins):
+        passwords.pwd_context.verify("correct horse battery staple", stored)
+    inline = args.logins / (time.perf_counter() - started)
+    print(f"{'inline':<12}{inline:>10.1f} logins/s")
+
+    for workers in range(1, args.max_workers + 1):
+        passwords.PASSWORD_HASH_WORKERS = workers
+        hasher = passwords.PasswordHasher()
+
+        async def burst():
+            # Warm the pool so process start-up is not measured
+            await asyncio.gather(*(hasher.verify("x", stored) for _ in range(workers)))
+            t = time.perf_counter()
+            results = await asyncio.gather(*(
+                hasher.verify("correct horse battery staple", stored) for _ in range(args.logins)
+            ))
+            assert all(valid for valid, _ in results)
+            return time.perf_counter() - t
+
+        elapsed = asyncio.run(burst())
+        hasher.shutdown()
+        rate = args.logins / elapsed
+        print(f"{f'{workers} workers':<12}{rate:>10.1f} logins/s{rate / workers:>10.1f} per core")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
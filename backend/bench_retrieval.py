@@ -0,0 +1,134 @@
+"""
+Retrieval Benchmark
+Compares the two knowledge-base prompt modes on a synthetic corpus:
+
+  files  - every document is sent to the model (previous behaviour)
+  chunks - only the top-k BM25 passages under the token budget are sent
+
+Offline it reports prompt size, index build time, retrieval latency and
+whether the passage holding the answer was retrieved. With --live (and
+GOOGLE_AI_API_KEY set) it also measures time-to-first-token and total
+generation time against Gemini for both modes.
+
+Usage:
+    python bench_retrieval.py [--docs 50] [--paragraphs 40] [--queries 20] [--live]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from app.services.retrieval import (
+    BM25Index, Chunk, chunk_text, estimate_tokens, format_passages,
+    RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET,
+)
+
+WORDS = (
+    "service account billing report customer support team product update release "
+    "schedule office policy contract delivery warehouse invoice payment integration "
+    "dashboard network security backup storage migration training onboarding survey"
+).split()
+
+
+def build_corpus(num_docs: int, paragraphs: int, rng: random.Random):
+    docs, facts = [], []
+    for d in range(num_docs):
+        body = []
+        for p in range(paragraphs):
+            body.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 80))) + ".")
+        code = f"{rng.randint(1000, 9999)}"
+        site = f"site{d}"
+        body.insert(rng.randrange(len(body)), f"The gate access code for {site} is {code}.")
+        facts.append((d, site, code))
+        docs.append((d, f"doc_{d}.txt", "\n\n".join(body)))
+    return docs, facts
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_offline(docs, facts, queries):
+    started = time.perf_counter()
+    chunks = [Chunk(doc_id, name, i, passage) for doc_id, name, text in docs for i, passage in enumerate(chunk_text(text))]
+    index = BM25Index(chunks)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    full_prompt = "\n\n".join(text for _, _, text in docs)
+    files_tokens = estimate_tokens(full_prompt)
+
+    latencies, prompt_tokens, found = [], [], 0
+    prompts = []
+    for doc_id, site, code in queries:
+        question = f"What is the gate access code for {site}?"
+        t = time.perf_counter()
+        passages = index.search(question)
+        latencies.append((time.perf_counter() - t) * 1000)
+        context = format_passages(passages)
+        prompt_tokens.append(estimate_tokens(context))
+        found += any(code in c.text for c in passages)
+        prompts.append((question, context, code))
+
+    print(f"Corpus: {len(docs)} documents, {len(chunks)} chunks, ~{files_tokens} tokens")
+    print(f"Index build: {build_ms:.1f} ms (top_k={RETRIEVAL_TOP_K}, budget={RETRIEVAL_TOKEN_BUDGET} tokens)")
+    print()
+    print(f"{'mode':<8}{'prompt tokens':>16}{'retrieval p50':>16}{'retrieval p95':>16}{'answer in ctx':>16}")
+    print(f"{'files':<8}{files_tokens:>16}{'-':>16}{'-':>16}{len(queries):>13}/{len(queries)}")
+    print(f"{'chunks':<8}{int(statistics.mean(prompt_tokens)):>16}"
+          f"{percentile(latencies, 0.5):>13.2f} ms{percentile(latencies, 0.95):>13.2f} ms"
+          f"{found:>13}/{len(queries)}")
+    return full_prompt, prompts
+
+
+def run_live(full_prompt, prompts):
+    import google.generativeai as genai
+
+    api_key = os.getenv("GOOGLE_AI_API_KEY")
+    if not api_key:
+        print("\n--live needs GOOGLE_AI_API_KEY")
+        return
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel("gemini-flash-latest")
+
+    def measure(context, question):
+        started = time.perf_counter()
+        first = None
+        text = ""
+        for chunk in model.generate_content([context, f"Answer briefly: {question}"], stream=True):
+            if first is None:
+                first = time.perf_counter() - started
+            text += chunk.text or ""
+        return first or 0.0, time.perf_counter() - started, text
+
+    print(f"\n{'mode':<8}{'TTFT p50':>12}{'total p50':>12}{'correct':>10}")
+    for mode in ("files", "chunks"):
+        ttfts, totals, correct = [], [], 0
+        for question, context, code in prompts:
+            ttft, total, text = measure(full_prompt if mode == "files" else context, question)
+            ttfts.append(ttft)
+            totals.append(total)
+            correct += code in text
+        print(f"{mode:<8}{statistics.median(ttfts):>10.2f} s{statistics.median(totals):>10.2f} s"
+              f"{correct:>7}/{len(prompts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark files vs chunks retrieval modes")
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true", help="also measure TTFT against Gemini")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    docs, facts = build_corpus(args.docs, args.paragraphs, rng)
+    queries = rng.sample(facts, min(args.queries, len(facts)))
+    full_prompt, prompts = run_offline(docs, facts, queries)
+    if args.live:
+        run_live(full_prompt, prompts)
+    sys.exit(0)
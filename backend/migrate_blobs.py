@@ -0,0 +1,72 @@
+"""
+Blob Migration Script
+Moves document bytes stored inline in the documents table (legacy base64
+`file_content`) into the content-addressed blob store, sets
+`content_sha256`, and clears the inline column. Safe to re-run:
+documents already migrated are skipped.
+
+Usage:
+    python migrate_blobs.py [--batch-size 100] [--dry-run]
+"""
+
+import argparse
+import base64
+import binascii
+import hashlib
+from sqlalchemy.orm import undefer_group
+from app.database import SessionLocal
+from app import models
+from app.services.blob_store import blob_store
+from app.services.blob_gc import retain_blob
+
+
+def migrate_blobs(batch_size: int = 100, dry_run: bool = False):
+    db = SessionLocal()
+    migrated = skipped = total_bytes = 0
+    last_id = 0
+    try:
+        while True:
+            docs = db.query(models.Document).options(undefer_group("content")).filter(
+                models.Document.id > last_id,
+                models.Document.file_content.isnot(None)
+            ).order_by(models.Document.id).limit(batch_size).all()
+            if not docs:
+                break
+            last_id = docs[-1].id
+
+            for doc in docs:
+                try:
+                    content = base64.b64decode(doc.file_content)
+                except (binascii.Error, ValueError):
+                    print(f"⚠️  Skipping document {doc.id} ({doc.filename}): invalid base64 content")
+                    skipped += 1
+                    continue
+                migrated += 1
+                total_bytes += len(content)
+                if dry_run:
+                    continue
+                sha256 = hashlib.sha256(content).hexdigest()
+                retain_blob(db, sha256)
+                blob_store.put_bytes(content)
+                doc.content_sha256 = sha256
+                doc.file_content = None
+
+            if not dry_run:
+                # Blobs are written before the commit, so a crash leaves at most unreferenced blobs
+                db.commit()
+            db.expunge_all()
+            print(f"  ... {migrated} documents so far")
+    finally:
+        db.close()
+
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"✅ {action} {migrated} documents ({total_bytes / 1024 / 1024:.1f} MiB), skipped {skipped}")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move inline document content into the blob store")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate_blobs(args.batch_size, args.dry_run)
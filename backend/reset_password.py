@@ -10,11 +10,9 @@ Example:
 """
 
 import sys
-from passlib.context import CryptContext
 from app.database import SessionLocal
 from app import models
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.passwords import pwd_context
 
 def reset_password(email: str, new_password: str):
     db = SessionLocal()
@@ -31,6 +29,8 @@ def reset_password(email: str, new_password: str):
         # Hash the new password
         hashed_password = pwd_context.hash(new_password)
         user.hashed_password = hashed_password
+        # Sign out every session holding a token issued with the old password
+        user.token_version = (user.token_version or 1) + 1
         db.commit()
         
         print(f"✅ Password reset successfully for {email}")
@@ -0,0 +1,57 @@
+"""
+Outbound Job Workers
+Processes queued email, SMS and call jobs from the outbound_jobs table.
+Run as many copies as needed, on any host that can reach the database;
+workers share the queue safely. Set JOB_WORKER_IN_API=false on the API
+servers when running these.
+
+Usage:
+    python run_workers.py [--concurrency 16]
+    python run_workers.py --requeue-dead [--kind sms]
+"""
+
+import argparse
+import asyncio
+from app.database import engine, SessionLocal
+from app.migrations import prepare_database
+from app.services.job_queue import JobWorker, requeue_dead, JOB_WORKER_CONCURRENCY
+from app.services.usage_writer import usage_writer
+from app.services.http_transport import http_transport
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run outbound job workers")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="jobs in flight at once")
+    parser.add_argument("--requeue-dead", action="store_true", help="retry dead-lettered jobs, then exit")
+    parser.add_argument("--kind", default=None, help="with --requeue-dead: only jobs of this kind")
+    args = parser.parse_args()
+
+    prepare_database(engine)
+
+    if args.requeue_dead:
+        db = SessionLocal()
+        try:
+            print(f"✅ Requeued {requeue_dead(db, args.kind)} dead jobs")
+        finally:
+            db.close()
+        return
+
+    worker = JobWorker(concurrency=args.concurrency)
+
+    async def run():
+        # Usage rows for finished jobs are batched here just as in the API
+        usage_writer.start()
+        try:
+            await worker.run_forever()
+        finally:
+            await usage_writer.stop()
+            await http_transport.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Manual check helpers
+Shared by the manual_test_* scripts, which are run as modules from
+backend/ (so `app` is importable) and stop at the first failed check.
+
+Usage:
+    from tests.checks import check, temp_database
+
+    temp_database("jobs")  # before importing anything from app
+    check("job is claimed once", claimed == 1)
+"""
+
+import os
+import sys
+import tempfile
+
+
+def check(label: str, condition: bool):
+    """Print the outcome of one check; exit with status 1 if it failed"""
+    print(f"{'✅' if condition else '❌'} {label}")
+    if not condition:
+        sys.exit(1)
+
+
+def temp_database(name: str) -> str:
+    """Point DATABASE_URL at a throwaway SQLite file; returns its directory"""
+    work_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, name + '.db')}"
+    return work_dir
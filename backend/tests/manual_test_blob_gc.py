@@ -0,0 +1,121 @@
+"""
+Blob Collector Check
+Exercises blob reference counting and the collector against a throwaway
+SQLite database and blob directory: a blob shared by two documents
+survives deleting one of them, an unreferenced blob survives its grace
+period and is then removed, a re-upload during the grace period keeps it,
+and an upload storing the blob while the collector runs wins the race.
+
+Usage (from backend/):
+    python -m tests.manual_test_blob_gc
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from tests.checks import check, temp_database
+
+WORK_DIR = temp_database("blob_gc")
+os.environ["BLOB_STORE_PATH"] = os.path.join(WORK_DIR, "blobs")
+
+from app.database import Base, engine, SessionLocal
+from app import models
+from app.services.blob_store import blob_store
+from app.services.blob_gc import BlobCollector, hold_blob, retain_blob, release_blob
+
+
+def upload(kb_id: int, content: bytes, hold_seconds: float = 0.0) -> int:
+    """What upload_document does: hold the blob, store the file, commit the reference and document"""
+    db = SessionLocal()
+    try:
+        sha256 = hashlib.sha256(content).hexdigest()
+        hold_blob(db, sha256)
+        db.commit()
+        time.sleep(hold_seconds)
+        blob_store.put_bytes(content)
+        retain_blob(db, sha256)
+        doc = models.Document(knowledge_base_id=kb_id, filename="a.txt", content_sha256=sha256, status="active")
+        db.add(doc)
+        db.commit()
+        return doc.id
+    finally:
+        db.close()
+
+
+def delete(doc_id: int):
+    """What delete_document does: drop the row and its reference in one transaction"""
+    db = SessionLocal()
+    try:
+        doc = db.get(models.Document, doc_id)
+        db.delete(doc)
+        release_blob(db, doc.content_sha256)
+        db.commit()
+    finally:
+        db.close()
+
+
+def ref_count(sha256: str):
+    db = SessionLocal()
+    try:
+        row = db.get(models.Blob, sha256)
+        return row.ref_count if row else None
+    finally:
+        db.close()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(email="blob@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    kb = models.KnowledgeBase(user_id=user.id, name="KB")
+    db.add(kb)
+    db.commit()
+    kb_id = kb.id
+    db.close()
+
+    collector = BlobCollector()
+    content = b"shared document bytes"
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    first, second = upload(kb_id, content), upload(kb_id, content)
+    check("identical uploads share one counted blob", ref_count(sha256) == 2 and blob_store.exists(sha256))
+
+    delete(first)
+    collector.collect(grace_seconds=0)
+    check("blob still referenced is kept", ref_count(sha256) == 1 and blob_store.exists(sha256))
+
+    delete(second)
+    collector.collect(grace_seconds=3600)
+    check("unreferenced blob is kept during the grace period", ref_count(sha256) == 0 and blob_store.exists(sha256))
+
+    third = upload(kb_id, content)
+    collector.collect(grace_seconds=0)
+    check("re-upload during the grace period keeps it", ref_count(sha256) == 1 and blob_store.exists(sha256))
+
+    delete(third)
+    time.sleep(1.1)
+    collector.collect(grace_seconds=1)
+    check("unreferenced blob is removed after the grace period", ref_count(sha256) is None and not blob_store.exists(sha256))
+
+    # Race: the blob is collectable, and an upload of the same content holds it
+    # (restarting its grace period) just before the collector gets to it
+    fourth = upload(kb_id, content)
+    delete(fourth)
+    time.sleep(1.1)
+    racer = threading.Thread(target=upload, args=(kb_id, content, 0.5))
+    racer.start()
+    time.sleep(0.1)
+    removed = collector.collect(grace_seconds=1)
+    racer.join()
+    check("collector loses the race to a concurrent upload", removed == 0)
+    check("the uploaded document's blob exists", ref_count(sha256) == 1 and blob_store.exists(sha256))
+
+    print(collector.stats())
+
+
+if __name__ == "__main__":
+    main()
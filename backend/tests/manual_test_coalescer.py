@@ -0,0 +1,151 @@
+"""
+Coalescer Check
+Exercises Coalescer: concurrent callers share one upstream, a late joiner
+gets the chunks produced so far, an error reaches every subscriber, a
+subscriber cancelled mid-stream (a client disconnect) leaves the others
+and the upstream running, the upstream is cancelled once everyone has
+left (after the linger period, unless someone rejoins), and a finished
+flight stays joinable only for retain_seconds.
+No network or database needed.
+
+Usage (from backend/):
+    python -m tests.manual_test_coalescer
+"""
+
+import asyncio
+
+from app.services.coalescer import Coalescer
+from tests.checks import check
+
+
+class Upstream:
+    """Counts how often it is started, and whether a run was cancelled"""
+
+    def __init__(self, chunks=5, delay=0.02, fail=False):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail = fail
+        self.started = 0
+        self.cancelled = 0
+        self.finished = 0
+
+    async def run(self):
+        self.started += 1
+        try:
+            for i in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield f"c{i}"
+            if self.fail:
+                raise RuntimeError("upstream failed")
+            self.finished += 1
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+async def collect(coalescer, key, upstream, limit=None):
+    out = []
+    stream = coalescer.stream(key, upstream.run)
+    try:
+        async for chunk in stream:
+            out.append(chunk)
+            if limit is not None and len(out) == limit:
+                break
+    finally:
+        # What the server does with a response body the client stopped reading
+        await stream.aclose()
+    return out
+
+
+async def main():
+    expected = [f"c{i}" for i in range(5)]
+
+    coalescer = Coalescer()
+    upstream = Upstream()
+    results = await asyncio.gather(*(collect(coalescer, "q", upstream) for _ in range(4)))
+    check("concurrent callers share one upstream", upstream.started == 1 and coalescer.joined == 3)
+    check("every caller gets every chunk", all(r == expected for r in results))
+    check("a finished key is free again", coalescer.stats()["inflight"] == 0 and coalescer.stats()["retained"] == 0)
+    await collect(coalescer, "q", upstream)
+    check("a later call starts a new upstream", upstream.started == 2)
+
+    # Late joiner
+    upstream = Upstream()
+    first = asyncio.ensure_future(collect(coalescer, "late", upstream))
+    await asyncio.sleep(0.07)
+    late = await collect(coalescer, "late", upstream)
+    check("a late joiner replays the chunks produced so far", late == expected and await first == expected)
+    check("the late joiner did not start its own upstream", upstream.started == 1)
+
+    # Errors
+    upstream = Upstream(fail=True)
+
+    async def failing():
+        try:
+            await collect(coalescer, "fail", upstream)
+        except RuntimeError as e:
+            return str(e)
+
+    errors = await asyncio.gather(failing(), failing())
+    check("an upstream error reaches every subscriber", errors == ["upstream failed"] * 2)
+
+    # One subscriber cancelled mid-stream
+    upstream = Upstream()
+    leaving = asyncio.ensure_future(collect(coalescer, "cancel", upstream))
+    staying = asyncio.ensure_future(collect(coalescer, "cancel", upstream))
+    await asyncio.sleep(0.05)
+    leaving.cancel()
+    await asyncio.gather(leaving, return_exceptions=True)
+    check("a cancelled subscriber leaves the others streaming", await staying == expected)
+    check("and the upstream runs to completion", upstream.finished == 1 and upstream.cancelled == 0)
+
+    # Everyone leaves, no linger
+    upstream = Upstream()
+    partial = await asyncio.gather(collect(coalescer, "gone", upstream, 1), collect(coalescer, "gone", upstream, 2))
+    await asyncio.sleep(0)
+    check("subscribers that stop early got what they read", partial == [["c0"], ["c0", "c1"]])
+    check("the upstream is cancelled once everyone has left", upstream.cancelled == 1 and coalescer.abandoned == 1)
+    check("an abandoned key is free again", coalescer.join("gone") is None)
+
+    # Linger: a subscriber coming back within it keeps the upstream
+    coalescer = Coalescer(linger_seconds=0.1)
+    upstream = Upstream()
+    check("a partial read stops early", await collect(coalescer, "linger", upstream, 1) == ["c0"])
+    await asyncio.sleep(0.05)
+    flight = coalescer.join("linger")
+    check("a subscriber can rejoin within the linger period", flight is not None)
+    resumed = []
+    try:
+        async for chunk in flight.subscribe(start=1):
+            resumed.append(chunk)
+    finally:
+        coalescer.leave("linger", flight)
+    check("the rejoined subscriber reads on from where it left", resumed == expected[1:])
+    check("a rejoin cancels the pending abandon", upstream.cancelled == 0 and coalescer.abandoned == 0)
+
+    upstream = Upstream(delay=0.05)
+    await collect(coalescer, "linger2", upstream, 1)
+    check("the upstream keeps running during the linger period", upstream.cancelled == 0)
+    await asyncio.sleep(0.15)
+    check("the upstream is cancelled after the linger period", upstream.cancelled == 1 and coalescer.abandoned == 1)
+    check("the abandoned key is free again", coalescer.join("linger2") is None)
+
+    # Retain: a finished flight can be joined (and replayed) for a while
+    coalescer = Coalescer(retain_seconds=0.1)
+    upstream = Upstream(delay=0)
+    await collect(coalescer, "kept", upstream)
+    flight = coalescer.join("kept")
+    check("a finished flight is retained", flight is not None and coalescer.stats()["retained"] == 1)
+    replay = [chunk async for chunk in flight.subscribe(start=3)]
+    coalescer.leave("kept", flight)
+    check("a retained flight replays from any position", replay == expected[3:])
+    await collect(coalescer, "kept", upstream)
+    check("joining a retained flight does not restart the upstream", upstream.started == 1)
+    await asyncio.sleep(0.15)
+    check("a retained flight is released after retain_seconds", coalescer.join("kept") is None)
+
+    print(coalescer.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
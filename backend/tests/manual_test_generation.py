@@ -0,0 +1,81 @@
+"""
+Context Cache Check
+Exercises the per-KB context cache against the offline fake provider: one
+cache per KB content version, reused by later queries (which then carry no
+files), rebuilt when the documents change with the old one deleted once no
+generation leases it, never replaced by a request from an older version,
+extended before its TTL runs out, and forgotten once it has expired.
+No network or API key needed.
+
+Usage (from backend/):
+    python -m tests.manual_test_generation
+"""
+
+import asyncio
+import os
+from collections import namedtuple
+
+os.environ["GENERATION_PROVIDER"] = "fake"
+
+from app.services import generation
+from app.services.generation import FakeProvider, ContextCacheRegistry, user_prompt
+from tests.checks import check
+
+File = namedtuple("File", ["name"])
+
+
+async def get(caches: ContextCacheRegistry, kb_id: int, version: int, files: list):
+    async with caches.lease(kb_id, version, files) as cache:
+        return cache
+
+
+async def main():
+    provider = FakeProvider()
+    caches = ContextCacheRegistry(provider)
+    files = [File("files/a"), File("files/b")]
+
+    first = await get(caches, 1, 1, files)
+    check("cache created for KB 1", first is not None and caches.created == 1)
+    again = await asyncio.gather(*(get(caches, 1, 1, list(reversed(files))) for _ in range(5)))
+    check("same version reuses the cache", all(c is first for c in again) and caches.created == 1)
+
+    answer = provider.generate([user_prompt("What are the opening hours?")], first)
+    _, parts, cache_name = provider.calls[-1]
+    check("cached query sends only the question", len(parts) == 1 and cache_name == first.name)
+    check("fake answer echoes the question", answer.status == "complete" and "opening hours" in answer.text)
+
+    async with caches.lease(1, 1, files) as in_flight:
+        second = await get(caches, 1, 2, files + [File("files/c")])
+        await asyncio.sleep(0.05)
+        check("new content version builds a new cache", second is not first and caches.created == 2)
+        check("superseded cache survives while a generation uses it", in_flight.name in provider.caches)
+    await asyncio.sleep(0.05)
+    check("superseded cache is deleted once released", first.name not in provider.caches)
+
+    stale = await get(caches, 1, 1, files)
+    check("an older content version does not replace the newer cache", stale is None and caches.created == 2)
+    check("the newer cache is still served", await get(caches, 1, 2, files + [File("files/c")]) is second)
+
+    check("no files means no cache", await get(caches, 2, 1, []) is None)
+
+    generation.CONTEXT_CACHE_REFRESH_SECONDS = generation.CONTEXT_CACHE_TTL_SECONDS + 1
+    await get(caches, 1, 2, files + [File("files/c")])
+    await asyncio.sleep(0.05)
+    check("cache near its TTL is extended", caches.extended == 1 and provider.calls[-1][0] == "extend_cache")
+
+    # Expiry: an expired cache is released (not deleted) when replaced, and an
+    # idle KB's expired cache is forgotten when another KB builds one
+    third = await get(caches, 3, 1, files)
+    caches._entries[1].expires_at = caches._entries[3].expires_at = 0
+    fourth = await get(caches, 1, 2, files + [File("files/c")])
+    check("an expired cache is rebuilt", fourth is not second and caches.created == 4)
+    check("the expired cache is released, not deleted", ("release_cache", second.name) in provider.calls
+          and ("delete_cache", second.name) not in provider.calls)
+    check("an idle KB's expired cache is forgotten", 3 not in caches._entries
+          and ("release_cache", third.name) in provider.calls)
+
+    print(caches.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
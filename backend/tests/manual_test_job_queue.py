@@ -0,0 +1,187 @@
+"""
+Job Queue Check
+Exercises the outbound job queue against a throwaway SQLite database with
+stub handlers (no provider calls): two workers claiming at the same time
+never take the same job, a failed job is retried with backoff and then
+dead-lettered, requeue_dead revives it, and a job whose lease expired is
+reclaimed by another worker while the original worker's late result is
+discarded, unless that was its last attempt and it is dead-lettered.
+
+Usage (from backend/):
+    python -m tests.manual_test_job_queue
+"""
+
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from tests.checks import check, temp_database
+
+temp_database("job_queue")
+os.environ["JOB_MAX_ATTEMPTS"] = "3"
+os.environ["JOB_RETRY_BASE_SECONDS"] = "60"
+os.environ["JOB_LEASE_SECONDS"] = "1"
+
+from app.database import Base, engine, SessionLocal
+from app import models
+from app.services import job_queue
+from app.services.job_queue import JobWorker, enqueue, requeue_dead
+
+
+async def succeed(payload):
+    return True, f"sent {payload['n']}", False
+
+
+async def fail(payload):
+    return False, "provider unavailable", True
+
+
+async def reject(payload):
+    return False, "invalid number", False
+
+
+async def crash(payload):
+    raise ConnectionError("connection reset")
+
+
+def job(job_id: str) -> models.OutboundJob:
+    db = SessionLocal()
+    try:
+        return db.get(models.OutboundJob, job_id)
+    finally:
+        db.close()
+
+
+def make_due(job_id: str):
+    """Skip the backoff wait"""
+    db = SessionLocal()
+    try:
+        db.query(models.OutboundJob).filter(models.OutboundJob.id == job_id).update(
+            {models.OutboundJob.run_after: datetime.utcnow() - timedelta(seconds=1)}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def add_jobs(kind: str, count: int) -> list:
+    db = SessionLocal()
+    try:
+        return [enqueue(db, kind, {"n": n}).id for n in range(count)]
+    finally:
+        db.close()
+
+
+def claim_race(workers, limit):
+    """Every worker claims at the same moment; returns the ids each one got"""
+    barrier = threading.Barrier(len(workers))
+    claimed = [None] * len(workers)
+
+    def claim(i):
+        barrier.wait()
+        claimed[i] = [job_id for job_id, _, _ in workers[i].claim(limit)]
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claimed
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    job_queue.HANDLERS.update({"ok": succeed, "flaky": fail, "bad": reject, "crash": crash})
+    first, second = JobWorker(concurrency=4), JobWorker(concurrency=4)
+
+    # Claim race
+    ids = add_jobs("ok", 40)
+    a, b = claim_race([first, second], 40)
+    check("concurrent claims never take the same job", not set(a) & set(b))
+    check("every due job is claimed exactly once", sorted(a + b) == sorted(ids))
+    check("claimed jobs are running with one attempt", all(
+        job(i).status == "running" and job(i).attempts == 1 for i in ids
+    ))
+    check("a job is locked by the worker that claimed it", all(
+        job(i).locked_by == first.worker_id for i in a
+    ) and all(job(i).locked_by == second.worker_id for i in b))
+    for job_id in a:
+        asyncio.run(first._run(job_id, "ok", {"n": 0}))
+    for job_id in b:
+        asyncio.run(second._run(job_id, "ok", {"n": 0}))
+    check("finished jobs succeed", all(job(i).status == "succeeded" for i in ids))
+    check("nothing left to claim", first.claim(10) == [])
+
+    # Retry with backoff, then dead-letter
+    (flaky,) = add_jobs("flaky", 1)
+    first.claim(1)
+    asyncio.run(first._run(flaky, "flaky", {}))
+    retried = job(flaky)
+    check("a retryable failure is requeued", retried.status == "queued" and retried.attempts == 1)
+    check("the retry waits out its backoff", retried.run_after > datetime.utcnow() + timedelta(seconds=30))
+    check("a job in backoff is not claimed", first.claim(1) == [])
+    for _ in range(2):
+        make_due(flaky)
+        first.claim(1)
+        asyncio.run(first._run(flaky, "flaky", {}))
+    dead = job(flaky)
+    check("dead-lettered after max_attempts", dead.status == "dead" and dead.attempts == 3)
+    check("the last error is kept", dead.last_error == "provider unavailable")
+
+    (bad,) = add_jobs("bad", 1)
+    first.claim(1)
+    asyncio.run(first._run(bad, "bad", {}))
+    check("a permanent failure is dead-lettered at once", job(bad).status == "dead" and job(bad).attempts == 1)
+
+    (crashed,) = add_jobs("crash", 1)
+    first.claim(1)
+    asyncio.run(first._run(crashed, "crash", {}))
+    check("a handler exception is retried", job(crashed).status == "queued"
+          and job(crashed).last_error.startswith("ConnectionError"))
+
+    db = SessionLocal()
+    revived = requeue_dead(db, kind="flaky")
+    db.close()
+    check("requeue_dead revives only the requested kind", revived == 1 and job(bad).status == "dead")
+    check("a revived job gets a fresh set of attempts", job(flaky).status == "queued" and job(flaky).attempts == 0)
+    check("a revived job is due right away", [i for i, _, _ in first.claim(1)] == [flaky])
+    asyncio.run(first._run(flaky, "ok", {"n": 0}))
+
+    # Lease expiry: the first worker claims a job and goes quiet
+    db = SessionLocal()
+    db.query(models.OutboundJob).filter(models.OutboundJob.status == "queued").delete()
+    db.commit()
+    db.close()
+    (slow,) = add_jobs("ok", 1)
+    first.claim(1)
+    second.maintain()
+    check("a job within its lease is left alone", job(slow).status == "running" and second.reclaimed == 0)
+    time.sleep(1.1)
+    second.maintain()
+    check("a job past its lease is requeued", job(slow).status == "queued" and second.reclaimed == 1)
+    check("another worker reclaims it", [i for i, _, _ in second.claim(1)] == [slow])
+    check("the retry counts as an attempt", job(slow).attempts == 2 and job(slow).locked_by == second.worker_id)
+    check("the original worker's late result is discarded", first._finish(slow, True, "late", False) is None)
+    check("the job is still the new worker's", job(slow).status == "running")
+    asyncio.run(second._run(slow, "ok", {"n": 1}))
+    check("the new worker finishes it", job(slow).status == "succeeded" and job(slow).result == "sent 1")
+
+    # A job that keeps outliving its lease (say it crashes its worker) runs out of attempts
+    (poison,) = add_jobs("ok", 1)
+    for _ in range(3):
+        first.claim(1)
+        time.sleep(1.1)
+        second.maintain()
+    poisoned = job(poison)
+    check("a lease expiring on the last attempt dead-letters the job", poisoned.status == "dead"
+          and poisoned.attempts == 3 and poisoned.last_error.startswith("Lease expired"))
+    check("the dead job is not claimed again", first.claim(1) == [])
+
+    print(first.stats())
+    print(second.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Query Budget Check
+Runs the list endpoints in-process against a throwaway SQLite database
+seeded with several knowledge bases and documents, and fails if any of them
+issues more SQL statements than its budget. Budgets do not grow with the
+number of rows, so an N+1 regression fails here.
+
+Usage (from backend/):
+    python -m tests.manual_test_query_budget
+"""
+
+import os
+import sys
+import tempfile
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "query_budget.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import engine, SessionLocal
+from app import models
+from tests.query_budget import query_budget
+
+KNOWLEDGE_BASES = 5
+DOCUMENTS_PER_KB = 4
+
+# Endpoint -> max statements: authentication (at most one, on a principal
+# cache miss) plus the endpoint's own queries
+BUDGETS = {
+    "/users/me": 3,
+    "/users/me/api-keys": 2,
+    "/api/file-search/knowledge-bases": 3,
+    "/api/file-search/knowledge-bases?include_documents=false": 2,
+    "/api/file-search/knowledge-bases/1/documents": 3,
+}
+
+
+def seed(user_id: int):
+    db = SessionLocal()
+    try:
+        db.add(models.APIKey(key="query-budget-extra", key_hash="0" * 64, user_id=user_id, label="Extra"))
+        db.add(models.Subscription(user_id=user_id, plan_type=models.PlanType.STANDARD))
+        for i in range(KNOWLEDGE_BASES):
+            kb = models.KnowledgeBase(user_id=user_id, name=f"KB {i}", description="")
+            db.add(kb)
+            db.flush()
+            for j in range(DOCUMENTS_PER_KB):
+                db.add(models.Document(
+                    knowledge_base_id=kb.id, filename=f"doc{j}.txt", google_file_id=f"files/{i}-{j}",
+                    file_size=10, mime_type="text/plain", status="active", file_content="eA=="
+                ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_query_budgets():
+    client = TestClient(app)
+    resp = client.post("/users/", json={"email": "budget@example.com", "password": "pw", "company_name": "Budget"})
+    assert resp.status_code == 200, resp.text
+    seed(resp.json()["id"])
+    token = client.post("/users/login", json={"email": "budget@example.com", "password": "pw"}).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    failures = 0
+    for path, budget in BUDGETS.items():
+        try:
+            with query_budget(engine, budget, f"GET {path}") as counter:
+                resp = client.get(path, headers=headers)
+            assert resp.status_code == 200, resp.text
+            print(f"✅ GET {path}: {counter.count} statements (budget {budget})")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {e}")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    ok = test_query_budgets()
+    os.remove(DB_PATH)
+    sys.exit(0 if ok else 1)
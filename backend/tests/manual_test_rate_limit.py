@@ -0,0 +1,178 @@
+"""
+Rate Limiter Check
+Exercises the rate limiter with a fake clock: token bucket refill and
+Retry-After, the sliding window's weighted carry-over between windows, a
+request denied by one rule not consuming the others, plan multipliers for
+per-key limits, the LRU bound on tracked keys, and the middleware's 429
+and client IP handling. No network or database needed.
+
+Usage (from backend/):
+    python -m tests.manual_test_rate_limit
+"""
+
+import asyncio
+import time
+
+from app import rate_limit
+from app.models import PlanType
+from app.rate_limit import MemoryRateLimitBackend, RateLimiter, RateLimitMiddleware, Rule
+from app.services.api_keys import APIKeyPrincipal, api_key_resolver, hash_api_key
+from tests.checks import check
+
+
+def close(a: float, b: float) -> bool:
+    return abs(a - b) < 1e-6
+
+
+def burst(limiter, rules, count, key_hash=None, ip="10.0.0.1", now=0.0):
+    """How many of `count` requests at the same instant are allowed, and the last decision"""
+    allowed, decision = 0, None
+    for _ in range(count):
+        decision = limiter.check("test", rules, key_hash, ip, now=now)
+        allowed += decision.allowed
+    return allowed, decision
+
+
+def cache_principal(key: str, plan):
+    """As if the key had been resolved by an earlier request in this process"""
+    principal = APIKeyPrincipal(1, "Acme", "https://acme.test", 1, [], plan)
+    api_key_resolver._principals[hash_api_key(key)] = (time.monotonic() + 60, principal)
+
+
+def check_token_bucket():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rules = [Rule("test", "key", "token_bucket", 10, 10.0)]
+    key = hash_api_key("bucket-key")
+
+    allowed, decision = burst(limiter, rules, 11, key)
+    check("token bucket allows a burst of its capacity", allowed == 10 and not decision.allowed)
+    check("token bucket Retry-After is the time to one token", close(decision.retry_after, 1.0))
+    decision = limiter.check("test", rules, key, "", now=0.5)
+    check("a request before the token refills is denied", not decision.allowed and close(decision.retry_after, 0.5))
+    decision = limiter.check("test", rules, key, "", now=1.0)
+    check("a refilled token is spent", decision.allowed and decision.remaining == 0)
+    decision = limiter.check("test", rules, key, "", now=1000.0)
+    check("refill stops at capacity", decision.allowed and decision.remaining == 9)
+    check("requests without a key skip per-key rules", limiter.check("test", rules, None, "10.0.0.1", now=0.0) is None)
+
+
+def check_sliding_window():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rules = [Rule("test", "ip", "sliding_window", 10, 60.0)]
+
+    allowed, decision = burst(limiter, rules, 11, now=600.0)
+    check("sliding window allows its limit per window", allowed == 10 and not decision.allowed)
+    # At 660 the full previous window still counts; it has decayed enough for one more at 666
+    check("sliding window Retry-After covers the carried-over count", close(decision.retry_after, 66.0))
+    check("the previous window still counts early in the next", not limiter.check("test", rules, None, "10.0.0.1", now=665.9).allowed)
+    check("a request is allowed once the previous window has decayed", limiter.check("test", rules, None, "10.0.0.1", now=666.0).allowed)
+    allowed, _ = burst(limiter, rules, 10, now=690.0)
+    # 10 * (1 - 30/60) + 1 already used at 690: room for 4 more
+    check("the previous window is weighted by its overlap", allowed == 4)
+    allowed, _ = burst(limiter, rules, 11, now=900.0)
+    check("an idle gap of two windows carries nothing over", allowed == 10)
+    check("a different IP has its own window", limiter.check("test", rules, None, "10.0.0.2", now=600.0).allowed)
+
+
+def check_all_rules():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rules = [
+        Rule("test", "key", "token_bucket", 5, 60.0),
+        Rule("test", "ip", "sliding_window", 3, 60.0),
+    ]
+    key = hash_api_key("two-rule-key")
+
+    allowed, decision = burst(limiter, rules, 4, key, ip="10.0.0.1")
+    check("the per-IP rule denies the fourth request", allowed == 3 and not decision.allowed)
+    check("the denial reports the rule that denied it", decision.limit == 3)
+    allowed, decision = burst(limiter, rules, 3, key, ip="10.0.0.2")
+    check("a denied request consumed none of the key's tokens", allowed == 2 and decision.limit == 5)
+
+    rules = [Rule("test", "route", "sliding_window", 2, 60.0)]
+    allowed, _ = burst(limiter, rules, 1, ip="10.0.0.3")
+    allowed += burst(limiter, rules, 2, ip="10.0.0.4")[0]
+    check("a per-route rule is shared by every caller", allowed == 2)
+
+
+def check_plans():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    rules = [Rule("test", "key", "token_bucket", 5, 60.0)]
+    multiplier = rate_limit.RATE_LIMIT_PLAN_MULTIPLIERS[PlanType.STANDARD]
+
+    cache_principal("standard-key", PlanType.STANDARD)
+    allowed, _ = burst(limiter, rules, 100, hash_api_key("standard-key"))
+    check("per-key limits scale with the plan", allowed == int(5 * multiplier))
+    allowed, _ = burst(limiter, rules, 100, hash_api_key("unresolved-key"))
+    check("a key not resolved yet gets the free plan's limit", allowed == 5)
+
+
+def check_lru():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    limiter = RateLimiter(backend)
+    rules = [Rule("test", "ip", "sliding_window", 1, 60.0)]
+    for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+        limiter.check("test", rules, None, ip, now=0.0)
+    check("tracked keys are bounded", len(backend) == 2)
+
+
+async def call(middleware, path, headers=(), client=("10.0.0.9", 1234)):
+    """Run one request through the middleware; (status, headers, reached the app)"""
+    reached = []
+    sent = []
+
+    async def app(scope, receive, send):
+        reached.append(scope)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": list(headers), "client": client}
+    await RateLimitMiddleware(app, middleware)(scope, receive, send)
+    start = sent[0]
+    return start["status"], dict(start["headers"]), bool(reached)
+
+
+async def check_middleware():
+    limiter = RateLimiter(MemoryRateLimitBackend())
+    limiter.rules = {"test": (("/limited",), [Rule("test", "ip", "sliding_window", 2, 60.0)])}
+
+    status, headers, reached = await call(limiter, "/open")
+    check("unlimited routes pass untouched", status == 200 and reached and b"x-ratelimit-limit" not in headers)
+    status, headers, _ = await call(limiter, "/limited")
+    check("limited routes carry X-RateLimit headers", status == 200 and headers[b"x-ratelimit-remaining"] == b"1")
+    await call(limiter, "/limited")
+    status, headers, reached = await call(limiter, "/limited")
+    check("an exhausted rule answers 429 without reaching the app", status == 429 and not reached)
+    check("429 carries Retry-After", int(headers[b"retry-after"]) >= 1)
+
+    forwarded = [(b"x-forwarded-for", b"203.0.113.7, 10.0.0.1")]
+    status, _, _ = await call(limiter, "/limited", forwarded)
+    check("without trusted proxies X-Forwarded-For is ignored", status == 429)
+    rate_limit.RATE_LIMIT_TRUSTED_PROXIES = 1
+    try:
+        status, _, _ = await call(limiter, "/limited", forwarded)
+        check("with one trusted proxy the client is the last hop", status == 200)
+        status, _, _ = await call(limiter, "/limited", [(b"x-forwarded-for", b"198.51.100.1, 10.0.0.1")])
+        check("a spoofed first hop does not get a fresh limit", status == 200 and limiter.check(
+            "test", limiter.rules["test"][1], None, "10.0.0.1"
+        ).allowed is False)
+    finally:
+        rate_limit.RATE_LIMIT_TRUSTED_PROXIES = 0
+
+
+def main():
+    check_token_bucket()
+    check_sliding_window()
+    check_all_rules()
+    check_plans()
+    check_lru()
+    asyncio.run(check_middleware())
+
+
+if __name__ == "__main__":
+    main()
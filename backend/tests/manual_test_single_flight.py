@@ -0,0 +1,61 @@
+"""
+Single-Flight Check
+Exercises FileHandleRegistry.single_flight: concurrent callers share one
+call, a failure reaches every caller, and a caller cancelled mid-flight
+(a client disconnect) neither cancels the others nor the shared work.
+No network or database needed.
+
+Usage (from backend/):
+    python -m tests.manual_test_single_flight
+"""
+
+import asyncio
+
+from app.services.file_registry import FileHandleRegistry
+from tests.checks import check
+
+
+async def main():
+    registry = FileHandleRegistry()
+    calls = []
+
+    async def lookup(value, delay=0.05, fail=False):
+        calls.append(value)
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("lookup failed")
+        return value
+
+    results = await asyncio.gather(*(registry.single_flight("a", lambda: lookup("a")) for _ in range(5)))
+    check("concurrent callers share one call", results == ["a"] * 5 and calls == ["a"])
+    check("finished flight is released", registry.stats()["inflight"] == 0)
+
+    calls.clear()
+    results = await asyncio.gather(
+        *(registry.single_flight("b", lambda: lookup("b", fail=True)) for _ in range(3)),
+        return_exceptions=True,
+    )
+    check("failure reaches every caller", calls == ["b"] and all(isinstance(r, RuntimeError) for r in results))
+
+    calls.clear()
+    leader = asyncio.ensure_future(registry.single_flight("c", lambda: lookup("c", delay=0.2)))
+    await asyncio.sleep(0.01)
+    joiners = [asyncio.ensure_future(registry.single_flight("c", lambda: lookup("c"))) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    results = await asyncio.gather(*joiners, return_exceptions=True)
+    check("leader is cancelled", leader.cancelled())
+    check("joiners still get the result", results == ["c"] * 3 and calls == ["c"])
+
+    calls.clear()
+    only = asyncio.ensure_future(registry.single_flight("d", lambda: lookup("d", delay=0.1)))
+    await asyncio.sleep(0.01)
+    only.cancel()
+    late = await registry.single_flight("d", lambda: lookup("d"))
+    check("a caller arriving after a cancellation joins the running call", late == "d" and calls == ["d"])
+
+    print(registry.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,171 @@
+"""
+SSE Engine Check
+Exercises SSEEngine.stream with short timings: the accepted event comes
+first, small text chunks are merged by size and by time, idle streams get
+heartbeats, errors end the stream with an error event, the source is not
+read far ahead of the events being merged, a client that
+reconnects with Last-Event-ID gets exactly the events it missed (while the
+source runs and shortly after it finished, and only for the same owner),
+and a source is cancelled once its client has gone and not come back.
+No network or database needed.
+
+Usage (from backend/):
+    python -m tests.manual_test_sse
+"""
+
+import asyncio
+import json
+import os
+
+os.environ["SSE_HEARTBEAT_SECONDS"] = "0.1"
+os.environ["SSE_COALESCE_CHARS"] = "10"
+os.environ["SSE_COALESCE_SECONDS"] = "0.05"
+os.environ["SSE_RESUME_GRACE_SECONDS"] = "0.2"
+os.environ["SSE_RESUME_SECONDS"] = "0.3"
+os.environ["SSE_READ_AHEAD"] = "4"
+
+from app.services.sse import SSEEngine
+from tests.checks import check
+
+
+def parse(body: str):
+    """(events as (id, name, data), heartbeat count) from an SSE body"""
+    events, heartbeats = [], 0
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        if block.startswith(":"):
+            heartbeats += 1
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("id"), fields.get("event"), json.loads(fields["data"])))
+    return events, heartbeats
+
+
+def text_of(events) -> str:
+    return "".join(data.get("text", "") for _, _, data in events)
+
+
+class Source:
+    """Yields text chunks (with a pause before each) and records how its run ended"""
+
+    def __init__(self, chunks, delay=0.0, fail=False):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail = fail
+        self.outcome = None
+        self.runs = 0
+
+    async def run(self):
+        self.runs += 1
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield chunk
+            if self.fail:
+                raise RuntimeError("model unavailable")
+            self.outcome = "finished"
+        except asyncio.CancelledError:
+            self.outcome = "cancelled"
+            raise
+
+
+async def read(engine, source_factory, owner=None, last_event_id=None, events=None):
+    """Read a response body, stopping (as a disconnecting client would) after `events` events"""
+    stream = engine.stream(source_factory, owner, last_event_id)
+    body = ""
+    try:
+        async for part in stream:
+            body += part
+            if events is not None and len(parse(body)[0]) >= events:
+                break
+    finally:
+        await stream.aclose()
+    return parse(body)
+
+
+async def main():
+    engine = SSEEngine()
+
+    source = Source(["ab"] * 12)
+    events, _ = await read(engine, source.run)
+    check("the accepted event comes first", events[0][1] == "accepted" and "stream_id" in events[0][2])
+    check("the stream ends with done", events[-1][2] == {"done": True})
+    check("text arrives complete", text_of(events) == "ab" * 12)
+    check("small chunks are merged by size", len(events) - 2 < 12)
+    seqs = [int(event_id.split(":")[1]) for event_id, _, _ in events]
+    check("event ids are increasing", seqs == sorted(seqs) and len(set(seqs)) == len(seqs))
+
+    source = Source(["slow", "er"], delay=0.25)
+    events, heartbeats = await read(engine, source.run)
+    check("a pending chunk goes out after the coalesce delay", [d.get("text") for _, _, d in events[1:3]] == ["slow", "er"])
+    check("an idle stream gets heartbeats", heartbeats >= 2)
+
+    async def whole_events():
+        yield "hi"
+        yield {"sources": ["a.txt"]}
+        yield {"done": True, "usage": 3}
+        yield "never sent"
+
+    events, _ = await read(engine, whole_events)
+    check("dict events are sent as is and end the stream on done", [d for _, _, d in events[1:]] == [
+        {"text": "hi"}, {"sources": ["a.txt"]}, {"done": True, "usage": 3}
+    ])
+
+    source = Source(["partial"], fail=True)
+    events, _ = await read(engine, source.run)
+    check("a source error ends the stream with an error event", events[-1][2] == {"error": "model unavailable"})
+
+    read_ahead = 0
+
+    async def counted():
+        nonlocal read_ahead
+        for i in range(100):
+            read_ahead += 1
+            yield {"n": i}
+
+    events = engine._events(counted(), "held")
+    await events.__anext__()
+    await events.__anext__()
+    await asyncio.sleep(0.05)
+    check("a source is read only a bounded distance ahead", read_ahead <= 4 + 2)
+    await events.aclose()
+
+    # Resume while the source runs
+    full = [f"w{i:02d} " for i in range(20)]
+    source = Source(full, delay=0.02)
+    first, _ = await read(engine, source.run, owner="u1", events=3)
+    last_id = first[-1][0]
+    await asyncio.sleep(0.05)
+    rest, _ = await read(engine, source.run, owner="u1", last_event_id=last_id)
+    check("a resume continues the same stream", rest[0][0].split(":")[0] == last_id.split(":")[0])
+    check("a resume gets exactly the events missed", text_of(first) + text_of(rest) == "".join(full))
+    check("a resume does not restart the source", source.runs == 1 and source.outcome == "finished" and engine.resumed == 1)
+
+    # Resume of a finished stream, then after it has expired
+    source = Source(["abcdefghij", "klmnopqrst"], delay=0.01)
+    first, _ = await read(engine, source.run, owner="u1", events=2)
+    await asyncio.sleep(0.05)
+    tail, _ = await read(engine, source.run, owner="u1", last_event_id=first[-1][0])
+    check("a finished stream can still be resumed", text_of(first) + text_of(tail) == "abcdefghijklmnopqrst")
+    other, _ = await read(engine, source.run, owner="u2", last_event_id=first[-1][0])
+    check("another owner cannot resume it", other[0][1] == "accepted" and other[0][0] != first[0][0])
+    await asyncio.sleep(0.35)
+    expired, _ = await read(engine, source.run, owner="u1", last_event_id=first[-1][0])
+    check("an expired stream starts over", expired[0][1] == "accepted" and expired[0][0] != first[0][0])
+    garbage, _ = await read(engine, source.run, owner="u1", last_event_id="not-an-id")
+    check("a malformed Last-Event-ID starts a new stream", garbage[0][1] == "accepted")
+
+    # Disconnect without coming back
+    source = Source(["x"] * 50, delay=0.02)
+    await read(engine, source.run, events=2)
+    await asyncio.sleep(0.1)
+    check("the source keeps running during the resume grace period", source.outcome is None)
+    await asyncio.sleep(0.2)
+    check("the source is cancelled once the client has not come back", source.outcome == "cancelled")
+
+    print(engine.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+"""
+Query budget helpers
+Count the SQL statements an endpoint issues and fail when it exceeds its
+budget, so N+1 loads and lazy relationship access are caught as soon as
+they are introduced.
+
+Usage:
+    from tests.query_budget import query_budget
+
+    with query_budget(engine, 3, "GET /users/me"):
+        client.get("/users/me", headers=headers)
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    """Record every statement executed on `engine` while the block runs"""
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._record)
+
+
+@contextmanager
+def query_budget(engine, max_queries: int, label: str = ""):
+    """Fail with the offending statements if the block runs more than `max_queries`"""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > max_queries:
+        statements = "\n".join(f"  {i + 1}. {s.strip()[:200]}" for i, s in enumerate(counter.statements))
+        raise AssertionError(
+            f"{label or 'block'} ran {counter.count} SQL statements (budget {max_queries}):\n{statements}"
+        )
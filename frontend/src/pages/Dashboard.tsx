@@ -1085,9 +1085,23 @@ const Dashboard = () => {
     navigate('/');
   };
 
-  // Mock Data for Charts
-  const usageData = [350, 420, 300, 550, 680, 720, 650];
-  const maxUsage = Math.max(...usageData);
+  // Daily API calls for the last 7 days, from the usage rollups
+  const [usageData, setUsageData] = useState<number[]>([0, 0, 0, 0, 0, 0, 0]);
+  const maxUsage = Math.max(1, ...usageData);
+
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token) return;
+    const start = new Date(Date.now() - 6 * 24 * 60 * 60 * 1000).toISOString();
+    fetch(`${API_BASE_URL}/users/me/usage?granularity=day&start=${encodeURIComponent(start)}`, {
+      headers: { 'Authorization': `Bearer ${token}` }
+    })
+      .then(res => (res.ok ? res.json() : null))
+      .then(series => {
+        if (series) setUsageData(series.buckets.map((b: { total: number }) => b.total));
+      })
+      .catch(error => console.error('Failed to fetch usage:', error));
+  }, []);
 
   const renderContent = () => {
     switch (activeTab) {
@@ -519,7 +519,8 @@ class APIVerseWidget {
 
     private async fetchCompanyInfo() {
         try {
-            const response = await fetch(`${this.config.apiUrl}/config/${this.config.apiKey}`);
+            // Cacheable (ETag + Cache-Control); the browser revalidates with If-None-Match
+            const response = await fetch(`${this.config.apiUrl}/bootstrap/${this.config.apiKey}`);
             if (response.ok) {
                 const data = await response.json();
                 if (data.company_name) {